@@ -1,13 +1,14 @@
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework import routers
-from main_app import views
+from main_app import async_views, metrics, views
 
 router = routers.DefaultRouter()
 router.register(r'users', views.UserViewSet)
 router.register(r'groups', views.GroupViewSet)
 router.register(r'games', views.GameViewSet)
 router.register(r'reviews', views.ReviewViewSet)
+router.register(r'genres', views.GenreFacetViewSet)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -19,8 +20,18 @@ urlpatterns = [
     path('games/<int:game_id>/edit', views.EditGameAPIView.as_view()),
     path('api/login', views.LoginAndTokenView.as_view()),
     path('api/logout', views.LogoutView.as_view()),
+    path('api/token/refresh', views.RefreshTokenView.as_view()),
     path('get-csrf-token/', views.csrf_token_view),
-    path('rev-user/<int:user_id>', views.UserForReviewView.as_view())
+    path('rev-user/<int:user_id>', views.UserForReviewView.as_view()),
+    path('search/', views.SearchView.as_view()),
+    path('export/<slug:kind>.<slug:extension>', views.ExportView.as_view()),
+    path('internal/db-pool', views.DatabasePoolStatsView.as_view()),
+    path('metrics', metrics.metrics_view),
+    # async copies of the read endpoints, only worth it when served over ASGI (async_views.py)
+    path('async/games/', async_views.game_list),
+    path('async/games/<int:pk>/', async_views.game_detail),
+    path('async/reviews/', async_views.review_list),
+    path('async/users/<int:pk>/', async_views.user_profile),
 ]
 
 #some of these paths ended up not being used as I understood better how to use the viewsets
@@ -0,0 +1,27 @@
+import os
+
+# SERVER_MODE=wsgi (default) runs the usual sync workers. SERVER_MODE=asgi runs uvicorn workers on
+# backend.asgi, where the async views (main_app/async_views.py) can wait on postgres without holding
+# a process, and the regular DRF views still work through django's sync_to_async
+mode = os.environ.get('SERVER_MODE', 'wsgi')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+# not cpu_count() based: every worker has its own connection pool, WEB_CONCURRENCY x DB_POOL_MAX_SIZE has to fit in
+# postgres' max_connections (with the run_worker processes) and memory grows the same way. raise it knowingly
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+
+if mode == 'asgi':
+    wsgi_app = 'backend.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'backend.wsgi:application'
+    worker_class = 'sync'
+
+
+def child_exit(server, worker):
+    # prometheus multiprocess mode (main_app/metrics.py): drop a dead worker's live gauges
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,145 @@
+from django.db import connection, transaction
+from django.db.models import Count, F, Func, Max, Q, Subquery, Sum
+from django.utils import timezone
+
+from .models import Game, GameStats, GenreFacet, Review, UserStats
+
+
+def compute_game_stats(game_ids):
+    # aggregate the reviews. the game-stats job, rebuild_game_stats and its --verify all count this way
+    stats = {game_id: GameStats(game_id=game_id) for game_id in game_ids}
+    rows = (
+        Review.objects.filter(game_id__in=game_ids)
+        .values('game_id')
+        .annotate(
+            review_count=Count('id'),
+            score_sum=Sum('score'),
+            last_review_date=Max('date_submitted'),
+            **{field: Count('id', filter=Q(score=score)) for score, field in GameStats.SCORE_FIELDS.items()},
+        )
+    )
+    for row in rows:
+        game_stats = stats[row.pop('game_id')]
+        for field, value in row.items():
+            setattr(game_stats, field, value)
+        game_stats.average_score = game_stats.score_sum / game_stats.review_count
+    return stats
+
+
+def rebuild_game_stats(game_ids):
+    # recount and save, FOR UPDATE on the old rows so two recounts of a game take turns
+    game_ids = list(Game.objects.filter(id__in=game_ids).values_list('id', flat=True))
+    old = GameStats.objects.select_for_update().in_bulk(game_ids)
+    stats = compute_game_stats(game_ids)
+    for game_id, game_stats in stats.items(): # the genre totals were built from the old numbers
+        before = old.get(game_id, GameStats())
+        if game_stats.review_count != before.review_count or game_stats.score_sum != before.score_sum:
+            move_genre_totals(game_id, game_stats.review_count - before.review_count, game_stats.score_sum - before.score_sum)
+    GameStats.objects.bulk_create(
+        stats.values(),
+        update_conflicts=True,
+        unique_fields=['game'],
+        update_fields=['review_count', 'score_sum', 'average_score', 'last_review_date', *GameStats.SCORE_FIELDS.values()],
+    )
+    return stats
+
+
+# GENRE FACETS
+
+def move_genre_totals(game_id, count, total):
+    # a recount changed one game's totals, every genre it has moves by the same amount.
+    # the genres are read inside the UPDATE, no round trip to fetch them first
+    game_genres = Game.objects.filter(id=game_id).annotate(genre=Func(F('genres'), function='unnest')).values('genre')
+    GenreFacet.objects.filter(genre__in=Subquery(game_genres)).update(
+        review_count=F('review_count') + count,
+        score_sum=F('score_sum') + total,
+    )
+
+
+def add_game_to_genres(game_id, genres, sign=1):
+    # a game joining (sign=1) or leaving (sign=-1) some genres takes its review totals with it.
+    # FOR UPDATE on the stats row lines this up with recounts of the game, which lock that row first
+    if not genres:
+        return
+    stats = GameStats.objects.select_for_update().filter(game_id=game_id).first() or GameStats()
+    if sign > 0:
+        GenreFacet.objects.bulk_create([GenreFacet(genre=genre) for genre in genres], ignore_conflicts=True)
+    GenreFacet.objects.filter(genre__in=genres).update(
+        game_count=F('game_count') + sign,
+        review_count=F('review_count') + sign * stats.review_count,
+        score_sum=F('score_sum') + sign * stats.score_sum,
+    )
+
+
+def rebuild_genre_facets():
+    # from scratch, one pass over games joined to their stats. for the command and bulk imports
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('LOCK TABLE main_app_genrefacet IN EXCLUSIVE MODE')
+        cursor.execute('DELETE FROM main_app_genrefacet')
+        cursor.execute("""
+            INSERT INTO main_app_genrefacet (genre, game_count, review_count, score_sum)
+            SELECT genre, COUNT(*), COALESCE(SUM(s.review_count), 0), COALESCE(SUM(s.score_sum), 0)
+            FROM (SELECT DISTINCT id, unnest(genres) AS genre FROM main_app_game) g
+            LEFT JOIN main_app_gamestats s ON s.game_id = g.id
+            GROUP BY genre
+        """)
+
+
+# USER STATS
+
+# one statement for any number of users, {users} is the filter on the user ids. last_active_at is only moved
+# forward, to the newest review's date for users that have none yet, touch_users() keeps it to the second
+USER_STATS_SQL = """
+    INSERT INTO main_app_userstats (user_id, review_count, score_sum, score_1, score_2, score_3, score_4, score_5,
+                                    average_score, games_added, favourite_genres, last_active_at)
+    SELECT u.id, COALESCE(r.review_count, 0), COALESCE(r.score_sum, 0), COALESCE(r.score_1, 0), COALESCE(r.score_2, 0),
+           COALESCE(r.score_3, 0), COALESCE(r.score_4, 0), COALESCE(r.score_5, 0),
+           r.score_sum::float8 / NULLIF(r.review_count, 0), COALESCE(g.games_added, 0), COALESCE(f.genres, '{{}}'),
+           r.last_review_date::timestamptz
+    FROM auth_user u
+    LEFT JOIN (
+        SELECT user_id, COUNT(*) AS review_count, SUM(score) AS score_sum,
+               COUNT(*) FILTER (WHERE score = 1) AS score_1, COUNT(*) FILTER (WHERE score = 2) AS score_2,
+               COUNT(*) FILTER (WHERE score = 3) AS score_3, COUNT(*) FILTER (WHERE score = 4) AS score_4,
+               COUNT(*) FILTER (WHERE score = 5) AS score_5, MAX(date_submitted) AS last_review_date
+        FROM main_app_review WHERE {users} GROUP BY user_id
+    ) r ON r.user_id = u.id
+    LEFT JOIN (SELECT user_id, COUNT(*) AS games_added FROM main_app_game WHERE {users} GROUP BY user_id) g ON g.user_id = u.id
+    LEFT JOIN (
+        SELECT user_id, (array_agg(genre ORDER BY liked DESC, genre))[1:%(favourites)s] AS genres
+        FROM (
+            SELECT r.user_id, genre, COUNT(*) AS liked
+            FROM main_app_review r JOIN main_app_game game ON game.id = r.game_id, unnest(game.genres) AS genre
+            WHERE r.score >= 4 AND {reviewers}
+            GROUP BY r.user_id, genre
+        ) liked_genres
+        GROUP BY user_id
+    ) f ON f.user_id = u.id
+    WHERE {accounts}
+    ORDER BY u.id -- the same lock order as touch_users()
+    ON CONFLICT (user_id) DO UPDATE SET
+        review_count = excluded.review_count, score_sum = excluded.score_sum, score_1 = excluded.score_1,
+        score_2 = excluded.score_2, score_3 = excluded.score_3, score_4 = excluded.score_4, score_5 = excluded.score_5,
+        average_score = excluded.average_score, games_added = excluded.games_added, favourite_genres = excluded.favourite_genres,
+        last_active_at = GREATEST(main_app_userstats.last_active_at, excluded.last_active_at)
+"""
+
+
+def rebuild_user_stats(user_ids=None):
+    # recount these users, or every user, from their reviews and games. for the jobs and rebuild_user_stats.
+    # a game's genre change only reaches its reviewers' favourite genres here
+    if user_ids is None:
+        filters = {'users': 'TRUE', 'reviewers': 'TRUE', 'accounts': 'TRUE'}
+    else:
+        filters = {'users': 'user_id = ANY(%(users)s)', 'reviewers': 'r.user_id = ANY(%(users)s)', 'accounts': 'u.id = ANY(%(users)s)'}
+    with connection.cursor() as cursor:
+        cursor.execute(USER_STATS_SQL.format(**filters), {'users': list(user_ids or []), 'favourites': UserStats.FAVOURITE_GENRES})
+        return cursor.rowcount
+
+
+def touch_users(user_ids): # they just saved a review or a game. the job that recounts them can lag, this can't
+    now = timezone.now()
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=user_id, last_active_at=now) for user_id in sorted(user_ids)], # sorted, same lock order as other batches
+        update_conflicts=True, unique_fields=['user'], update_fields=['last_active_at'],
+    )
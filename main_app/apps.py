@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class MainAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main_app'
+
+    def ready(self):
+        from . import signals # noqa: F401 registers the receivers
+        from django.conf import settings
+        if settings.METRICS_ENABLED:
+            from .metrics import start_metrics
+            start_metrics()
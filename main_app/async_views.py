@@ -0,0 +1,94 @@
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.urls import reverse
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.request import Request
+
+from .authentication import RevocableJWTAuthentication
+from .fast_serializers import game_rows, review_rows, serialize_games, serialize_reviews, serialize_reviews_with_reviewer
+from .filters import filter_games, filter_reviews
+from .models import Game, Review
+from .pagination import GamePagination, ReviewPagination
+from .renderers import FastJSONRenderer
+from .serializers import GameSerializer, UserSerializer, user_stats_data
+
+# async versions of the hot read endpoints, for when the app is served over ASGI (SERVER_MODE=asgi, see
+# gunicorn.conf.py). same queries and the same JSON as the viewsets, but a request waiting on postgres
+# doesn't hold a worker. DRF views are sync only, so these are plain django async views doing the auth,
+# paging and rendering by hand. bearer JWTs only, no session or basic auth, and no response cache.
+# everything a serializer touches is fetched up front, a lazy query in here would raise SynchronousOnlyOperation
+authenticator = RevocableJWTAuthentication()
+renderer = FastJSONRenderer()
+
+
+def async_api_view(view):
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return render({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+        request = Request(request) # query_params and build_absolute_uri for the paginators and serializers
+        try:
+            authenticated = await authenticator.aauthenticate(request)
+            if authenticated is None:
+                response = render({'detail': 'Authentication credentials were not provided.'}, status=401)
+                response['WWW-Authenticate'] = authenticator.authenticate_header(request)
+                return response
+            request.user, request.auth = authenticated
+            data = await view(request, *args, **kwargs)
+        except APIException as error: # the bits of DRF's exception handler we need
+            detail = error.detail if isinstance(error.detail, (dict, list)) else {'detail': error.detail}
+            return render(detail, status=error.status_code)
+        return render(data)
+    return wrapper
+
+
+def render(data, status=200):
+    return HttpResponse(renderer.render(data), status=status, content_type='application/json')
+
+
+async def get_or_404(queryset, **lookup):
+    try:
+        return await queryset.aget(**lookup)
+    except queryset.model.DoesNotExist:
+        raise NotFound('Not found.')
+
+
+@async_api_view
+async def game_list(request):
+    queryset = filter_games(Game.objects.all(), request.query_params)
+    paginator = GamePagination()
+    page = await paginator.apaginate_queryset(game_rows(queryset), request)
+    return paginator.get_paginated_data(serialize_games(page))
+
+
+@async_api_view
+async def game_detail(request, pk):
+    game = await get_or_404(Game.objects.select_related('stats'), pk=pk)
+    reviews = [review async for review in review_rows(game.reviews.order_by('-date_submitted', '-id'), reviewer=True)]
+    return {
+        'game': GameSerializer(game).data,
+        'reviews': serialize_reviews_with_reviewer(reviews),
+    }
+
+
+@async_api_view
+async def review_list(request):
+    queryset = filter_reviews(Review.objects.all(), request.query_params)
+    paginator = ReviewPagination()
+    page = await paginator.apaginate_queryset(review_rows(queryset), request)
+    return paginator.get_paginated_data(serialize_reviews(page))
+
+
+@async_api_view
+async def user_profile(request, pk):
+    user = await get_or_404(User.objects.select_related('stats'), pk=pk)
+    games, reviews = GamePagination(), ReviewPagination()
+    game_page = await games.afirst_page(game_rows(user.game_set.all()), request, f"{reverse(game_list)}?user={user.id}", '-id')
+    review_page = await reviews.afirst_page(review_rows(user.reviews.all()), request, f"{reverse(review_list)}?user={user.id}")
+    return {
+        'user': UserSerializer(user, context={'request': request}).data,
+        'stats': user_stats_data(user),
+        'games': serialize_games(game_page),
+        'games_next': games.get_next_link(),
+        'reviews': serialize_reviews(review_page),
+        'reviews_next': reviews.get_next_link(),
+    }
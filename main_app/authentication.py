@@ -0,0 +1,64 @@
+import copy
+import time
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .revocation import revoked_tokens
+
+
+# SimpleJWT's bearer token auth: checking the signature is a HMAC, no password hashing and no session lookup.
+# on top of that it refuses tokens that were logged out (see revocation.py) and keeps the users it resolved
+# for JWT_USER_CACHE_SECONDS, so a request with a known token doesn't query at all. the price is that
+# deactivating a user takes up to that long to reach every worker
+class RevocableJWTAuthentication(JWTAuthentication):
+    users = {} # per worker, user id -> (user, cached until)
+    max_cached_users = 10000
+
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        if revoked_tokens.is_revoked(token.get(api_settings.JTI_CLAIM)):
+            raise InvalidToken(_('Token has been revoked'))
+        return token
+
+    def get_user(self, validated_token):
+        user = self.cached_user(validated_token)
+        if user is None:
+            user = self.cache_user(validated_token, super().get_user(validated_token))
+        return copy.copy(user) # each request gets its own, views may set attributes on request.user
+
+    # the async views (async_views.py) can't go through DRF, they call this instead of authenticate()
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        raw_token = self.get_raw_token(header) if header is not None else None
+        if raw_token is None:
+            return None
+        token = JWTAuthentication.get_validated_token(self, raw_token) # signature and expiry, no io
+        if await revoked_tokens.ais_revoked(token.get(api_settings.JTI_CLAIM)):
+            raise InvalidToken(_('Token has been revoked'))
+        user = self.cached_user(token)
+        if user is None:
+            try:
+                user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: token[api_settings.USER_ID_CLAIM]})
+            except (KeyError, self.user_model.DoesNotExist):
+                raise AuthenticationFailed(_('User not found'), code='user_not_found')
+            if not user.is_active:
+                raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+            self.cache_user(token, user)
+        return copy.copy(user), token
+
+    def cached_user(self, validated_token):
+        cached = self.users.get(validated_token.get(api_settings.USER_ID_CLAIM))
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        return None
+
+    def cache_user(self, validated_token, user):
+        if len(self.users) >= self.max_cached_users:
+            self.users.clear() # crude, but it only costs one query per user to fill up again
+        self.users[validated_token.get(api_settings.USER_ID_CLAIM)] = (user, time.monotonic() + settings.JWT_USER_CACHE_SECONDS)
+        return user
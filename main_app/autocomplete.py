@@ -0,0 +1,190 @@
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import timedelta
+from itertools import accumulate, islice
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity, TrigramWordSimilarity
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import Game, GameNameChange, normalize_name
+
+# /games/autocomplete/?q= answers from a sorted index of every game name that each worker keeps in memory, no
+# query per keystroke. games added, renamed or deleted go into GameNameChange (signals.py), every worker pulls
+# those in every AUTOCOMPLETE_SYNC_SECONDS, same idea as revocation.py. the worker that made the change has it
+# as soon as it commits. when there aren't enough names starting with q, the rest come from a pg_trgm query
+# (migration 0010) that also catches typos and words further into the name
+LIMIT = 10
+FUZZY_MIN_LENGTH = 3 # trigrams of one or two letters match half the table
+SYNC_OVERLAP = timedelta(seconds=30) # re-read a little behind the last sync, rows can commit out of changed_at order
+CHANGE_RETENTION = timedelta(days=1) # a reload deletes older GameNameChange rows, a worker further behind reloads
+RELOAD_AFTER_CHANGES = 10000 # changes kept on top of the table before it's rebuilt (or 1% of the names if more)
+
+
+class NameTable:
+    # every name normalized (models.normalize_name), sorted and packed into one bytes object plus an array of
+    # where each one starts, the display names the same way. 24 bytes a game on top of the names
+    # themselves, a trie or a list of str objects is several times that. a prefix is a binary search and a
+    # walk forward. utf-8 bytes sort in the same order as the strings, so comparing bytes is fine
+    def __init__(self, rows): # (id, name) pairs
+        entries = sorted((normalize_name(name).encode(), game_id, name.encode()) for game_id, name in rows)
+        self.keys = b''.join(key for key, _, _ in entries)
+        self.key_starts = array('L', accumulate((len(key) for key, _, _ in entries), initial=0))
+        self.names = b''.join(name for _, _, name in entries)
+        self.name_starts = array('L', accumulate((len(name) for _, _, name in entries), initial=0))
+        self.ids = array('l', (game_id for _, game_id, _ in entries))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, position): # the normalized name, what bisect compares against
+        return self.keys[self.key_starts[position]:self.key_starts[position + 1]]
+
+    def name(self, position):
+        return self.names[self.name_starts[position]:self.name_starts[position + 1]].decode()
+
+    def matches(self, prefix, skip): # (key, id, name) in order, skip is ids whose entry here is out of date
+        for position in range(bisect_left(self, prefix), len(self.ids)):
+            key = self[position]
+            if not key.startswith(prefix):
+                return
+            if self.ids[position] not in skip:
+                yield key, self.ids[position], self.name(position)
+
+
+class GameNameIndex:
+    def __init__(self, sync_seconds=None):
+        self.sync_seconds = sync_seconds
+        # (NameTable, sorted (key, id, name) of games added or renamed since it was built, ids whose table entry
+        # is out of date). swapped as a whole, so a lookup never sees half an update
+        self.state = (None, [], frozenset())
+        self.synced_at = 0 # time.monotonic() of the last sync
+        self.watermark = None # changed_at of the last sync
+        self.lock = threading.Lock()
+        self.loading = None # the thread building a new table
+
+    def lookup(self, query, limit=LIMIT): # [(id, name)] of the names starting with query, None until it has loaded
+        if self.needs_sync():
+            self.sync()
+        table, added, changed = self.state
+        if table is None:
+            return None
+        prefix = normalize_name(query).encode()
+        added = islice(added, bisect_left(added, (prefix,)), None)
+        found = []
+        for key, game_id, name in heapq.merge(table.matches(prefix, changed), added):
+            if not key.startswith(prefix) or len(found) == limit:
+                break
+            found.append((game_id, name))
+        return found
+
+    def needs_sync(self):
+        return time.monotonic() - self.synced_at >= self.get_sync_seconds()
+
+    def sync(self):
+        if not self.lock.acquire(blocking=False):
+            return # another thread is on it, use what we have
+        try:
+            now = timezone.now()
+            if self.state[0] is None or self.watermark < now - CHANGE_RETENTION:
+                self.reload()
+                return
+            changes = GameNameChange.objects.filter(changed_at__gte=self.watermark)
+            game_ids = set(changes.values_list('game_id', flat=True))
+            if None in game_ids: # something changed games wholesale
+                self.reload()
+            elif game_ids:
+                names = dict(Game.objects.filter(id__in=game_ids).values_list('id', 'name'))
+                self.apply({game_id: names.get(game_id) for game_id in game_ids})
+            self.watermark = now - SYNC_OVERLAP
+            self.synced_at = time.monotonic()
+        finally:
+            self.lock.release()
+
+    def update(self, game_id, name): # a game this worker just saved (name) or deleted (None)
+        with self.lock:
+            if self.state[0] is not None:
+                self.apply({game_id: name})
+
+    def apply(self, names): # {game id: its name now, None if it's gone}. call with the lock held
+        table, added, changed = self.state
+        added = [entry for entry in added if entry[1] not in names]
+        added.extend((normalize_name(name).encode(), game_id, name) for game_id, name in names.items() if name is not None)
+        added.sort()
+        self.state = (table, added, changed | names.keys())
+        if len(added) + len(self.state[2]) > max(RELOAD_AFTER_CHANGES, len(table) // 100):
+            self.reload() # a fresh table beats walking past more and more stale entries
+
+    def reload(self): # builds a new table in the background, the current one keeps answering. call with the lock held
+        if self.loading is None or not self.loading.is_alive():
+            self.loading = threading.Thread(target=self.load_in_background, name='autocomplete-load', daemon=True)
+            self.loading.start()
+
+    def load_in_background(self):
+        try:
+            self.load()
+        finally:
+            connections.close_all() # this thread's connections only
+
+    def load(self):
+        started = timezone.now()
+        GameNameChange.objects.filter(changed_at__lt=started - CHANGE_RETENTION).delete()
+        table = NameTable(Game.objects.values_list('id', 'name').iterator(chunk_size=10000))
+        with self.lock:
+            self.state = (table, [], frozenset())
+            self.watermark = started - SYNC_OVERLAP # what changed while loading comes in with the next sync
+            self.synced_at = time.monotonic()
+
+    def get_sync_seconds(self):
+        if self.sync_seconds is not None:
+            return self.sync_seconds
+        return getattr(settings, 'AUTOCOMPLETE_SYNC_SECONDS', 5)
+
+    def clear(self): # tests
+        with self.lock:
+            self.state = (None, [], frozenset())
+            self.synced_at = 0
+            self.watermark = None
+
+
+game_names = GameNameIndex()
+
+
+def record_name_change(game_id, name): # from the signals, in the game's transaction. name is None for a delete
+    GameNameChange.objects.create(game_id=game_id)
+    transaction.on_commit(lambda: game_names.update(game_id, name))
+
+
+def autocomplete(query, limit=LIMIT):
+    normalized = normalize_name(query)
+    if not normalized:
+        return []
+    # None while this worker is still loading the index, the trigram query answers on its own until then
+    # (istartswith is UPPER(name) LIKE, no index for that)
+    prefix_matches = game_names.lookup(query, limit) or []
+    results = [{'id': game_id, 'name': name, 'match': 'prefix'} for game_id, name in prefix_matches]
+    if len(results) < limit and len(normalized) >= FUZZY_MIN_LENGTH:
+        results += [{'id': game_id, 'name': name, 'match': 'fuzzy'}
+                    for game_id, name in fuzzy_matches(query, limit - len(results), exclude=[game_id for game_id, _ in prefix_matches])]
+    return results
+
+
+def fuzzy_matches(query, limit, exclude=()): # names with a word close to query, best first. %> on the trigram index
+    return list(
+        Game.objects.filter(name__trigram_word_similar=query).exclude(id__in=exclude)
+        .annotate(similarity=TrigramWordSimilarity(query, 'name')).order_by('-similarity', 'id')
+        .values_list('id', 'name')[:limit]
+    )
+
+
+def find_duplicates(name, limit=20): # games whose name normalizes to the same as name's, % on the trigram index
+    normalized = normalize_name(name)
+    candidates = (Game.objects.filter(name__trigram_similar=name)
+                  .annotate(similarity=TrigramSimilarity('name', name)).order_by('-similarity', 'id')
+                  .values_list('id', 'name')[:limit * 5])
+    return [{'id': game_id, 'name': game_name} for game_id, game_name in candidates
+            if normalize_name(game_name) == normalized][:limit]
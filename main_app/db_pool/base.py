@@ -0,0 +1,37 @@
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgresDatabaseWrapper
+from django.db.backends.postgresql.creation import DatabaseCreation as PostgresDatabaseCreation
+
+from .pool import close_all_pools, get_pool
+
+# ENGINE = 'main_app.db_pool': the stock postgres backend, except connections come from and go back to
+# a per-process pool (pool.py). settings go in DATABASES[...]['POOL'], see backend/settings.py.
+# keep CONN_MAX_AGE at 0, django then "closes" at the end of every request, which is what returns the
+# connection to the pool for the next request or thread
+
+
+class DatabaseCreation(PostgresDatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        close_all_pools() # postgres won't drop a database we still have idle connections to
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(PostgresDatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_pool(self, conn_params):
+        options = {key.lower(): value for key, value in self.settings_dict.get('POOL', {}).items()}
+        key = tuple(sorted((name, str(value)) for name, value in conn_params.items())) # the test database gets its own
+        return get_pool(key, conn_params.get('dbname') or conn_params.get('database', ''), **options)
+
+    def get_new_connection(self, conn_params):
+        self.pool = self.get_pool(conn_params)
+        return self.pool.getconn(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+
+    def _close(self):
+        if self.connection is None:
+            return
+        with self.wrap_database_errors:
+            if self.in_atomic_block:
+                self.pool.discard(self.connection) # closed mid transaction, the wrapper keeps pointing at it. don't share it
+            else:
+                self.pool.putconn(self.connection)
@@ -0,0 +1,181 @@
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+# a small per-process pool of psycopg2 connections. django hands its connection back at the end of every
+# request (CONN_MAX_AGE=0), the pooled backend in base.py turns that into a checkin here instead of a
+# disconnect, so the next request skips the TCP connect, auth and backend fork
+request_pool_wait = contextvars.ContextVar('request_pool_wait', default=None) # set per request by DatabasePoolMiddleware
+
+
+class PoolTimeout(psycopg2.OperationalError): # django wraps it into django.db.OperationalError like any connect failure
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, name='', max_size=4, timeout=10, max_lifetime=30 * 60, health_check_after=30):
+        self.name = name
+        self.max_size = max_size
+        self.timeout = timeout # seconds to wait for a free connection before giving up
+        self.max_lifetime = max_lifetime # reconnect now and then, so postgres restarts and failovers get picked up
+        self.health_check_after = health_check_after # SELECT 1 before handing out a connection idle this long
+        self.condition = threading.Condition()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.idle = deque() # (connection, created at, returned at), most recently returned on the right
+        self.created_at = {} # id(connection) -> time.monotonic() it was opened, for everything we own
+        self.stats = {
+            'checkouts': 0, 'waits': 0, 'wait_seconds': 0.0, 'timeouts': 0,
+            'connects': 0, 'connection_errors': 0, 'health_check_failures': 0, 'discarded': 0,
+        }
+
+    def getconn(self, connect):
+        self.check_fork()
+        deadline = time.monotonic() + self.timeout
+        waited = None
+        while True:
+            with self.condition:
+                if self.idle:
+                    connection, created, returned = self.idle.pop()
+                elif len(self.created_at) < self.max_size:
+                    connection = None
+                    slot = object() # holds the place while we connect outside the lock
+                    self.created_at[id(slot)] = time.monotonic()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if waited is None:
+                        waited = time.monotonic()
+                        self.stats['waits'] += 1
+                    if remaining <= 0 or not self.condition.wait(remaining):
+                        self.stats['timeouts'] += 1
+                        self.record_wait(waited)
+                        raise PoolTimeout(f'no database connection free after {self.timeout}s ({self.max_size} in use)')
+                    continue
+
+            if connection is None:
+                connection = self.open(connect, slot)
+            elif not self.healthy(connection, created, returned):
+                self.discard(connection)
+                continue
+            with self.condition:
+                self.stats['checkouts'] += 1
+            self.record_wait(waited)
+            return connection
+
+    def open(self, connect, slot):
+        try:
+            connection = connect()
+        except Exception:
+            with self.condition:
+                self.stats['connection_errors'] += 1
+                self.created_at.pop(id(slot))
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.stats['connects'] += 1
+            self.created_at[id(connection)] = self.created_at.pop(id(slot))
+        return connection
+
+    def putconn(self, connection):
+        if os.getpid() != self.pid or id(connection) not in self.created_at:
+            connection.close() # not ours, or opened before a fork
+            return
+        created = self.created_at[id(connection)]
+        if connection.closed or time.monotonic() - created > self.max_lifetime:
+            self.discard(connection)
+            return
+        try:
+            if connection.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback() # nothing left open for the next request to trip over
+        except psycopg2.Error:
+            self.discard(connection)
+            return
+        with self.condition:
+            self.idle.append((connection, created, time.monotonic()))
+            self.condition.notify()
+
+    def discard(self, connection):
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+        with self.condition:
+            self.created_at.pop(id(connection), None)
+            self.stats['discarded'] += 1
+            self.condition.notify()
+
+    def healthy(self, connection, created, returned):
+        now = time.monotonic()
+        if connection.closed or now - created > self.max_lifetime:
+            return False
+        if now - returned < self.health_check_after:
+            return True # used moments ago, a ping would cost more than it catches
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except psycopg2.Error:
+            with self.condition:
+                self.stats['health_check_failures'] += 1
+            return False
+
+    def record_wait(self, waited):
+        if waited is None:
+            return
+        seconds = time.monotonic() - waited
+        with self.condition:
+            self.stats['wait_seconds'] += seconds
+        request_wait = request_pool_wait.get()
+        if request_wait is not None:
+            request_wait.append(seconds)
+
+    def check_fork(self):
+        # connections opened before a fork (gunicorn --preload) belong to the parent, forget them without closing
+        if os.getpid() != self.pid:
+            with self.condition:
+                self.reset()
+
+    def close_all(self):
+        with self.condition:
+            idle, self.idle = self.idle, deque()
+        for connection, _, _ in idle:
+            self.discard(connection)
+
+    def get_stats(self):
+        with self.condition:
+            return {
+                **self.stats,
+                'size': len(self.created_at),
+                'idle': len(self.idle),
+                'in_use': len(self.created_at) - len(self.idle),
+                'max_size': self.max_size,
+            }
+
+
+pools = {} # one per distinct set of connection parameters
+pools_lock = threading.Lock()
+
+
+def get_pool(key, name, **options):
+    with pools_lock:
+        if key not in pools:
+            pools[key] = ConnectionPool(name, **options)
+        return pools[key]
+
+
+def close_all_pools():
+    with pools_lock:
+        for pool in pools.values():
+            pool.close_all()
+
+
+def get_all_stats():
+    with pools_lock:
+        return [{'database': pool.name, **pool.get_stats()} for pool in pools.values()]
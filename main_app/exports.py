@@ -0,0 +1,120 @@
+import csv
+from datetime import date, datetime, time, timezone as dt_timezone
+
+import orjson
+from asgiref.sync import sync_to_async
+from django.db import transaction
+
+from .fast_serializers import datetime_string
+from .models import Game, GameStats, Review
+
+# full dumps of games, reviews and per-game stats as NDJSON or CSV, for /export/ and the export_data command.
+# rows come off a server-side cursor CHUNK_SIZE at a time and go out as soon as they are formatted, so memory
+# stays at one chunk however big the table is. rows are in key order, ?after=<last key you got> picks a
+# broken download back up. games dumps can be fed straight back into import_games
+CHUNK_SIZE = 2000
+
+# output column -> .values() field, key is the order rows come out in (and what after= compares against),
+# filters say which field ?game=, ?user= and ?since=/?until= apply to
+EXPORTS = {
+    'games': {
+        'model': Game,
+        'columns': {'id': 'id', 'name': 'name', 'genres': 'genres', 'description': 'description',
+                    'release_date': 'release_date', 'image_url': 'image_url', 'user': 'user_id'},
+        'key': 'id',
+        'filters': {'game': 'id', 'user': 'user_id', 'date': 'release_date'},
+    },
+    'reviews': {
+        'model': Review,
+        'columns': {'id': 'id', 'score': 'score', 'review': 'review', 'date_submitted': 'date_submitted',
+                    'user': 'user_id', 'game': 'game_id'},
+        'key': 'id',
+        'filters': {'game': 'game_id', 'user': 'user_id', 'date': 'date_submitted'},
+    },
+    'game-stats': {
+        'model': GameStats,
+        'columns': {'game': 'game_id', 'name': 'game__name', 'review_count': 'review_count',
+                    'average_score': 'average_score', **{str(score): field for score, field in GameStats.SCORE_FIELDS.items()},
+                    'last_review_date': 'last_review_date'},
+        'key': 'game_id',
+        'filters': {'game': 'game_id', 'user': 'game__user_id', 'date': 'last_review_date'},
+    },
+}
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv; charset=utf-8'}
+
+
+def export_queryset(kind, game=None, user=None, since=None, until=None, after=None):
+    export = EXPORTS[kind]
+    filters = export['filters']
+    queryset = export['model'].objects.order_by(export['key'])
+    if game is not None:
+        queryset = queryset.filter(**{filters['game']: game})
+    if user is not None:
+        queryset = queryset.filter(**{filters['user']: user})
+    if export['model']._meta.get_field(filters['date']).get_internal_type() == 'DateTimeField':
+        since = since and datetime.combine(since, time.min, tzinfo=dt_timezone.utc) # whole days, like /search/
+        until = until and datetime.combine(until, time.max, tzinfo=dt_timezone.utc)
+    if since is not None:
+        queryset = queryset.filter(**{f"{filters['date']}__gte": since})
+    if until is not None:
+        queryset = queryset.filter(**{f"{filters['date']}__lte": until})
+    if after is not None:
+        queryset = queryset.filter(**{f"{export['key']}__gt": after})
+    return queryset.values(*export['columns'].values())
+
+
+def export_value(value, file_format):
+    if isinstance(value, datetime): # before date, a datetime is a date too
+        return datetime_string(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, float):
+        return round(value, 2)
+    if isinstance(value, list) and file_format == 'csv':
+        return '|'.join(value) # import_games' default --genre-separator
+    return value
+
+
+class Echo: # csv.writer wants a file, this one hands each line straight back
+    def write(self, line):
+        return line
+
+
+def stream_export(kind, file_format, chunk_size=CHUNK_SIZE, **filters):
+    # the database is picked now, the body is read after the request's replica routing (routers.py) has ended
+    queryset = export_queryset(kind, **filters)
+    return export_chunks(queryset.using(queryset.db), EXPORTS[kind]['columns'], file_format, chunk_size)
+
+
+def export_chunks(queryset, columns, file_format, chunk_size):
+    writer = csv.writer(Echo())
+    if file_format == 'csv':
+        yield writer.writerow(columns).encode()
+    # in a transaction the cursor is a plain server-side one. outside one django declares it WITH HOLD,
+    # and postgres materializes the whole result before handing out the first row.
+    # the body is read on the thread that ran the view, so nothing else touches the connection between chunks
+    with transaction.atomic(using=queryset.db):
+        chunk = []
+        for row in queryset.iterator(chunk_size=chunk_size):
+            values = [export_value(value, file_format) for value in row.values()]
+            if file_format == 'csv':
+                chunk.append(writer.writerow(values).encode())
+            else:
+                chunk.append(orjson.dumps(dict(zip(columns, values))) + b'\n')
+            if len(chunk) == chunk_size:
+                yield b''.join(chunk)
+                chunk = []
+        if chunk:
+            yield b''.join(chunk)
+
+
+async def async_chunks(chunks):
+    # under ASGI django 4.2 reads a sync streaming body with sync_to_async(list), the whole table before the first
+    # byte. this hands it over a chunk at a time instead. thread_sensitive runs every next() on the thread that ran
+    # the view, the one whose connection holds the cursor's transaction
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    try:
+        while (chunk := await next_chunk(chunks, None)) is not None:
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close, thread_sensitive=True)() # a client that went away, end the transaction
@@ -0,0 +1,76 @@
+from django.utils import timezone
+
+from .metrics import timed_serializer
+from .models import GameStats
+
+# read-only twins of GameSerializer, ReviewSerializer and ReviewWithReviewerSerializer for the big list
+# responses. .values() fetches just the columns the JSON needs and every row goes straight from a dict to
+# a dict: no model instances, no field objects, no to_representation() per field. the output has to be
+# exactly what the serializers give, tests.py compares the two. change a serializer, change its twin
+HISTOGRAM_COLUMNS = [(str(score), f'stats__{field}') for score, field in GameStats.SCORE_FIELDS.items()]
+GAME_COLUMNS = (
+    'id', 'name', 'genres', 'description', 'release_date', 'image_url', 'user_id',
+    'stats__review_count', 'stats__average_score', 'stats__last_review_date', *(column for _, column in HISTOGRAM_COLUMNS),
+)
+REVIEW_COLUMNS = ('id', 'score', 'review', 'date_submitted', 'user_id', 'game_id')
+
+
+def datetime_string(value): # what DRF's DateTimeField does with the default ISO 8601 format
+    value = value.astimezone(timezone.get_current_timezone()).isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+def game_rows(queryset): # the stats columns come from a LEFT JOIN, select_related doesn't apply to .values()
+    return queryset.values(*GAME_COLUMNS)
+
+
+@timed_serializer
+def serialize_games(rows):
+    games = []
+    for row in rows:
+        if row['stats__review_count'] is None: # no GameStats row
+            stats = None
+        else:
+            average = row['stats__average_score']
+            last_review = row['stats__last_review_date']
+            stats = {
+                'review_count': row['stats__review_count'],
+                'average_score': None if average is None else round(average, 2),
+                'histogram': {score: row[column] for score, column in HISTOGRAM_COLUMNS},
+                'last_review_date': None if last_review is None else last_review.isoformat(),
+            }
+        games.append({
+            'id': row['id'],
+            'name': row['name'],
+            'genres': row['genres'],
+            'description': row['description'],
+            'release_date': datetime_string(row['release_date']),
+            'image_url': row['image_url'],
+            'user': row['user_id'],
+            'stats': stats,
+        })
+    return games
+
+
+def review_rows(queryset, reviewer=False): # reviewer=True joins in the username for serialize_reviews_with_reviewer
+    return queryset.values(*REVIEW_COLUMNS, 'user__username') if reviewer else queryset.values(*REVIEW_COLUMNS)
+
+
+@timed_serializer
+def serialize_reviews(rows):
+    return [{
+        'id': row['id'],
+        'score': row['score'],
+        'review': row['review'],
+        'date_submitted': row['date_submitted'].isoformat(),
+        'user': row['user_id'],
+        'game': row['game_id'],
+    } for row in rows]
+
+
+@timed_serializer
+def serialize_reviews_with_reviewer(rows):
+    reviews = serialize_reviews(rows)
+    for review, row in zip(reviews, rows):
+        review['reviewer'] = {'id': row['user_id'], 'username': row['user__username']}
+    return reviews
@@ -0,0 +1,26 @@
+from rest_framework.exceptions import ValidationError
+
+# the list filters, shared by the viewsets (views.py) and their async twins (async_views.py) so the two can't
+# drift apart. params is request.query_params
+
+
+def filter_games(queryset, params):
+    genres = params.get('genres')
+    if genres: # ?genres=RPG,Indie lists games that have all of them, @> on the genres GIN index
+        queryset = queryset.filter(genres__contains=[genre.strip() for genre in genres.split(',') if genre.strip()])
+    return filter_id(queryset, params, 'user') # the games someone added, on the (user, id) index
+
+
+def filter_reviews(queryset, params):
+    queryset = filter_id(queryset, params, 'game') # one game's reviews, on the (game, date_submitted, id) index
+    return filter_id(queryset, params, 'user') # someone's reviews, on the (user, date_submitted, id) index
+
+
+def filter_id(queryset, params, field): # ?game=<id> or ?user=<id>
+    value = params.get(field)
+    if not value:
+        return queryset
+    try:
+        return queryset.filter(**{f'{field}_id': int(value)})
+    except ValueError:
+        raise ValidationError({field: f'must be a {field} id'})
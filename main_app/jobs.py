@@ -0,0 +1,169 @@
+import logging
+import time
+import traceback
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import BooleanField, Count, ExpressionWrapper, F, Min, Q
+from django.utils import timezone
+
+from .aggregates import rebuild_game_stats, rebuild_user_stats
+from .metrics import JOB_LATENCY_SECONDS, JOB_SECONDS, JOBS
+from .models import Game, Job
+from .rankings import refresh_rankings
+from .response_cache import bump_on_commit
+
+# work a write causes that its response doesn't have to wait for (a game's stats and genre totals, the
+# leaderboards, similar games, the profile stats) is a Job row, run by `manage.py run_worker`. enqueue() inserts it in the write's own transaction,
+# so there is a job exactly when the write committed. a job already waiting for the same kind and target covers a
+# new one, they coalesce on the job_pending_uniq index. workers claim due jobs with FOR UPDATE SKIP LOCKED, so any
+# number of them can run side by side without handing a job out twice. a job's work and its deletion commit
+# together. a job that raises is retried with exponential backoff, after MAX_ATTEMPTS it stays as failed.
+# a batch kind's handler takes a list of target ids, when one of its jobs is due the kind's whole backlog runs with it
+logger = logging.getLogger('main_app.jobs')
+MAX_ATTEMPTS = 5
+BACKOFF = timedelta(seconds=5) # doubled after every failed attempt
+STALLED_AFTER = timedelta(minutes=10) # a job running this long lost its worker, another worker takes it over
+
+handlers = {} # kind -> (function of the target id, delay, batch size)
+
+
+def job(kind, delay=timedelta(0), batch_size=None):
+    # delay: jobs run that long after the first enqueue, later ones coalesce into it. batch_size: the function
+    # gets the target ids of up to that many jobs at once, for work that costs about the same for one game or many
+    def register(function):
+        handlers[kind] = (function, delay, batch_size)
+        return function
+    return register
+
+
+def enqueue(*jobs): # (kind, target id) pairs, one INSERT for all of them
+    now = timezone.now()
+    Job.objects.bulk_create(
+        [Job(kind=kind, target_id=target_id, run_at=now + handlers[kind][1]) for kind, target_id in sorted(set(jobs), key=str)],
+        ignore_conflicts=True,
+    )
+
+
+def claim(limit, which=None): # which: a Q of the jobs to take, what's due (or stalled) by default
+    now = timezone.now()
+    if which is None:
+        which = Q(state=Job.PENDING, run_at__lte=now) | Q(state=Job.RUNNING, started_at__lt=now - STALLED_AFTER)
+    with transaction.atomic():
+        jobs = list(Job.objects.select_for_update(skip_locked=True).filter(which).order_by('run_at', 'id')[:limit])
+        Job.objects.filter(id__in=[job.id for job in jobs]).update(state=Job.RUNNING, started_at=now, attempts=F('attempts') + 1)
+    for job in jobs:
+        job.attempts += 1
+    return jobs
+
+
+def batches(jobs): # claimed jobs as they run: one at a time, a batch kind's all together with the rest of its backlog
+    grouped = {}
+    for job in jobs:
+        if handlers[job.kind][2] is None:
+            yield [job]
+        else:
+            grouped.setdefault(job.kind, []).append(job)
+    for kind, group in grouped.items():
+        # due or not, alone they would each pay for the same setup later. retries keep their backoff
+        yield group + claim(handlers[kind][2] - len(group), Q(kind=kind, state=Job.PENDING, attempts=0))
+
+
+def run_job(job): # 'done', 'retried' or 'failed'
+    return run_batch([job])[0]
+
+
+def run_batch(jobs): # jobs of one kind, from batches(). their outcomes in the same order
+    kind = jobs[0].kind
+    function, _, batch_size = handlers[kind]
+    start = time.perf_counter()
+    try:
+        with transaction.atomic():
+            if batch_size is None:
+                function(jobs[0].target_id)
+            else:
+                function([job.target_id for job in jobs])
+            Job.objects.filter(id__in=[job.id for job in jobs]).delete()
+        outcomes = ['done'] * len(jobs)
+    except Exception:
+        logger.exception('%s job %s for %s failed (attempt %s)', kind, ', '.join(str(job.id) for job in jobs),
+                         ', '.join(str(job.target_id) for job in jobs), ', '.join(str(job.attempts) for job in jobs))
+        error = traceback.format_exc()
+        outcomes = [retry_later(job, error) for job in jobs]
+    JOB_SECONDS.labels(kind).observe(time.perf_counter() - start)
+    for job, outcome in zip(jobs, outcomes):
+        JOBS.labels(kind, outcome).inc()
+        if outcome == 'done':
+            JOB_LATENCY_SECONDS.labels(kind).observe((timezone.now() - job.created_at).total_seconds())
+    return outcomes
+
+
+def retry_later(job, error):
+    if job.attempts >= MAX_ATTEMPTS:
+        Job.objects.filter(id=job.id).update(state=Job.FAILED, last_error=error)
+        return 'failed'
+    try:
+        with transaction.atomic():
+            run_at = timezone.now() + BACKOFF * 2 ** (job.attempts - 1)
+            Job.objects.filter(id=job.id).update(state=Job.PENDING, run_at=run_at, last_error=error)
+    except IntegrityError: # a write enqueued the same job again meanwhile, that one does it
+        Job.objects.filter(id=job.id).delete()
+    return 'retried'
+
+
+def release(jobs): # claimed jobs a stopping worker won't get to, back to pending for the next one
+    for job in jobs:
+        try:
+            with transaction.atomic():
+                Job.objects.filter(id=job.id).update(state=Job.PENDING, attempts=F('attempts') - 1)
+        except IntegrityError: # already enqueued again
+            Job.objects.filter(id=job.id).delete()
+
+
+def run_jobs(batch_size=20): # runs what's due until nothing is, for run_worker and tests. {outcome: count}
+    outcomes = {}
+    while jobs := claim(batch_size):
+        for batch in batches(jobs):
+            for outcome in run_batch(batch):
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    return outcomes
+
+
+def queue_depth(): # (kind, state, count, seconds the oldest has waited). due and waiting (for a retry) split pending
+    now = timezone.now()
+    due = ExpressionWrapper(Q(state=Job.PENDING, run_at__lte=now), output_field=BooleanField())
+    rows = (Job.objects.annotate(due=due).values('kind', 'state', 'due')
+            .annotate(count=Count('id'), oldest=Min('created_at')).order_by('kind', 'state'))
+    for row in rows:
+        label = ('due' if row['due'] else 'waiting') if row['state'] == Job.PENDING else row['state']
+        yield row['kind'], label, row['count'], (now - row['oldest']).total_seconds()
+
+
+# HANDLERS
+
+@job('game-stats')
+def update_game_stats(game_id): # recount one game, the genre totals move with it (aggregates.py)
+    rebuild_game_stats([game_id])
+    bump_on_commit('game', game_id)
+    user_id = Game.objects.filter(id=game_id).values_list('user_id', flat=True).first()
+    if user_id is not None: # the profile of whoever added the game shows its stats
+        bump_on_commit('user', user_id)
+
+
+@job('rankings', delay=timedelta(minutes=1)) # at most about once a minute however many reviews come in
+def update_rankings(game_id):
+    refresh_rankings()
+
+
+# every run loads all the games and reviews (a few seconds at 10M reviews), so it waits for more to change
+@job('similar-games', delay=timedelta(minutes=10), batch_size=5000)
+def update_similar_games(game_ids):
+    from .similar import build_similar_games # numpy and scipy only in the worker, not every web process
+    build_similar_games(None if None in game_ids else game_ids) # None: every game, queued by migration 0012
+
+
+@job('user-stats', batch_size=1000) # one query recounts a batch as cheaply as a single user
+def update_user_stats(user_ids): # what the profile shows, see aggregates.py
+    rebuild_user_stats(user_ids)
+    for user_id in user_ids:
+        bump_on_commit('user', user_id)
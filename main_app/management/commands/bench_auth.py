@@ -0,0 +1,95 @@
+import base64
+import statistics
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from main_app.authentication import RevocableJWTAuthentication
+from main_app.models import RevokedToken
+from main_app.revocation import revoked_tokens
+
+
+def percentiles(times):
+    times = sorted(times)
+    return statistics.median(times), times[min(len(times) - 1, int(len(times) * 0.99))]
+
+
+class Command(BaseCommand):
+    help = ('Times authentication: the authenticator alone (plain SimpleJWT vs with the revocation check and '
+            'user cache, against --revoked revoked tokens), then whole requests to --endpoints with basic auth vs '
+            'a bearer token. Test data is rolled back')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000, help='per authenticator')
+        parser.add_argument('--revoked', type=int, default=10000, help='revoked tokens in the table')
+        parser.add_argument('--endpoint-requests', type=int, default=200, help='per endpoint and auth type')
+        parser.add_argument('--endpoints', default='/games/,/reviews/,/genres/')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            password = uuid.uuid4().hex
+            user = User.objects.create_user(username='bench-auth', password=password) # hashed with the real hasher
+            expires = timezone.now() + timedelta(days=1)
+            RevokedToken.objects.bulk_create(
+                [RevokedToken(jti=uuid.uuid4().hex, expires_at=expires) for _ in range(options['revoked'])],
+                batch_size=5000,
+            )
+            revoked_tokens.clear()
+            RevocableJWTAuthentication.users.clear()
+            bearer = f'Bearer {RefreshToken.for_user(user).access_token}'
+            basic = 'Basic ' + base64.b64encode(f'bench-auth:{password}'.encode()).decode()
+
+            self.bench_authenticators(bearer, options['requests'])
+            self.bench_endpoints(bearer, basic, options['endpoints'].split(','), options['endpoint_requests'])
+            transaction.set_rollback(True)
+        revoked_tokens.clear()
+        RevocableJWTAuthentication.users.clear()
+
+    def bench_authenticators(self, bearer, count):
+        factory = APIRequestFactory()
+        self.stdout.write(f"{'authenticator':<28} {'p50 us':>8} {'p99 us':>8} {'queries/request':>16}")
+        for name, authenticator in (('SimpleJWT', JWTAuthentication()), ('RevocableJWTAuthentication', RevocableJWTAuthentication())):
+            authenticator.authenticate(Request(factory.get('/', HTTP_AUTHORIZATION=bearer))) # warm up, first sync
+            times = []
+            with CaptureQueriesContext(connection) as queries:
+                for _ in range(count):
+                    request = Request(factory.get('/', HTTP_AUTHORIZATION=bearer))
+                    start = time.perf_counter()
+                    authenticator.authenticate(request)
+                    times.append((time.perf_counter() - start) * 1_000_000)
+            p50, p99 = percentiles(times)
+            self.stdout.write(f'{name:<28} {p50:>8.1f} {p99:>8.1f} {len(queries) / count:>16.3f}')
+
+    def bench_endpoints(self, bearer, basic, endpoints, count):
+        client = Client(HTTP_HOST='localhost')
+        headers = {'jwt': bearer}
+        if settings.BASIC_AUTH_ENABLED:
+            headers['basic'] = basic
+        else:
+            self.stdout.write('basic auth is off (BASIC_AUTH_ENABLED), only timing jwt')
+
+        self.stdout.write(f"\n{'endpoint':<16} {'auth':<6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+        for endpoint in endpoints:
+            for name, header in headers.items():
+                client.get(endpoint, HTTP_AUTHORIZATION=header) # warm up
+                times = []
+                for _ in range(count):
+                    start = time.perf_counter()
+                    response = client.get(endpoint, HTTP_AUTHORIZATION=header)
+                    times.append((time.perf_counter() - start) * 1000)
+                    if response.status_code != 200:
+                        raise CommandError(f'{endpoint} with {name} auth answered {response.status_code}')
+                p50, p99 = percentiles(times)
+                self.stdout.write(f'{endpoint:<16} {name:<6} {count / (sum(times) / 1000):>8.0f} {p50:>8.2f} {p99:>8.2f}')
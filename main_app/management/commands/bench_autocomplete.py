@@ -0,0 +1,65 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main_app.autocomplete import LIMIT, GameNameIndex, NameTable
+from main_app.management.commands.seed_synthetic import ADJECTIVES, NOUNS, SUFFIXES
+from main_app.models import normalize_name
+
+SYLLABLES = ['ka', 'zel', 'da', 'mor', 'rin', 'tho', 'vel', 'sha', 'ul', 'gri', 'no', 'pex', 'tra', 'quo', 'lia', 'bor']
+
+
+class Command(BaseCommand):
+    help = ('Prefix lookup latency of the autocomplete index (main_app/autocomplete.py) over --names made up game '
+            'names, no database involved. Prints build time, memory and p50/p95/p99, and fails if p99 is over --max-p99-ms')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--names', type=int, default=1000000)
+        parser.add_argument('--changes', type=int, default=1000, help='games added or renamed since the table was built')
+        parser.add_argument('--lookups', type=int, default=100000)
+        parser.add_argument('--limit', type=int, default=LIMIT)
+        parser.add_argument('--max-p99-ms', type=float, default=1.0)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        names = [self.make_name(rng) for _ in range(options['names'] + options['changes'])]
+
+        start = time.perf_counter()
+        table = NameTable(enumerate(names[:options['names']], start=1))
+        built = time.perf_counter() - start
+        size = sum(len(part) * getattr(part, 'itemsize', 1) for part in (table.keys, table.key_starts, table.names, table.name_starts, table.ids))
+        self.stdout.write(f'{len(table)} names in {built:.1f}s, {size / 2 ** 20:.0f} MiB ({size / len(table):.0f} bytes a name)')
+
+        index = GameNameIndex(sync_seconds=float('inf')) # no database, nothing to sync with
+        index.state = (table, [], frozenset())
+        with index.lock:
+            index.apply(dict(enumerate(names[options['names']:], start=options['names'] + 1)))
+            # and as many of the originals renamed, so the lookups have stale entries to walk past
+            index.apply({rng.randint(1, options['names']): self.make_name(rng) for _ in range(options['changes'])})
+
+        # what someone typing a name sends: the first 1 to 8 characters of a real one
+        queries = [normalize_name(name)[:rng.randint(1, 8)] for name in rng.choices(names, k=options['lookups'])]
+        timings = []
+        found = 0
+        for query in queries:
+            start = time.perf_counter_ns()
+            found += len(index.lookup(query, options['limit']))
+            timings.append(time.perf_counter_ns() - start)
+        p50, p95, p99 = (value / 1e6 for value in self.percentiles(timings, (50, 95, 99)))
+        self.stdout.write(f'{len(queries)} lookups, {found / len(queries):.1f} names each: '
+                          f'p50 {p50:.3f}ms p95 {p95:.3f}ms p99 {p99:.3f}ms max {max(timings) / 1e6:.3f}ms')
+        if p99 > options['max_p99_ms']:
+            raise CommandError(f'p99 {p99:.3f}ms is over {options["max_p99_ms"]}ms')
+
+    def make_name(self, rng): # a few real looking words, often with the same start as seed_synthetic's
+        words = [''.join(rng.choices(SYLLABLES, k=rng.randint(1, 4))).capitalize() for _ in range(rng.randint(1, 3))]
+        if rng.random() < 0.5:
+            words.insert(0, f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}')
+        return ' '.join(words) + rng.choice(SUFFIXES)
+
+    def percentiles(self, values, points):
+        cuts = statistics.quantiles(values, n=100)
+        return [cuts[point - 1] for point in points]
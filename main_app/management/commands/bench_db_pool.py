@@ -0,0 +1,49 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgresDatabaseWrapper
+
+from main_app.db_pool.base import DatabaseWrapper as PooledDatabaseWrapper
+from main_app.db_pool.pool import close_all_pools
+
+
+def percentiles(times):
+    times = sorted(times)
+    return statistics.median(times), times[min(len(times) - 1, int(len(times) * 0.99))]
+
+
+class Command(BaseCommand):
+    help = ('Times what the connection costs a request: connect, run --query, close. Once with a new connection per '
+            'request (the stock backend) and once through the pool, against the default database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--query', default='SELECT id, name FROM main_app_game ORDER BY id LIMIT 20')
+
+    def handle(self, *args, **options):
+        settings_dict = {**connections['default'].settings_dict, 'CONN_MAX_AGE': 0}
+        self.stdout.write(f"{'backend':<10} {'p50 ms':>8} {'p99 ms':>8} {'mean ms':>8}")
+        results = {}
+        for name, wrapper_class in (('connect', PostgresDatabaseWrapper), ('pooled', PooledDatabaseWrapper)):
+            wrapper = wrapper_class(dict(settings_dict), alias=f'bench_{name}')
+            self.request(wrapper, options['query']) # warm up, the pool opens its connection here
+            times = []
+            for _ in range(options['requests']):
+                start = time.perf_counter()
+                self.request(wrapper, options['query'])
+                times.append((time.perf_counter() - start) * 1000)
+            p50, p99 = percentiles(times)
+            results[name] = statistics.mean(times)
+            self.stdout.write(f'{name:<10} {p50:>8.3f} {p99:>8.3f} {results[name]:>8.3f}')
+            if name == 'pooled':
+                self.stdout.write(f'pool: {wrapper.pool.get_stats()}')
+        close_all_pools()
+        self.stdout.write(f"saved per request: {results['connect'] - results['pooled']:.3f} ms")
+
+    def request(self, wrapper, query): # what django does around every request with CONN_MAX_AGE=0
+        with wrapper.cursor() as cursor:
+            cursor.execute(query)
+            cursor.fetchall()
+        wrapper.close()
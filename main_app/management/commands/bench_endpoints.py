@@ -0,0 +1,234 @@
+import json
+import statistics
+import time
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver, resolve
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from main_app.autocomplete import game_names
+from main_app.models import GameStats, Review
+
+# (method, path, body). {game}, {user}, {review}, {group}, {ids} and the tokens are filled in from the database,
+# the path as written here is the name the baseline knows the case by. writes are rolled back after every request
+CASES = [
+    ('GET', '/', None),
+    ('GET', '/users/', None),
+    ('GET', '/users/?ids={ids}', None),
+    ('GET', '/users/{user}/', None),
+    ('GET', '/groups/', None),
+    ('GET', '/groups/{group}/', None),
+    ('GET', '/games/', None),
+    ('GET', '/games/?genres=RPG', None),
+    ('GET', '/games/?ordering=-release_date&count=true', None),
+    ('GET', '/games/?user={user}&ordering=-id', None),
+    ('POST', '/games/', 'game'),
+    ('GET', '/games/top/', None),
+    ('GET', '/games/top/?genre=RPG', None),
+    ('GET', '/games/trending/', None),
+    ('GET', '/games/{game}/similar/', None),
+    ('GET', '/games/autocomplete/?q=s', None), # enough names start with it, no query
+    ('GET', '/games/autocomplete/?q=kingdm', None), # a typo, the rest come from the trigram index
+    ('GET', '/games/{game}/', None),
+    ('PUT', '/games/{game}/', 'game'),
+    ('PATCH', '/games/{game}/', {'description': 'patched'}),
+    ('DELETE', '/games/{game}/', None),
+    ('GET', '/reviews/', None),
+    ('GET', '/reviews/?game={game}', None),
+    ('GET', '/reviews/?user={user}', None),
+    ('POST', '/reviews/', 'review'),
+    ('POST', '/reviews/batch/', 'batch'),
+    ('GET', '/reviews/{review}/', None),
+    ('PUT', '/reviews/{review}/', 'review'),
+    ('PATCH', '/reviews/{review}/', {'score': 4}),
+    ('DELETE', '/reviews/{review}/', None),
+    ('GET', '/genres/', None),
+    ('GET', '/genres/RPG/', None),
+    ('GET', '/api-auth/login/', None),
+    ('POST', '/api-auth/logout/', None),
+    ('POST', '/new-user/', {'username': 'bench-new-user', 'password': 'bench-password', 'email': 'new@example.com',
+                            'first_name': '', 'last_name': ''}),
+    ('POST', '/new-game/', 'game'),
+    ('POST', '/games/{game}/new-review', 'review'),
+    ('PUT', '/games/{game}/edit', 'game'),
+    ('POST', '/api/login', {'username': 'bench-endpoints', 'password': 'bench-password'}),
+    ('POST', '/api/logout', {'refresh': '{logout_refresh}'}),
+    ('POST', '/api/token/refresh', {'refresh': '{refresh}'}),
+    ('GET', '/get-csrf-token/', None),
+    ('GET', '/rev-user/{user}', None),
+    ('GET', '/search/?q=kingdom', None),
+    ('GET', '/search/?q=soundtrack&type=reviews', None),
+    ('GET', '/export/reviews.ndjson?game={game}', None),
+    ('GET', '/export/games.csv', None),
+    ('GET', '/export/game-stats.ndjson', None),
+    ('GET', '/internal/db-pool', None),
+    ('GET', '/metrics', None),
+    ('GET', '/async/games/', None),
+    ('GET', '/async/games/{game}/', None),
+    ('GET', '/async/reviews/?game={game}', None),
+    ('GET', '/async/users/{user}/', None),
+]
+SKIPPED_ROUTES = ['admin/'] # django's own
+
+
+def route_names():
+    def walk(patterns, prefix=''):
+        for pattern in patterns:
+            route = prefix + str(pattern.pattern)
+            if isinstance(pattern, URLResolver):
+                yield from walk(pattern.url_patterns, route)
+            elif '(?P<format>' not in route: # DRF's .json suffix copies
+                yield route
+    return {route for route in walk(get_resolver().url_patterns) if not route.startswith(tuple(SKIPPED_ROUTES))}
+
+
+def case_route(path):
+    return resolve(path.partition('?')[0].format(game=1, user=1, review=1, group=1)).route
+
+
+def percentile(times, fraction):
+    return times[min(len(times) - 1, int(len(times) * fraction))]
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks every route in backend/urls.py against the current database (seed it with seed_synthetic): '
+            'latency percentiles, queries and response bytes per case. Compares with a stored baseline and fails '
+            'if a case runs more queries than it used to or got slower than --latency-tolerance allows')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30, help='timed requests per case')
+        parser.add_argument('--baseline', default=str(settings.BASE_DIR / 'bench_baseline.json'))
+        parser.add_argument('--save-baseline', action='store_true', help='write the results as the new baseline')
+        parser.add_argument('--latency-tolerance', type=float, default=0.5, help='allowed p50 slowdown, 0.5 = 50%%')
+        parser.add_argument('--latency-floor-ms', type=float, default=2, help='p50 changes smaller than this never fail')
+        parser.add_argument('--only', help='just the cases whose path contains this')
+
+    def handle(self, *args, **options):
+        uncovered = route_names() - {case_route(path) for _, path, _ in CASES}
+        if uncovered:
+            raise CommandError(f'routes without a benchmark case: {", ".join(sorted(uncovered))}')
+
+        results = {}
+        # the test clients always send Host: testserver
+        test_settings = override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], RESPONSE_CACHE_ENABLED=False, SLOW_REQUEST_MS=None)
+        with test_settings, transaction.atomic():
+            fixtures = self.make_fixtures()
+            bearer = f"Bearer {fixtures['access']}"
+            with override_settings(METRICS_TOKEN=fixtures['access']): # the same bearer reads /metrics
+                clients = {
+                    'sync': Client(HTTP_AUTHORIZATION=bearer),
+                    # async views go through an event loop on this thread, so their ORM calls share our connection
+                    # (and transaction) and show up in the query count
+                    'async': AsyncClient(), # its default headers don't reach the request in django 4.2, see run_case
+                }
+                self.stdout.write(f"{'case':<52} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'bytes':>9}")
+                for method, path, body in CASES:
+                    name = f'{method} {path}'
+                    if options['only'] and options['only'] not in path:
+                        continue
+                    client = clients['async' if path.startswith('/async/') else 'sync']
+                    results[name] = result = self.run_case(client, method, path, body, fixtures, options['iterations'])
+                    self.stdout.write(f"{name:<52} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+                                      f"{result['queries']:>8} {result['bytes']:>9}")
+            transaction.set_rollback(True)
+
+        if options['save_baseline']:
+            with open(options['baseline'], 'w') as baseline:
+                json.dump(results, baseline, indent=2, sort_keys=True)
+                baseline.write('\n')
+            self.stdout.write(f"baseline written to {options['baseline']}")
+            return
+        self.compare(results, options)
+
+    def make_fixtures(self):
+        user = User.objects.create_user('bench-endpoints', password='bench-password', is_staff=True)
+        game_names.load() # a warmed up worker's autocomplete index, not one still loading in the background
+        # a middling game, not the Zipf head with thousands of reviews on its detail page
+        stats = GameStats.objects.filter(review_count__gt=0).order_by('review_count', 'game_id')
+        middle = stats[stats.count() // 2] if stats.exists() else None
+        if middle is None:
+            raise CommandError('no reviewed games, run seed_synthetic first')
+        review = Review.objects.filter(game_id=middle.game_id).order_by('id').first()
+        game = {'name': 'Bench Game', 'genres': ['RPG'], 'description': 'benchmark', 'user': user.id,
+                'release_date': '2020-01-01T00:00:00Z', 'image_url': 'https://example.com/bench.png'}
+        review_body = {'score': 3, 'review': 'benchmark review', 'date_submitted': '2023-01-01',
+                       'user': user.id, 'game': middle.game_id}
+        return {
+            'game': middle.game_id,
+            'user': review.user_id,
+            'review': review.id,
+            'group': Group.objects.create(name='bench-endpoints').id,
+            'ids': ','.join(str(user_id) for user_id in User.objects.order_by('id').values_list('id', flat=True)[:20]),
+            'access': str(RefreshToken.for_user(user).access_token),
+            'refresh': str(RefreshToken.for_user(user)),
+            'logout_refresh': str(RefreshToken.for_user(user)), # its own, the refresh case's token has to stay valid
+            'bodies': {'game': game, 'review': review_body, 'batch': [review_body] * 20},
+        }
+
+    def run_case(self, client, method, path, body, fixtures, iterations):
+        url = path.format(**fixtures)
+        if isinstance(body, str):
+            body = fixtures['bodies'][body]
+        elif isinstance(body, dict):
+            body = {key: value.format(**fixtures) if isinstance(value, str) else value for key, value in body.items()}
+        send = getattr(client, method.lower())
+        if isinstance(client, AsyncClient):
+            send = async_to_sync(self.awaited(send, {'Authorization': f"Bearer {fixtures['access']}"}))
+
+        times, queries, size = [], [], 0
+        for iteration in range(iterations + 1): # the first one warms up
+            connection.queries_log.clear() # it holds 9000 queries, after that CaptureQueriesContext counts 0
+            with transaction.atomic(), CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = send(url, data=body, content_type='application/json') if body is not None else send(url)
+                content = b''.join(response.streaming_content) if response.streaming else response.content
+                elapsed = (time.perf_counter() - start) * 1000
+                transaction.set_rollback(True)
+            if response.status_code >= 400:
+                raise CommandError(f'{method} {url} answered {response.status_code}: {content[:200]!r}')
+            if iteration:
+                times.append(elapsed)
+                queries.append(len(captured))
+                size = len(content)
+        times.sort()
+        return {
+            'p50_ms': round(statistics.median(times), 3),
+            'p95_ms': round(percentile(times, 0.95), 3),
+            'p99_ms': round(percentile(times, 0.99), 3),
+            'queries': statistics.mode(queries), # not max, the odd request also syncs the revocation list
+            'bytes': size,
+        }
+
+    def awaited(self, send, headers):
+        async def call(*args, **kwargs):
+            return await send(*args, headers=headers, **kwargs)
+        return call
+
+    def compare(self, results, options):
+        try:
+            with open(options['baseline']) as baseline:
+                baseline = json.load(baseline)
+        except FileNotFoundError:
+            self.stdout.write(f"no baseline at {options['baseline']}, run with --save-baseline to make one")
+            return
+
+        failures = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                self.stdout.write(f'{name}: new, not in the baseline')
+                continue
+            if result['queries'] > before['queries']:
+                failures.append(f"{name}: {result['queries']} queries, baseline {before['queries']}")
+            allowed = max(before['p50_ms'] * (1 + options['latency_tolerance']), before['p50_ms'] + options['latency_floor_ms'])
+            if result['p50_ms'] > allowed:
+                failures.append(f"{name}: p50 {result['p50_ms']:.2f} ms, baseline {before['p50_ms']:.2f} ms")
+        if failures:
+            raise CommandError('regressions against the baseline:\n' + '\n'.join(failures))
+        self.stdout.write(f'{len(results)} cases within the baseline')
@@ -0,0 +1,85 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from main_app.aggregates import rebuild_genre_facets
+from main_app.models import GenreFacet
+
+GENRES = [
+    'Action', 'Adventure', 'RPG', 'Indie', 'Strategy', 'Simulation', 'Puzzle', 'Platformer', 'Shooter', 'Racing',
+    'Sports', 'Fighting', 'Horror', 'Survival', 'Roguelike', 'Metroidvania', 'Sandbox', 'Stealth', 'Rhythm', 'MMO',
+]
+
+UNNEST_SQL = """
+    SELECT genre, COUNT(*), SUM(s.review_count), SUM(s.score_sum)
+    FROM (SELECT DISTINCT id, unnest(genres) AS genre FROM main_app_game) g
+    LEFT JOIN main_app_gamestats s ON s.game_id = g.id
+    GROUP BY genre
+"""
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return statistics.median(times), times[min(len(times) - 1, int(len(times) * 0.99))]
+
+
+class Command(BaseCommand):
+    help = ('Times the genre facet read against unnesting the games table, at growing catalogue sizes. '
+            'Inserts synthetic games in a transaction that is rolled back at the end')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000,1000000', help='comma separated game counts')
+        parser.add_argument('--repeat', type=int, default=200, help='facet reads per size')
+        parser.add_argument('--unnest-repeat', type=int, default=5, help='full unnest aggregations per size')
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        self.stdout.write(f"{'games':>10} {'facets p50 ms':>14} {'facets p99 ms':>14} {'unnest p50 ms':>14}")
+
+        with transaction.atomic():
+            user = User.objects.create(username='bench-genre-facets')
+            inserted = 0
+            for size in sizes:
+                self.insert_games(user.id, size - inserted)
+                inserted = size
+                rebuild_genre_facets()
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE main_app_game; ANALYZE main_app_genrefacet')
+
+                facets_p50, facets_p99 = timed(
+                    lambda: list(GenreFacet.objects.filter(game_count__gt=0).order_by('-game_count', 'genre').values()),
+                    options['repeat'],
+                )
+                unnest_p50, _ = timed(self.unnest, options['unnest_repeat'])
+                self.stdout.write(f'{size:>10} {facets_p50:>14.3f} {facets_p99:>14.3f} {unnest_p50:>14.3f}')
+            transaction.set_rollback(True)
+
+    def insert_games(self, user_id, count):
+        # set based, 1-3 random genres a game and made up review totals
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                WITH new_games AS (
+                    INSERT INTO main_app_game (name, genres, description, release_date, image_url, user_id)
+                    SELECT 'bench game ' || n,
+                           ARRAY(SELECT (%s::text[])[1 + floor(random() * %s)::int] FROM generate_series(1, 1 + (n %% 3))),
+                           'synthetic', now() - (n %% 3650) * interval '1 day', 'https://example.com/bench.png', %s
+                    FROM generate_series(1, %s) AS n
+                    RETURNING id
+                )
+                INSERT INTO main_app_gamestats
+                    (game_id, review_count, score_sum, score_1, score_2, score_3, score_4, score_5, average_score)
+                SELECT id, 10, 35, 0, 2, 3, 3, 2, 3.5 FROM new_games
+            """, [GENRES, len(GENRES), user_id, count])
+
+    def unnest(self):
+        with connection.cursor() as cursor:
+            cursor.execute(UNNEST_SQL)
+            cursor.fetchall()
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from main_app.models import Game
+
+# what each server mode gets hit with: the DRF views under wsgi, their async copies under asgi
+ENDPOINTS = {
+    'wsgi': ['/games/', '/games/{game}/', '/reviews/', '/users/{user}/'],
+    'asgi': ['/async/games/', '/async/games/{game}/', '/async/reviews/', '/async/users/{user}/'],
+}
+
+
+class Command(BaseCommand):
+    help = ('Load test: starts gunicorn in each SERVER_MODE (see gunicorn.conf.py) against the configured database, '
+            'drives the read endpoints at rising concurrency over keep-alive connections and reports throughput '
+            'and p99 latency. Run it against a local postgres with some data in it (seed it first)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', default='wsgi,asgi')
+        parser.add_argument('--concurrency', default='1,8,32,128', help='comma separated client counts')
+        parser.add_argument('--duration', type=float, default=10, help='seconds per concurrency level')
+        parser.add_argument('--workers', type=int, default=4, help='gunicorn workers, the same for every mode')
+        parser.add_argument('--port', type=int, default=8765)
+
+    def handle(self, *args, **options):
+        game = Game.objects.order_by('id').values_list('id', flat=True).first()
+        if game is None:
+            raise CommandError('no games in the database, there is nothing to load test')
+        user, _ = User.objects.get_or_create(username='bench-load') # committed, the servers are other processes
+        paths = {mode: [path.format(game=game, user=user.id) for path in paths] for mode, paths in ENDPOINTS.items()}
+        headers = f'Host: localhost\r\nAuthorization: Bearer {RefreshToken.for_user(user).access_token}\r\n'
+        levels = [int(level) for level in options['concurrency'].split(',')]
+
+        try:
+            self.stdout.write(f"{'mode':<6} {'clients':>8} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>9} {'errors':>7}")
+            for mode in options['modes'].split(','):
+                if mode not in ENDPOINTS:
+                    raise CommandError(f'unknown mode {mode}, pick from {", ".join(ENDPOINTS)}')
+                server = self.start_server(mode, options['workers'], options['port'])
+                try:
+                    for level in levels:
+                        requests, errors, times = asyncio.run(
+                            self.run_level(options['port'], paths[mode], headers, level, options['duration']))
+                        times.sort()
+                        p50 = times[len(times) // 2] if times else 0
+                        p99 = times[min(len(times) - 1, int(len(times) * 0.99))] if times else 0
+                        self.stdout.write(f'{mode:<6} {level:>8} {requests / options["duration"]:>9.0f} '
+                                          f'{p50:>8.2f} {p99:>9.2f} {errors:>7}')
+                finally:
+                    server.terminate()
+                    server.wait(timeout=30)
+        finally:
+            user.delete()
+
+    def start_server(self, mode, workers, port):
+        env = {
+            **os.environ, 'SERVER_MODE': mode, 'PORT': str(port), 'WEB_CONCURRENCY': str(workers),
+            'RESPONSE_CACHE_ENABLED': 'false', # the async views aren't cached, keep it like for like
+        }
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--log-level', 'warning'],
+            cwd=settings.BASE_DIR, env=env,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'gunicorn ({mode}) exited with {server.returncode}')
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return server
+            except OSError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError(f'gunicorn ({mode}) did not start listening on {port}')
+
+    async def run_level(self, port, paths, headers, clients, duration):
+        stop_at = time.monotonic() + duration
+        results = await asyncio.gather(*(self.client(port, paths, headers, number, stop_at) for number in range(clients)))
+        times = [elapsed for client_times, _ in results for elapsed in client_times]
+        return len(times), sum(errors for _, errors in results), times
+
+    async def client(self, port, paths, headers, number, stop_at):
+        # one connection per client, reused while the server keeps it open (sync gunicorn workers don't)
+        times, errors = [], 0
+        reader = writer = None
+        sent = number # each client starts on a different endpoint so the mix is even at any concurrency
+        while time.monotonic() < stop_at:
+            path = paths[sent % len(paths)]
+            sent += 1
+            start = time.perf_counter()
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                writer.write(f'GET {path} HTTP/1.1\r\n{headers}\r\n'.encode())
+                status, keep_alive = await self.read_response(reader)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                errors += 1
+                writer = None
+                continue
+            if status == 200:
+                times.append((time.perf_counter() - start) * 1000)
+            else:
+                errors += 1
+            if not keep_alive:
+                writer.close()
+                writer = None
+        if writer is not None:
+            writer.close()
+        return times, errors
+
+    async def read_response(self, reader):
+        head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+        status = int(head[0].split()[1])
+        fields = dict(line.split(':', 1) for line in head[1:] if ':' in line)
+        fields = {name.strip().lower(): value.strip().lower() for name, value in fields.items()}
+        if fields.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await reader.readline()).strip(), 16)
+                await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        elif 'content-length' in fields:
+            await reader.readexactly(int(fields['content-length']))
+        else:
+            await reader.read() # no length, the body ends when the server closes
+            return status, False
+        return status, fields.get('connection') != 'close'
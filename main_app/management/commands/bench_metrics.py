@@ -0,0 +1,77 @@
+import statistics
+import time
+from datetime import date, datetime, timezone
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client, override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from main_app.models import Game, Review
+
+METRICS_MIDDLEWARE = 'main_app.metrics.metrics_middleware'
+
+
+class Command(BaseCommand):
+    help = ('Measures what the /metrics instrumentation costs: the same requests with the metrics middleware on and '
+            'off, alternating rounds so drift hits both. Test data is rolled back')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=10)
+        parser.add_argument('--requests', type=int, default=100, help='per endpoint per round')
+        parser.add_argument('--endpoints', default='/games/,/games/{game}/,/reviews/,/genres/')
+        parser.add_argument('--max-overhead', type=float, help='fail if the overhead is above this many percent')
+
+    def handle(self, *args, **options):
+        if METRICS_MIDDLEWARE not in settings.MIDDLEWARE:
+            raise CommandError('metrics are off (METRICS_ENABLED), nothing to measure')
+        without = [name for name in settings.MIDDLEWARE if name != METRICS_MIDDLEWARE]
+
+        with transaction.atomic():
+            user = User.objects.create(username='bench-metrics')
+            game = self.make_data(user)
+            endpoints = [endpoint.format(game=game.id) for endpoint in options['endpoints'].split(',')]
+            bearer = f'Bearer {RefreshToken.for_user(user).access_token}'
+            clients = {}
+            for name, middleware in (('on', settings.MIDDLEWARE), ('off', without)):
+                with override_settings(MIDDLEWARE=middleware):
+                    clients[name] = Client(HTTP_HOST='localhost', HTTP_AUTHORIZATION=bearer)
+                    self.run_round(clients[name], endpoints, 1) # the client builds its middleware chain now, and keeps it
+
+            totals = {'on': [], 'off': []}
+            for round_number in range(options['rounds']):
+                order = ('on', 'off') if round_number % 2 else ('off', 'on')
+                for name in order:
+                    totals[name].append(self.run_round(clients[name], endpoints, options['requests']))
+            transaction.set_rollback(True)
+
+        requests = len(endpoints) * options['requests']
+        on, off = statistics.median(totals['on']), statistics.median(totals['off'])
+        overhead = (on - off) / off * 100
+        self.stdout.write(f'metrics off: {off / requests * 1000:.3f} ms/request')
+        self.stdout.write(f'metrics on:  {on / requests * 1000:.3f} ms/request')
+        self.stdout.write(f'overhead:    {overhead:+.2f}%')
+        if options['max_overhead'] is not None and overhead > options['max_overhead']:
+            raise CommandError(f"overhead {overhead:.2f}% is over {options['max_overhead']}%")
+
+    def make_data(self, user):
+        games = [
+            Game.objects.create(name=f'bench metrics {n}', genres=['RPG'], description='synthetic',
+                                release_date=datetime(2020, 1, 1, tzinfo=timezone.utc),
+                                image_url='https://example.com/bench.png', user=user)
+            for n in range(20)
+        ]
+        for n in range(20):
+            Review.objects.create(game=games[0], user=user, score=n % 5 + 1, review='fine', date_submitted=date(2023, 1, 1))
+        return games[0]
+
+    def run_round(self, client, endpoints, count):
+        start = time.perf_counter()
+        for endpoint in endpoints:
+            for _ in range(count):
+                response = client.get(endpoint)
+                if response.status_code != 200:
+                    raise CommandError(f'{endpoint} answered {response.status_code}')
+        return time.perf_counter() - start
@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from main_app.fast_serializers import game_rows, review_rows, serialize_games, serialize_reviews_with_reviewer
+from main_app.models import Game, Review
+from main_app.renderers import FastJSONRenderer
+from main_app.serializers import GameSerializer, ReviewWithReviewerSerializer
+
+
+class Command(BaseCommand):
+    help = ('Rows/sec of the DRF serializers + JSONRenderer against the .values() serializers + FastJSONRenderer '
+            '(main_app/fast_serializers.py, main_app/renderers.py) on the current database, split into fetching, '
+            'serializing and rendering. Fails if the two paths ever give different bytes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000, help='rows per run')
+        parser.add_argument('--rounds', type=int, default=5, help='best of this many runs')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        games = Game.objects.order_by('id')[:rows]
+        reviews = Review.objects.order_by('-date_submitted', '-id')[:rows]
+        cases = [
+            ('games', {
+                'serializer': (lambda: list(games.select_related('stats')), lambda page: GameSerializer(page, many=True).data, JSONRenderer()),
+                'fast': (lambda: list(game_rows(games)), serialize_games, FastJSONRenderer()),
+            }),
+            ('reviews + reviewer', {
+                'serializer': (lambda: list(reviews.select_related('user')), lambda page: ReviewWithReviewerSerializer(page, many=True).data, JSONRenderer()),
+                'fast': (lambda: list(review_rows(reviews, reviewer=True)), serialize_reviews_with_reviewer, FastJSONRenderer()),
+            }),
+        ]
+
+        self.stdout.write(f"{'case':<20} {'path':<11} {'rows':>6} {'fetch/s':>10} {'serialize/s':>12} {'render/s':>10} {'total/s':>10}")
+        for name, paths in cases:
+            rendered = {}
+            for path, (fetch, serialize, renderer) in paths.items():
+                best = None
+                for _ in range(options['rounds']):
+                    start = time.perf_counter()
+                    page = fetch()
+                    fetched = time.perf_counter()
+                    data = serialize(page)
+                    serialized = time.perf_counter()
+                    rendered[path] = renderer.render(data)
+                    done = time.perf_counter()
+                    timings = (fetched - start, serialized - fetched, done - serialized, done - start)
+                    best = timings if best is None else tuple(map(min, best, timings))
+                if not page:
+                    raise CommandError(f'no {name} in the database, seed it first (seed_synthetic)')
+                self.stdout.write(f'{name:<20} {path:<11} {len(page):>6} ' +
+                                  ' '.join(f'{len(page) / seconds:>{width}.0f}' for seconds, width in zip(best, (10, 12, 10, 10))))
+            if rendered['fast'] != rendered['serializer']:
+                raise CommandError(f'{name}: the fast path rendered different bytes than the serializers')
@@ -0,0 +1,48 @@
+import resource
+import time
+import tracemalloc
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from main_app import similar
+
+
+class Command(BaseCommand):
+    help = ('Times loading the game and review vectors of main_app/similar.py from the current database and scoring '
+            'every game at each --chunk-sizes, and the memory each takes. Nothing is written. For the numbers in '
+            'the README: seed_synthetic --reviews 10000000 --games 100000')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-sizes', default='16,64,256,1024')
+        parser.add_argument('--games', type=int, help='score only this many games (spread over all of them) and extrapolate')
+        parser.add_argument('--top-k', type=int, default=similar.TOP_K)
+
+    def handle(self, *args, **options):
+        tracemalloc.start() # numpy reports its arrays to tracemalloc
+        start = time.perf_counter()
+        ids, genres = similar.load_games()
+        reviews = similar.load_reviews(ids)
+        loaded = time.perf_counter() - start
+        if not len(ids):
+            raise CommandError('no games, run seed_synthetic first')
+        vectors = genres.nbytes + reviews.data.nbytes + reviews.indices.nbytes + reviews.indptr.nbytes
+        self.stdout.write(f'{len(ids)} games, {reviews.nnz} game/reviewer pairs (3s left out) from {reviews.shape[1]} users, '
+                          f'{genres.shape[1]} genres: loaded in {loaded:.1f}s, {vectors / 2 ** 20:.0f} MiB of vectors, '
+                          f'load peak {tracemalloc.get_traced_memory()[1] / 2 ** 20:.0f} MiB')
+
+        rows = np.arange(len(ids))
+        if options['games'] and options['games'] < len(ids):
+            rows = np.linspace(0, len(ids) - 1, options['games']).astype(np.intp)
+        for chunk_size in [int(size) for size in options['chunk_sizes'].split(',')]:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            for _ in similar.nearest(genres, reviews, rows, top_k=options['top_k'], chunk_size=chunk_size):
+                pass
+            elapsed = (time.perf_counter() - start) * len(ids) / len(rows)
+            peak = tracemalloc.get_traced_memory()[1] - base
+            self.stdout.write(f'chunks of {chunk_size}: all {len(ids)} games in {elapsed:.1f}s '
+                              f'({len(ids) / elapsed:.0f} games/s), {peak / 2 ** 20:.0f} MiB on top of the vectors')
+        tracemalloc.stop()
+        self.stdout.write(f'peak process memory {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB')
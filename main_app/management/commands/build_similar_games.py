@@ -0,0 +1,27 @@
+import resource
+import time
+
+from django.core.management.base import BaseCommand
+
+from main_app import similar
+
+
+class Command(BaseCommand):
+    help = ('Recomputes /games/<id>/similar/ for every game (main_app/similar.py). Review writes only redo the '
+            'games they touched, run this nightly so the other games catch up with them')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, nargs='+', help='just these game ids')
+        parser.add_argument('--top-k', type=int, default=similar.TOP_K, help='neighbours kept per game')
+        parser.add_argument('--genre-weight', type=float, default=similar.GENRE_WEIGHT,
+                            help='share of the similarity that comes from genres, the rest is from reviews')
+        parser.add_argument('--chunk-size', type=int, default=similar.CHUNK_SIZE, help='games scored at a time')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        saved = similar.build_similar_games(
+            options['games'], top_k=options['top_k'], genre_weight=options['genre_weight'],
+            chunk_size=options['chunk_size'], report=lambda stage, seconds: self.stdout.write(f'{stage}: {seconds:.1f}s'),
+        )
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # kilobytes on linux
+        self.stdout.write(f'{saved} games in {time.perf_counter() - started:.1f}s, peak memory {peak:.0f} MiB')
@@ -0,0 +1,37 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from main_app.exports import CHUNK_SIZE, EXPORTS, FORMATS, stream_export
+
+
+class Command(BaseCommand):
+    help = ('Dumps games, reviews or per-game stats as NDJSON or CSV, the same as /export/ but without going through '
+            'a worker. Memory stays flat however many rows there are. --after <last key written> resumes a dump')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(EXPORTS))
+        parser.add_argument('--format', choices=list(FORMATS), default='ndjson')
+        parser.add_argument('--output', help='file to write (appended to with --after), defaults to stdout')
+        parser.add_argument('--game', type=int)
+        parser.add_argument('--user', type=int)
+        parser.add_argument('--since', type=date.fromisoformat, help='YYYY-MM-DD')
+        parser.add_argument('--until', type=date.fromisoformat, help='YYYY-MM-DD')
+        parser.add_argument('--after', type=int, help='only rows with a higher key (id, game id for game-stats)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='rows per fetch from the cursor')
+
+    def handle(self, *args, **options):
+        filters = {name: options[name] for name in ('game', 'user', 'since', 'until', 'after') if options[name] is not None}
+        chunks = stream_export(options['kind'], options['format'], chunk_size=options['chunk_size'], **filters)
+        if options['format'] == 'csv' and options['after'] is not None:
+            next(chunks) # the header is already at the top of the file being resumed
+        output = open(options['output'], 'ab' if options['after'] is not None else 'wb') if options['output'] else None
+        try:
+            for chunk in chunks:
+                if output:
+                    output.write(chunk)
+                else:
+                    self.stdout.write(chunk.decode(), ending='')
+        finally:
+            if output:
+                output.close()
@@ -0,0 +1,149 @@
+import csv
+import json
+import os
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from main_app.aggregates import rebuild_genre_facets
+from main_app.jobs import enqueue
+from main_app.models import Game, GameNameChange, GameStats
+from main_app.response_cache import bump_on_commit
+from main_app.serializers import GameImportSerializer
+
+UPDATED_FIELDS = ['name', 'genres', 'description', 'release_date', 'image_url']
+
+
+class Command(BaseCommand):
+    help = ('Streams games from a JSONL or CSV dump (name, genres, description, release_date, image_url) into the '
+            'catalogue with batched upserts. Games with the same normalized name and release date are updated, not '
+            'duplicated. Progress is checkpointed after every batch, rerun the same command to resume')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--user', required=True, help='username the imported games are registered under')
+        parser.add_argument('--format', choices=['jsonl', 'csv'], help='defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--genre-separator', default='|', help='how genres are joined in a CSV column')
+        parser.add_argument('--checkpoint', help='defaults to <path>.checkpoint')
+        parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and start from the top')
+        parser.add_argument('--rejects', help='write rejected rows and why to this JSONL file')
+
+    def handle(self, *args, **options):
+        try:
+            self.user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"no user called {options['user']}")
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        self.genre_separator = options['genre_separator']
+        self.verbosity = options['verbosity']
+        self.checkpoint_path = options['checkpoint'] or f'{path}.checkpoint'
+        done = 0 if options['restart'] else self.read_checkpoint()
+        self.validator = GameImportSerializer() # one instance for every row, binding the fields is the slow part
+        self.rejects = open(options['rejects'], 'a') if options['rejects'] else None
+        self.imported = self.rejected = 0
+        self.started = time.perf_counter()
+
+        if done:
+            self.stdout.write(f'resuming after record {done}')
+        try:
+            with open(path, newline='', encoding='utf-8') as source:
+                records = self.read_csv(source) if file_format == 'csv' else self.read_jsonl(source)
+                batch = []
+                for number, record in enumerate(records, start=1):
+                    if number <= done:
+                        continue
+                    batch.append((number, record))
+                    if len(batch) == options['batch_size']:
+                        self.import_batch(batch)
+                        batch = []
+                if batch:
+                    self.import_batch(batch)
+        finally:
+            if self.rejects:
+                self.rejects.close()
+
+        rebuild_genre_facets() # one recount beats adjusting it row by row through a bulk upsert
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        self.report(final=True)
+
+    def read_jsonl(self, source):
+        for line in source:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield line # rejected as not an object
+
+    def read_csv(self, source):
+        for row in csv.DictReader(source):
+            genres = row.get('genres') or ''
+            row['genres'] = [genre.strip() for genre in genres.split(self.genre_separator) if genre.strip()]
+            yield row
+
+    def import_batch(self, batch):
+        games = {}
+        for number, record in batch:
+            try:
+                if not isinstance(record, dict):
+                    raise ValidationError({'record': 'not a JSON object'})
+                data = self.validator.run_validation(record)
+            except ValidationError as error:
+                self.reject(number, record, error.detail)
+                continue
+            game = Game(user=self.user, **data)
+            game.import_key = Game.make_import_key(game.name, game.release_date)
+            games[game.import_key] = game # later rows in the file win over earlier duplicates
+
+        if games:
+            with transaction.atomic():
+                Game.objects.bulk_create(
+                    games.values(),
+                    update_conflicts=True,
+                    unique_fields=['import_key'],
+                    update_fields=UPDATED_FIELDS,
+                )
+                # bulk_create skips the signals, so the stats rows and cache versions are done here
+                game_ids = list(Game.objects.filter(import_key__in=games).values_list('id', flat=True))
+                GameStats.objects.bulk_create([GameStats(game_id=game_id) for game_id in game_ids], ignore_conflicts=True)
+                GameNameChange.objects.bulk_create([GameNameChange(game_id=game_id) for game_id in game_ids]) # for autocomplete.py
+                enqueue(*(('similar-games', game_id) for game_id in game_ids), ('user-stats', self.user.id)) # genres, games added
+                for game_id in game_ids:
+                    bump_on_commit('game', game_id)
+                bump_on_commit('user', self.user.id)
+
+        self.imported += len(games)
+        self.write_checkpoint(batch[-1][0])
+        self.report()
+
+    def reject(self, number, record, errors):
+        self.rejected += 1
+        if self.rejects:
+            self.rejects.write(json.dumps({'record_number': number, 'errors': errors, 'record': record}, default=str) + '\n')
+        elif self.verbosity > 1:
+            self.stderr.write(f'record {number} rejected: {errors}')
+
+    def read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as checkpoint:
+                return json.load(checkpoint)['records_done']
+        except FileNotFoundError:
+            return 0
+
+    def write_checkpoint(self, records_done):
+        # written only once the batch is committed. a crash in between redoes the batch, which the upsert makes harmless
+        temporary = f'{self.checkpoint_path}.tmp'
+        with open(temporary, 'w') as checkpoint:
+            json.dump({'records_done': records_done}, checkpoint)
+        os.replace(temporary, self.checkpoint_path)
+
+    def report(self, final=False):
+        elapsed = time.perf_counter() - self.started
+        rate = (self.imported + self.rejected) / elapsed if elapsed else 0
+        message = f'{self.imported} imported, {self.rejected} rejected, {rate:.0f} rows/s'
+        self.stdout.write(('done: ' if final else '') + message)
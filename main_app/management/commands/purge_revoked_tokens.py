@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main_app.models import RevokedToken
+
+
+class Command(BaseCommand):
+    help = 'Deletes revoked tokens that have expired anyway. Run it from cron, daily is plenty'
+
+    def handle(self, *args, **options):
+        deleted, _ = RevokedToken.objects.filter(expires_at__lte=timezone.now()).delete()
+        self.stdout.write(f'{deleted} expired revoked tokens deleted')
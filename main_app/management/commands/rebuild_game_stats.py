@@ -0,0 +1,54 @@
+import math
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from main_app.aggregates import compute_game_stats, rebuild_game_stats
+from main_app.models import Game, GameStats
+
+COMPARED_FIELDS = ['review_count', 'score_sum', 'last_review_date', *GameStats.SCORE_FIELDS.values()]
+
+
+class Command(BaseCommand):
+    help = 'Recounts the per-game review stats from the reviews table, or with --verify just checks them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='report games whose stats are wrong without fixing them')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        game_ids = Game.objects.order_by('id').values_list('id', flat=True)
+        last_id = 0
+        checked = wrong = 0
+
+        while True: # walk the games in id order so memory stays the same however big the table gets
+            batch = list(game_ids.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1]
+
+            with transaction.atomic():
+                stored = GameStats.objects.select_for_update().in_bulk(batch) # holds off game-stats jobs while we compare
+                expected = compute_game_stats(batch)
+                bad = [game_id for game_id, stats in expected.items() if not self.matches(stored.get(game_id), stats)]
+                if bad and not options['verify']:
+                    rebuild_game_stats(bad)
+
+            for game_id in bad:
+                self.stdout.write(f'game {game_id}: stats were wrong' + ('' if options['verify'] else ', rebuilt'))
+            checked += len(batch)
+            wrong += len(bad)
+
+        self.stdout.write(f'{checked} games checked, {wrong} wrong')
+        if wrong and options['verify']:
+            raise CommandError(f'{wrong} games have stale stats, run without --verify to fix them')
+
+    def matches(self, stored, expected):
+        if stored is None:
+            return False
+        if (stored.average_score is None) != (expected.average_score is None):
+            return False
+        if stored.average_score is not None and not math.isclose(stored.average_score, expected.average_score):
+            return False # isclose, postgres and python can disagree on the last bit of a float division
+        return all(getattr(stored, field) == getattr(expected, field) for field in COMPARED_FIELDS)
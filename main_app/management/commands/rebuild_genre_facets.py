@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from main_app.aggregates import rebuild_genre_facets
+from main_app.models import GenreFacet
+
+
+class Command(BaseCommand):
+    help = 'Recounts the genre facet table (games, reviews and average score per genre) from the games table'
+
+    def handle(self, *args, **options):
+        rebuild_genre_facets()
+        self.stdout.write(f'{GenreFacet.objects.count()} genres counted')
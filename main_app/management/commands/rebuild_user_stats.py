@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main_app.aggregates import rebuild_user_stats
+
+
+class Command(BaseCommand):
+    help = ('Recounts the profile stats (UserStats) from the reviews and games tables. Writes keep them current through '
+            'the job queue, run this after raw imports and nightly so favourite genres follow games changing genre')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, nargs='+', help='just these user ids')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = rebuild_user_stats(options['users'])
+        self.stdout.write(f'{count} users counted in {time.perf_counter() - started:.1f}s')
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main_app.models import GameRanking
+from main_app import rankings
+
+
+class Command(BaseCommand):
+    help = ('Recomputes the /games/top/ and /games/trending/ leaderboards (overall and per genre). '
+            'Run it from cron, every few minutes for trending, the endpoints only ever read its output')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=[kind for kind, _ in GameRanking.KIND_CHOICES], help='just this one')
+        parser.add_argument('--prior-reviews', type=int, default=rankings.PRIOR_REVIEWS,
+                            help='reviews at the average score every game starts with, for the bayesian average')
+        parser.add_argument('--size', type=int, default=rankings.SIZE, help='games kept per leaderboard')
+        parser.add_argument('--window-days', type=int, default=rankings.TRENDING_WINDOW_DAYS, help='trending window')
+
+    def handle(self, *args, **options):
+        kinds = [options['kind']] if options['kind'] else [kind for kind, _ in GameRanking.KIND_CHOICES]
+        started = time.perf_counter()
+        counts = rankings.refresh_rankings(kinds, prior=options['prior_reviews'], size=options['size'],
+                                           window_days=options['window_days'])
+        for kind, count in counts.items():
+            self.stdout.write(f'{kind}: {count} ranking rows')
+        self.stdout.write(f'done in {time.perf_counter() - started:.1f}s')
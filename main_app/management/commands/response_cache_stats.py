@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from main_app.response_cache import get_counters
+
+
+class Command(BaseCommand):
+    help = 'Prints the response cache hit/miss counters (shared by all workers)'
+
+    def handle(self, *args, **options):
+        counters = get_counters()
+        served = counters['hits'] + counters['not_modified']
+        total = served + counters['misses']
+        for name, value in counters.items():
+            self.stdout.write(f'{name}: {value}')
+        if total:
+            self.stdout.write(f'hit ratio: {served / total:.1%}')
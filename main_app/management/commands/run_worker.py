@@ -0,0 +1,56 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from prometheus_client import start_http_server
+
+from main_app.jobs import batches, claim, release, run_batch
+
+
+class Command(BaseCommand):
+    help = ('Runs the queued jobs (main_app/jobs.py): game stats and genre totals after review writes, the '
+            'leaderboards, similar games. Run as many as you like, on as many machines, they never get the same job. '
+            'SIGTERM or Ctrl-C stops it after the job it is on')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20, help='jobs claimed at a time')
+        parser.add_argument('--poll-seconds', type=float, default=1, help='how long to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help="run what's due and exit, for cron or a deploy step")
+        parser.add_argument('--metrics-port', type=int, help='serve this process\'s job metrics on this port, '
+                            'not needed with PROMETHEUS_MULTIPROC_DIR')
+
+    def handle(self, *args, **options):
+        if options['metrics_port']:
+            start_http_server(options['metrics_port'])
+        self.stopping = False
+        previous = {signum: signal.signal(signum, self.stop) for signum in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            outcomes = self.work(options)
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        self.stdout.write(', '.join(f'{count} {outcome}' for outcome, count in sorted(outcomes.items())) or 'no jobs')
+
+    def work(self, options):
+        outcomes = {}
+        while not self.stopping:
+            jobs = claim(options['batch_size'])
+            groups = list(batches(jobs))
+            for position, group in enumerate(groups):
+                if self.stopping:
+                    release([job for rest in groups[position:] for job in rest])
+                    break
+                for job, outcome in zip(group, run_batch(group)):
+                    outcomes[outcome] = outcomes.get(outcome, 0) + 1
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f'{job.kind} job for {job.target_id}: {outcome}')
+            if not jobs:
+                if options['once']:
+                    break
+                close_old_connections() # what the end of a request does, a dropped connection isn't kept around
+                time.sleep(options['poll_seconds'])
+        return outcomes
+
+    def stop(self, signum, frame):
+        self.stopping = True
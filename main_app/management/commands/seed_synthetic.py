@@ -0,0 +1,173 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from main_app.aggregates import rebuild_genre_facets, rebuild_user_stats
+from main_app.management.commands.bench_genre_facets import GENRES
+from main_app.models import GameNameChange
+from main_app.rankings import refresh_rankings
+from main_app.similar import build_similar_games
+
+ADJECTIVES = [
+    'Crimson', 'Hollow', 'Eternal', 'Pixel', 'Silent', 'Iron', 'Neon', 'Lost', 'Broken', 'Golden', 'Shadow', 'Wild',
+    'Frozen', 'Ancient', 'Cosmic', 'Tiny', 'Last', 'Burning', 'Hidden', 'Electric',
+]
+NOUNS = [
+    'Kingdom', 'Knight', 'Odyssey', 'Frontier', 'Dungeon', 'Garden', 'Legacy', 'Horizon', 'Citadel', 'Voyage',
+    'Harvest', 'Protocol', 'Tower', 'Engine', 'Archive', 'Rebellion', 'Lantern', 'Circuit', 'Requiem', 'Island',
+]
+SUFFIXES = ['', '', '', '', ' II', ' III', ': Remastered', ' Origins', ' Deluxe', ' Zero']
+PHRASES = [
+    'Great soundtrack.', 'The controls feel tight.', 'Way too short for the price.', 'I lost a whole weekend to this.',
+    'The story drags in the middle.', 'Gorgeous pixel art.', 'Crashed twice on me.', 'Best co-op I have played in years.',
+    'The difficulty spikes are brutal.', 'A bit repetitive after the first few hours.', 'Boss fights are the highlight.',
+    'Needs a better tutorial.', 'Runs fine on old hardware.', 'Writing is sharp and funny.', 'Not my genre but it won me over.',
+]
+
+
+class Command(BaseCommand):
+    help = ('Fills the database with synthetic users, games and reviews for benchmarking. Reviews follow a Zipf '
+            'distribution over games (a few hits, a long tail), everything is inserted set based in batches. '
+            'Game and user stats, genre facets, rankings, similar games and the autocomplete index are brought up to date at the end')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reviews', type=int, default=10000, help='10k for a laptop, up to 10M')
+        parser.add_argument('--games', type=int, help='defaults to reviews / 50')
+        parser.add_argument('--users', type=int, help='defaults to reviews / 20')
+        parser.add_argument('--zipf', type=float, default=1.1, help='exponent of the review distribution over games')
+        parser.add_argument('--seed', type=float, default=0.42, help='same seed, same data (between -1 and 1)')
+        parser.add_argument('--prefix', default='synthetic', help='usernames start with this')
+        parser.add_argument('--batch-size', type=int, default=200000, help='reviews per INSERT')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('seed_synthetic needs postgres')
+        reviews = options['reviews']
+        games = options['games'] or max(50, reviews // 50)
+        users = options['users'] or max(100, reviews // 20)
+        self.started = time.perf_counter()
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT setseed(%s)', [options['seed']])
+            self.insert_users(cursor, options['prefix'], users)
+            self.insert_games(cursor, games)
+            done = 0
+            while done < reviews:
+                count = min(options['batch_size'], reviews - done)
+                self.insert_reviews(cursor, done, count, games, users, options['zipf'])
+                done += count
+                self.report(f'{done} reviews')
+            self.update_stats(cursor)
+            cursor.execute('DROP TABLE seed_users, seed_games')
+            cursor.execute('ANALYZE auth_user; ANALYZE main_app_game; ANALYZE main_app_review; ANALYZE main_app_gamestats')
+        rebuild_genre_facets()
+        refresh_rankings()
+        build_similar_games()
+        self.report('similar games')
+        rebuild_user_stats()
+        self.report('user stats')
+        GameNameChange.objects.create(game_id=None) # running workers reload their autocomplete index
+
+        self.report(f'done: {users} users, {games} games, {reviews} reviews')
+
+    def insert_users(self, cursor, prefix, count):
+        cursor.execute("SELECT COUNT(*) FROM auth_user WHERE username LIKE %s", [f'{prefix}-user-%'])
+        first = cursor.fetchone()[0] + 1 # rerunning adds more users instead of colliding with the last run
+        cursor.execute("""
+            CREATE TEMP TABLE seed_users AS
+            WITH new_users AS (
+                INSERT INTO auth_user (password, is_superuser, username, first_name, last_name, email, is_staff, is_active, date_joined)
+                SELECT '!', false, %(prefix)s || '-user-' || n, '', '', %(prefix)s || '-user-' || n || '@example.com',
+                       false, true, now() - random() * interval '1095 days'
+                FROM generate_series(%(first)s, %(last)s) AS n
+                RETURNING id
+            )
+            SELECT row_number() OVER () AS rank, id FROM new_users
+        """, {'prefix': prefix, 'first': first, 'last': first + count - 1})
+        cursor.execute('CREATE UNIQUE INDEX ON seed_users (rank)')
+        self.report(f'{count} users')
+
+    def insert_games(self, cursor, count):
+        # ranked in random order, so the popular games aren't simply the oldest ids
+        cursor.execute("""
+            CREATE TEMP TABLE seed_games AS
+            WITH new_games AS (
+                INSERT INTO main_app_game (name, genres, description, release_date, image_url, user_id)
+                SELECT (%(adjectives)s::text[])[1 + floor(random() * %(adjective_count)s)::int] || ' ' ||
+                       (%(nouns)s::text[])[1 + floor(random() * %(noun_count)s)::int] ||
+                       (%(suffixes)s::text[])[1 + floor(random() * %(suffix_count)s)::int],
+                       ARRAY(SELECT DISTINCT (%(genres)s::text[])[1 + floor(random() * %(genre_count)s)::int]
+                             FROM generate_series(1, 1 + n %% 3)),
+                       'A synthetic game for benchmarks.',
+                       now() - random() * interval '7300 days',
+                       'https://example.com/synthetic.png',
+                       u.id
+                FROM generate_series(1, %(count)s) AS n
+                JOIN seed_users u ON u.rank = 1 + (n * 7919) %% (SELECT COUNT(*) FROM seed_users)
+                RETURNING id
+            )
+            SELECT row_number() OVER (ORDER BY random()) AS rank, id FROM new_games
+        """, {
+            'adjectives': ADJECTIVES, 'adjective_count': len(ADJECTIVES), 'nouns': NOUNS, 'noun_count': len(NOUNS),
+            'suffixes': SUFFIXES, 'suffix_count': len(SUFFIXES), 'genres': GENRES, 'genre_count': len(GENRES),
+            'count': count,
+        })
+        cursor.execute('CREATE UNIQUE INDEX ON seed_games (rank)')
+        cursor.execute('INSERT INTO main_app_gamestats (game_id, review_count, score_sum, score_1, score_2, score_3, score_4, score_5) '
+                       'SELECT id, 0, 0, 0, 0, 0, 0, 0 FROM seed_games')
+        self.report(f'{count} games')
+
+    def insert_reviews(self, cursor, done, count, games, users, zipf):
+        # game rank by inverse transform sampling of a (continuous) Zipf distribution. each game gets a quality
+        # from its id so its scores cluster instead of averaging out at 3
+        if zipf == 1:
+            game_rank = 'floor(power(%(games)s, random()))::int'
+        else:
+            game_rank = 'least(%(games)s, floor(power((power(%(games)s + 1, 1 - %(zipf)s) - 1) * random() + 1, 1 / (1 - %(zipf)s)))::int)'
+        cursor.execute(f"""
+            INSERT INTO main_app_review (score, review, date_submitted, user_id, game_id)
+            SELECT least(5, greatest(1, round(1 + 4 * ((g.id * 2654435761) %% 1000) / 1000.0 + (random() - 0.5) * 2)))::int,
+                   (%(phrases)s::text[])[1 + floor(random() * %(phrase_count)s)::int] || ' ' ||
+                   (%(phrases)s::text[])[1 + floor(random() * %(phrase_count)s)::int],
+                   current_date - floor(random() * 1095)::int,
+                   u.id,
+                   g.id
+            FROM (
+                SELECT {game_rank} AS game_rank, 1 + floor(random() * %(users)s)::int AS user_rank
+                FROM generate_series(%(first)s, %(last)s)
+            ) AS picks
+            JOIN seed_games g ON g.rank = picks.game_rank
+            JOIN seed_users u ON u.rank = picks.user_rank
+        """, {
+            'phrases': PHRASES, 'phrase_count': len(PHRASES), 'games': games, 'users': users, 'zipf': zipf,
+            'first': done + 1, 'last': done + count,
+        })
+
+    def update_stats(self, cursor):
+        # the signals don't see raw inserts, recount the seeded games in one pass (same as migration 0003)
+        cursor.execute("""
+            UPDATE main_app_gamestats s
+            SET review_count = c.review_count, score_sum = c.score_sum, score_1 = c.score_1, score_2 = c.score_2,
+                score_3 = c.score_3, score_4 = c.score_4, score_5 = c.score_5, last_review_date = c.last_review_date,
+                average_score = c.score_sum::float8 / NULLIF(c.review_count, 0)
+            FROM (
+                SELECT g.id AS game_id,
+                       COUNT(r.id) AS review_count,
+                       COALESCE(SUM(r.score), 0) AS score_sum,
+                       COUNT(r.id) FILTER (WHERE r.score = 1) AS score_1,
+                       COUNT(r.id) FILTER (WHERE r.score = 2) AS score_2,
+                       COUNT(r.id) FILTER (WHERE r.score = 3) AS score_3,
+                       COUNT(r.id) FILTER (WHERE r.score = 4) AS score_4,
+                       COUNT(r.id) FILTER (WHERE r.score = 5) AS score_5,
+                       MAX(r.date_submitted) AS last_review_date
+                FROM seed_games g
+                LEFT JOIN main_app_review r ON r.game_id = g.id
+                GROUP BY g.id
+            ) AS c
+            WHERE s.game_id = c.game_id
+        """)
+        self.report('stats')
+
+    def report(self, message):
+        self.stdout.write(f'{message} ({time.perf_counter() - self.started:.1f}s)')
@@ -0,0 +1,221 @@
+import contextvars
+import logging
+import os
+import time
+from asyncio import iscoroutinefunction
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+from django.utils.decorators import sync_and_async_middleware
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, REGISTRY
+from rest_framework.serializers import BaseSerializer
+
+from .db_pool.pool import get_all_stats
+
+# per route and method: latency, SQL queries and time, serializer time and response size, as prometheus
+# histograms at /metrics. with several gunicorn workers set PROMETHEUS_MULTIPROC_DIR (see gunicorn.conf.py),
+# otherwise each scrape only sees the worker that answered it
+logger = logging.getLogger('main_app.slow_requests')
+current_request = contextvars.ContextVar('current_request_metrics', default=None)
+
+LABELS = ['route', 'method']
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Time to answer a request', LABELS)
+SQL_QUERIES = Histogram('http_request_sql_queries', 'SQL queries run by a request', LABELS,
+                        buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200, float('inf')))
+SQL_SECONDS = Histogram('http_request_sql_duration_seconds', 'Time a request spent waiting on SQL', LABELS)
+SERIALIZER_SECONDS = Histogram('http_request_serialization_seconds', 'Time a request spent serializing', LABELS)
+RESPONSE_BYTES = Histogram('http_response_size_bytes', 'Size of the response body', LABELS,
+                           buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, float('inf')))
+DATABASE_QUERIES = Counter('db_queries', 'SQL queries per database alias (primary, replicas)', ['database'])
+
+# the job queue (jobs.py). these come from the run_worker processes, so they only reach /metrics through
+# PROMETHEUS_MULTIPROC_DIR or run_worker --metrics-port. the queue depth is read from the database at scrape time
+JOB_SECONDS = Histogram('job_duration_seconds', 'Time a job took to run', ['kind'])
+JOB_LATENCY_SECONDS = Histogram('job_latency_seconds', 'Time from enqueueing a job to it being done', ['kind'],
+                                buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, float('inf')))
+JOBS = Counter('jobs', 'Jobs run, by how it went (done, retried, failed)', ['kind', 'outcome'])
+
+
+class RequestMetrics:
+    __slots__ = ('queries', 'sql_seconds', 'serializer_seconds', 'serializer_depth', 'captured')
+
+    def __init__(self, capture_queries):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.serializer_depth = 0
+        self.captured = [] if capture_queries else None # (sql, seconds) for the slow request log
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.sql_seconds += elapsed
+            if self.captured is not None:
+                self.captured.append((sql, elapsed))
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            metrics, token, start = begin()
+            try:
+                response = await get_response(request)
+            finally:
+                current_request.reset(token)
+            finish(request, response, metrics, start)
+            return response
+    else:
+        def middleware(request):
+            metrics, token, start = begin()
+            try:
+                response = get_response(request)
+            finally:
+                current_request.reset(token)
+            finish(request, response, metrics, start)
+            return response
+    return middleware
+
+
+def begin():
+    metrics = RequestMetrics(capture_queries=settings.SLOW_REQUEST_MS is not None)
+    return metrics, current_request.set(metrics), time.perf_counter()
+
+
+# connections belong to a thread and the async ORM runs queries on another one than the async view, so rather
+# than a connection.execute_wrapper() block around each request every connection gets this wrapper for good,
+# and it finds the request through the contextvar (asgiref carries those into its threads)
+def record_query(execute, sql, params, many, context):
+    DATABASE_QUERIES.labels(context['connection'].alias).inc() # requests or not
+    metrics = current_request.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def finish(request, response, metrics, start):
+    elapsed = time.perf_counter() - start
+    match = request.resolver_match
+    labels = (match.route if match else 'unmatched', request.method)
+    REQUEST_SECONDS.labels(*labels).observe(elapsed)
+    SQL_QUERIES.labels(*labels).observe(metrics.queries)
+    SQL_SECONDS.labels(*labels).observe(metrics.sql_seconds)
+    SERIALIZER_SECONDS.labels(*labels).observe(metrics.serializer_seconds)
+    if not response.streaming:
+        RESPONSE_BYTES.labels(*labels).observe(len(response.content))
+
+    if metrics.captured is not None and elapsed * 1000 >= settings.SLOW_REQUEST_MS:
+        slowest = sorted(metrics.captured, key=lambda query: query[1], reverse=True)[:10]
+        logger.warning(
+            'slow request %s %s: %.0f ms, %d queries in %.0f ms, serializers %.0f ms\n%s',
+            request.method, request.get_full_path(), elapsed * 1000, metrics.queries, metrics.sql_seconds * 1000,
+            metrics.serializer_seconds * 1000,
+            '\n'.join(f'  {seconds * 1000:.1f} ms  {sql}' for sql, seconds in slowest),
+        )
+
+
+def serializing(serialize, *args):
+    metrics = current_request.get()
+    if metrics is None or metrics.serializer_depth:
+        return serialize(*args)
+    metrics.serializer_depth += 1
+    start = time.perf_counter()
+    try:
+        return serialize(*args)
+    finally:
+        metrics.serializer_seconds += time.perf_counter() - start
+        metrics.serializer_depth -= 1
+
+
+def time_serializers():
+    # BaseSerializer.data is where every serializer (and ListSerializer) turns instances into primitives.
+    # nested serializers go through to_representation, not .data, the depth check is for the odd one that doesn't
+    compute = BaseSerializer.data.fget
+    BaseSerializer.data = property(lambda self: serializing(compute, self))
+
+
+def timed_serializer(serialize): # the .values() serializers in fast_serializers.py count as serializer time too
+    @wraps(serialize)
+    def wrapper(rows):
+        return serializing(serialize, rows)
+    return wrapper
+
+
+class DatabasePoolCollector: # this worker's connection pool counters (main_app/db_pool) at scrape time
+    def collect(self):
+        pools = get_all_stats()
+        counters = {
+            'checkouts': 'Connections handed out', 'waits': 'Checkouts that had to wait',
+            'wait_seconds': 'Time spent waiting for a connection', 'timeouts': 'Checkouts that gave up waiting',
+            'connects': 'New connections opened', 'connection_errors': 'Failed connection attempts',
+            'health_check_failures': 'Idle connections that failed their health check',
+        }
+        for name, documentation in counters.items():
+            family = CounterMetricFamily(f'db_pool_{name}', documentation, labels=['database'])
+            for stats in pools:
+                family.add_metric([stats['database']], stats[name])
+            yield family
+        for name in ('size', 'idle', 'in_use'):
+            family = GaugeMetricFamily(f'db_pool_{name}', f'Pooled connections ({name})', labels=['database'])
+            for stats in pools:
+                family.add_metric([stats['database']], stats[name])
+            yield family
+
+
+class JobQueueCollector: # jobs per kind and state, and how long the oldest due one has waited, one query a scrape
+    def describe(self): # so registering it doesn't run the query, possibly before migrations have
+        return self.families()
+
+    def families(self):
+        return (GaugeMetricFamily('job_queue_depth', 'Jobs in the queue', labels=['kind', 'state']),
+                GaugeMetricFamily('job_queue_oldest_seconds', 'Age of the oldest job that is due and not running', labels=['kind']))
+
+    def collect(self):
+        from .jobs import queue_depth # jobs.py imports the models, not ready when this module is
+        depth, oldest = self.families()
+        for kind, state, count, waited in queue_depth():
+            depth.add_metric([kind, state], count)
+            if state == 'due':
+                oldest.add_metric([kind], waited)
+        yield depth
+        yield oldest
+
+
+def start_metrics(): # from MainAppConfig.ready()
+    time_serializers()
+    connection_created.connect(install_query_wrapper)
+    for connection in connections.all(initialized_only=True):
+        install_query_wrapper(None, connection)
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        REGISTRY.register(DatabasePoolCollector())
+        REGISTRY.register(JobQueueCollector())
+
+
+def metrics_view(request):
+    # routes, query counts and pool sizes are nobody else's business. no token, no metrics, whatever DEBUG says
+    # (settings.py has it on)
+    if not settings.METRICS_TOKEN:
+        raise Http404
+    if request.headers.get('Authorization') != f'Bearer {settings.METRICS_TOKEN}':
+        return HttpResponse(status=401)
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry) # every worker's histograms, read from the shared directory
+        registry.register(DatabasePoolCollector())
+        registry.register(JobQueueCollector())
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,61 @@
+from asyncio import iscoroutinefunction
+
+from django.utils.decorators import sync_and_async_middleware
+
+from .db_pool.pool import request_pool_wait
+from .routers import begin_routing, finish_routing, routing
+
+
+# how long this request waited for a pooled database connection, as a Server-Timing header
+# (browser dev tools show it). works on both WSGI and ASGI, the async ORM's threads share the list
+@sync_and_async_middleware
+def database_pool_middleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            waits = []
+            token = request_pool_wait.set(waits)
+            try:
+                response = await get_response(request)
+            finally:
+                request_pool_wait.reset(token)
+            return add_pool_timing(response, waits)
+    else:
+        def middleware(request):
+            waits = []
+            token = request_pool_wait.set(waits)
+            try:
+                response = get_response(request)
+            finally:
+                request_pool_wait.reset(token)
+            return add_pool_timing(response, waits)
+    return middleware
+
+
+def add_pool_timing(response, waits):
+    timing = f'db-pool-wait;dur={sum(waits) * 1000:.2f}'
+    response['Server-Timing'] = f"{response['Server-Timing']}, {timing}" if response.has_header('Server-Timing') else timing
+    return response
+
+
+# which database this request reads from, see routers.py
+@sync_and_async_middleware
+def replica_routing_middleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            state, token = begin_routing(request)
+            try:
+                response = await get_response(request)
+            finally:
+                routing.reset(token)
+            finish_routing(request, state)
+            return response
+    else:
+        def middleware(request):
+            state, token = begin_routing(request)
+            try:
+                response = get_response(request)
+            finally:
+                routing.reset(token)
+            finish_routing(request, state)
+            return response
+    return middleware
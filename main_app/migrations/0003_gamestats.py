@@ -0,0 +1,48 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0002_rename_cover_url_game_image_url_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameStats',
+            fields=[
+                ('game', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='main_app.game')),
+                ('review_count', models.PositiveIntegerField(default=0)),
+                ('score_sum', models.PositiveIntegerField(default=0)),
+                ('score_1', models.PositiveIntegerField(default=0)),
+                ('score_2', models.PositiveIntegerField(default=0)),
+                ('score_3', models.PositiveIntegerField(default=0)),
+                ('score_4', models.PositiveIntegerField(default=0)),
+                ('score_5', models.PositiveIntegerField(default=0)),
+                ('last_review_date', models.DateField(blank=True, null=True)),
+            ],
+        ),
+        # count the reviews that already exist, one pass over the table
+        migrations.RunSQL(
+            """
+            INSERT INTO main_app_gamestats
+                (game_id, review_count, score_sum, score_1, score_2, score_3, score_4, score_5, last_review_date)
+            SELECT g.id,
+                   COUNT(r.id),
+                   COALESCE(SUM(r.score), 0),
+                   COUNT(r.id) FILTER (WHERE r.score = 1),
+                   COUNT(r.id) FILTER (WHERE r.score = 2),
+                   COUNT(r.id) FILTER (WHERE r.score = 3),
+                   COUNT(r.id) FILTER (WHERE r.score = 4),
+                   COUNT(r.id) FILTER (WHERE r.score = 5),
+                   MAX(r.date_submitted)
+            FROM main_app_game g
+            LEFT JOIN main_app_review r ON r.game_id = g.id
+            GROUP BY g.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0003_gamestats'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['release_date', 'id'], name='game_release_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['game', 'date_submitted', 'id'], name='review_game_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['date_submitted', 'id'], name='review_date_id_idx'),
+        ),
+        # auth_user isn't ours so there's no Meta to put this on, users are paged by -date_joined, -id
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS auth_user_date_joined_id_idx ON auth_user (date_joined, id)',
+            'DROP INDEX IF EXISTS auth_user_date_joined_id_idx',
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:56
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0004_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='gamestats',
+            name='average_score',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='game_search_vector_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['genres'], name='game_genres_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gamestats',
+            index=models.Index(fields=['average_score'], name='gamestats_average_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='review_search_vector_idx'),
+        ),
+        migrations.RunSQL(
+            'UPDATE main_app_gamestats SET average_score = score_sum::float / NULLIF(review_count, 0)',
+            migrations.RunSQL.noop,
+        ),
+        # search_vector is computed by postgres on every insert/update of the text columns, so no write path
+        # (serializers, admin, bulk imports) can forget it. name weighs most, then genres, then description
+        migrations.RunSQL(
+            """
+            CREATE FUNCTION main_app_game_search_vector() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector :=
+                    setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A') ||
+                    setweight(to_tsvector('english', coalesce(array_to_string(NEW.genres, ' '), '')), 'B') ||
+                    setweight(to_tsvector('english', coalesce(NEW.description, '')), 'C');
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER main_app_game_search_vector_update
+                BEFORE INSERT OR UPDATE OF name, genres, description ON main_app_game
+                FOR EACH ROW EXECUTE FUNCTION main_app_game_search_vector();
+
+            CREATE FUNCTION main_app_review_search_vector() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector := to_tsvector('english', coalesce(NEW.review, ''));
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER main_app_review_search_vector_update
+                BEFORE INSERT OR UPDATE OF review ON main_app_review
+                FOR EACH ROW EXECUTE FUNCTION main_app_review_search_vector();
+
+            UPDATE main_app_game SET name = name;
+            UPDATE main_app_review SET review = review;
+            """,
+            """
+            DROP TRIGGER IF EXISTS main_app_game_search_vector_update ON main_app_game;
+            DROP FUNCTION IF EXISTS main_app_game_search_vector();
+            DROP TRIGGER IF EXISTS main_app_review_search_vector_update ON main_app_review;
+            DROP FUNCTION IF EXISTS main_app_review_search_vector();
+            """,
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0005_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenreFacet',
+            fields=[
+                ('genre', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('game_count', models.PositiveIntegerField(default=0)),
+                ('review_count', models.PositiveBigIntegerField(default=0)),
+                ('score_sum', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunSQL(
+            """
+            INSERT INTO main_app_genrefacet (genre, game_count, review_count, score_sum)
+            SELECT genre, COUNT(*), COALESCE(SUM(s.review_count), 0), COALESCE(SUM(s.score_sum), 0)
+            FROM (SELECT DISTINCT id, unnest(genres) AS genre FROM main_app_game) g
+            LEFT JOIN main_app_gamestats s ON s.game_id = g.id
+            GROUP BY genre
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
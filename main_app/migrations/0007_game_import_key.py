@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0006_genre_facets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='import_key',
+            field=models.CharField(blank=True, editable=False, max_length=120, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0008_revoked_tokens'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameRanking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('top', 'Top rated'), ('trending', 'Trending')], max_length=10)),
+                ('genre', models.CharField(blank=True, max_length=50)),
+                ('rank', models.PositiveIntegerField()),
+                ('score', models.FloatField()),
+                ('computed_at', models.DateTimeField()),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rankings', to='main_app.game')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='gameranking',
+            constraint=models.UniqueConstraint(fields=('kind', 'genre', 'rank'), name='gameranking_kind_genre_rank_uniq'),
+        ),
+    ]
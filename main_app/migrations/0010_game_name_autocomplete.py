@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:44
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0009_game_rankings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameNameChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('game_id', models.IntegerField(null=True)),
+                ('changed_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        TrigramExtension(), # a trusted extension since postgres 13, the app's own user can create it
+        migrations.AddIndex(
+            model_name='game',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='game_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
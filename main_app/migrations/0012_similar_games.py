@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:40
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0011_job_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarGames',
+            fields=[
+                ('game', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='similar_games', serialize=False, to='main_app.game')),
+                ('similar_ids', django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), size=None)),
+                ('scores', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), size=None)),
+                ('computed_at', models.DateTimeField()),
+            ],
+        ),
+        # the first full build is too slow for a migration (numpy, every review), queue it for the worker instead.
+        # no game id: every game, see jobs.update_similar_games
+        migrations.RunSQL(
+            """
+            INSERT INTO main_app_job (kind, game_id, state, run_at, attempts, created_at, last_error)
+            SELECT 'similar-games', NULL, 'pending', now(), 0, now(), ''
+            WHERE EXISTS (SELECT 1 FROM main_app_game) -- nothing to compare in a new (or test) database
+            ON CONFLICT DO NOTHING
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,101 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:50
+
+from django.conf import settings
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.functions.comparison
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('main_app', '0012_similar_games'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('review_count', models.PositiveIntegerField(default=0)),
+                ('score_sum', models.PositiveIntegerField(default=0)),
+                ('score_1', models.PositiveIntegerField(default=0)),
+                ('score_2', models.PositiveIntegerField(default=0)),
+                ('score_3', models.PositiveIntegerField(default=0)),
+                ('score_4', models.PositiveIntegerField(default=0)),
+                ('score_5', models.PositiveIntegerField(default=0)),
+                ('average_score', models.FloatField(blank=True, null=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('games_added', models.PositiveIntegerField(default=0)),
+                ('favourite_genres', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=50), blank=True, default=list, size=None)),
+                ('last_active_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RemoveConstraint(
+            model_name='job',
+            name='job_pending_uniq',
+        ),
+        migrations.RenameField(
+            model_name='job',
+            old_name='game_id',
+            new_name='target_id',
+        ),
+        migrations.AlterField(
+            model_name='game',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='review',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='reviews', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['user', 'id'], name='game_user_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['user', 'date_submitted', 'id'], name='review_user_date_id_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='job',
+            constraint=models.UniqueConstraint(django.db.models.functions.comparison.Coalesce('target_id', 0), models.F('kind'), condition=models.Q(('state', 'pending')), name='job_pending_uniq'),
+        ),
+        # count every existing user once, aggregates.USER_STATS_SQL for all of them. favourite genres are the top 3
+        migrations.RunSQL(
+            """
+            INSERT INTO main_app_userstats (user_id, review_count, score_sum, score_1, score_2, score_3, score_4, score_5,
+                                            average_score, games_added, favourite_genres, last_active_at)
+            SELECT u.id, COALESCE(r.review_count, 0), COALESCE(r.score_sum, 0), COALESCE(r.score_1, 0), COALESCE(r.score_2, 0),
+                   COALESCE(r.score_3, 0), COALESCE(r.score_4, 0), COALESCE(r.score_5, 0),
+                   r.score_sum::float8 / NULLIF(r.review_count, 0), COALESCE(g.games_added, 0), COALESCE(f.genres, '{}'),
+                   r.last_review_date::timestamptz
+            FROM auth_user u
+            LEFT JOIN (
+                SELECT user_id, COUNT(*) AS review_count, SUM(score) AS score_sum,
+                       COUNT(*) FILTER (WHERE score = 1) AS score_1, COUNT(*) FILTER (WHERE score = 2) AS score_2,
+                       COUNT(*) FILTER (WHERE score = 3) AS score_3, COUNT(*) FILTER (WHERE score = 4) AS score_4,
+                       COUNT(*) FILTER (WHERE score = 5) AS score_5, MAX(date_submitted) AS last_review_date
+                FROM main_app_review GROUP BY user_id
+            ) r ON r.user_id = u.id
+            LEFT JOIN (SELECT user_id, COUNT(*) AS games_added FROM main_app_game GROUP BY user_id) g ON g.user_id = u.id
+            LEFT JOIN (
+                SELECT user_id, (array_agg(genre ORDER BY liked DESC, genre))[1:3] AS genres
+                FROM (
+                    SELECT r.user_id, genre, COUNT(*) AS liked
+                    FROM main_app_review r JOIN main_app_game game ON game.id = r.game_id, unnest(game.genres) AS genre
+                    WHERE r.score >= 4
+                    GROUP BY r.user_id, genre
+                ) liked_genres
+                GROUP BY user_id
+            ) f ON f.user_id = u.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0013_user_stats'),
+    ]
+
+    operations = [
+        # 0009 made the leaderboards empty and there was no job queue to fill them yet. queue the first refresh so
+        # the worker does it straight away, instead of /games/top/ and /games/trending/ waiting for a review write
+        migrations.RunSQL(
+            """
+            INSERT INTO main_app_job (kind, target_id, state, run_at, attempts, created_at, last_error)
+            SELECT 'rankings', NULL, 'pending', now(), 0, now(), ''
+            WHERE EXISTS (SELECT 1 FROM main_app_game) -- nothing to rank in a new (or test) database
+            ON CONFLICT DO NOTHING
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -1,6 +1,25 @@
-from django.db import models
+import re
+import unicodedata
+
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db.models.functions import Coalesce
+
+def normalize_name(name):
+    # 'The Witcher 3: Wild Hunt' and 'the witcher 3 wild  hunt' are the same game
+    if not name.isascii(): # nothing to strip otherwise, and this is most of the time on a million names
+        name = ''.join(char for char in unicodedata.normalize('NFKD', name) if not unicodedata.combining(char)) # é -> e
+    return ' '.join(re.sub(r'[^\w\s]', ' ', name.casefold()).split())
+
+
+# search_vector is about as big as the text it indexes, only the search view needs it
+class WithoutSearchVectorManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().defer('search_vector')
+
 
 class Game(models.Model):
     name = models.CharField(max_length=100)
@@ -8,10 +27,51 @@ class Game(models.Model):
     description = models.TextField()
     release_date = models.DateTimeField()
     image_url = models.URLField(max_length=200)
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False) # game_user_id_idx starts with it
+    # filled in by a postgres trigger from name, genres and description (migration 0005), don't set it
+    search_vector = SearchVectorField(null=True, editable=False)
+    # normalized name + release date, set by import_games and what its upserts dedupe on
+    import_key = models.CharField(max_length=120, null=True, blank=True, unique=True, editable=False)
+
+    objects = WithoutSearchVectorManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['release_date', 'id'], name='game_release_date_id_idx'), # ?ordering=release_date pages
+            models.Index(fields=['user', 'id'], name='game_user_id_idx'), # ?user=<id> pages, the profile's games
+            GinIndex(fields=['search_vector'], name='game_search_vector_idx'),
+            GinIndex(fields=['genres'], name='game_genres_idx'), # genres__contains=[...] is @>
+            # pg_trgm: the fuzzy autocomplete matches, duplicate checks and name ILIKE 'zel%' (autocomplete.py)
+            GinIndex(fields=['name'], name='game_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ]
 
     def __str__(self):
         return f'{self.title}, id: {self.id}'
+
+    @staticmethod
+    def make_import_key(name, release_date):
+        return f'{normalize_name(name)[:100]}|{release_date.date().isoformat()}'
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'genres' in field_names:
+            instance._remember_genres()
+        if 'name' in field_names:
+            instance._indexed_name = instance.name # what the autocomplete index has, see signals.py
+        return instance
+
+    def _remember_genres(self): # what the genre facets currently count this game under, see signals.py
+        self._counted_genres = set(self.genres or [])
+
+    # same as Review: the facet updates run in the signals, keep them in the game's transaction
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            return super().delete(*args, **kwargs)
     
 class Review(models.Model):
     SCORE_CHOICES = [
@@ -27,8 +87,192 @@ class Review(models.Model):
         )
     review = models.TextField()
     date_submitted = models.DateField()
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reviews')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reviews', db_index=False) # review_user_date_id_idx starts with it
     game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='reviews')
+    search_vector = SearchVectorField(null=True, editable=False) # trigger maintained from review, like Game's
+
+    objects = WithoutSearchVectorManager()
+
+    class Meta:
+        # btree indexes scan both ways, so these serve newest-first and oldest-first pages
+        indexes = [
+            models.Index(fields=['game', 'date_submitted', 'id'], name='review_game_date_id_idx'),
+            models.Index(fields=['date_submitted', 'id'], name='review_date_id_idx'),
+            models.Index(fields=['user', 'date_submitted', 'id'], name='review_user_date_id_idx'), # ?user=<id>, the profile
+            GinIndex(fields=['search_vector'], name='review_search_vector_idx'),
+        ]
+
+    def __str__(self):
+        return f'review id: {self.id} {self.game}'
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if {'game_id', 'score', 'date_submitted'}.issubset(field_names): # .only() querysets don't get to load more
+            instance._remember_scored_state()
+        return instance
+
+    def _remember_scored_state(self): # what the game stats currently count this review as, see signals.py
+        self._scored_state = (self.game_id, self.score, self.date_submitted)
+
+    # post_save/post_delete enqueue the stats jobs, wrapping both here keeps the review and its jobs in one transaction
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            return super().delete(*args, **kwargs)
+
+
+# review count, score sum and histogram, the part of the stats a game and a user have in common
+class ScoreCounts(models.Model):
+    SCORE_FIELDS = {score: f'score_{score}' for score, _ in Review.SCORE_CHOICES}
+
+    review_count = models.PositiveIntegerField(default=0)
+    score_sum = models.PositiveIntegerField(default=0)
+    score_1 = models.PositiveIntegerField(default=0)
+    score_2 = models.PositiveIntegerField(default=0)
+    score_3 = models.PositiveIntegerField(default=0)
+    score_4 = models.PositiveIntegerField(default=0)
+    score_5 = models.PositiveIntegerField(default=0)
+    average_score = models.FloatField(null=True, blank=True) # score_sum / review_count, stored so it can be indexed
+
+    class Meta:
+        abstract = True
+
+    @property
+    def histogram(self):
+        return {score: getattr(self, field) for score, field in self.SCORE_FIELDS.items()}
+
+
+# one row per game, recounted by the game-stats job after review writes (aggregates.py) so nobody has to AVG() over reviews on a read
+class GameStats(ScoreCounts):
+    game = models.OneToOneField(Game, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    last_review_date = models.DateField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['average_score'], name='gamestats_average_score_idx'),
+        ]
+
+    def __str__(self):
+        return f'stats for game id: {self.game_id}'
+
+
+# one row per user for the profile, which used to ship everything they ever wrote to count it in the browser.
+# recounted per user by a job after their writes (aggregates.py), average_score is the mean score they give
+class UserStats(ScoreCounts):
+    FAVOURITE_GENRES = 3
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    games_added = models.PositiveIntegerField(default=0)
+    # the genres of the games they scored 4 or 5 most often, up to FAVOURITE_GENRES
+    favourite_genres = ArrayField(models.CharField(max_length=50), default=list, blank=True)
+    last_active_at = models.DateTimeField(null=True, blank=True) # last review or game they saved
+
+    def __str__(self):
+        return f'stats for user id: {self.user_id}'
+
+
+# one row per genre with the totals of the games that have it, so the genre list never unnests the games table
+class GenreFacet(models.Model):
+    genre = models.CharField(max_length=50, primary_key=True)
+    game_count = models.PositiveIntegerField(default=0)
+    review_count = models.PositiveBigIntegerField(default=0) # over all games in the genre
+    score_sum = models.PositiveBigIntegerField(default=0)
+
+    @property
+    def average_score(self):
+        if not self.review_count:
+            return None
+        return round(self.score_sum / self.review_count, 2)
+
+    def __str__(self):
+        return f'{self.genre}: {self.game_count} games'
+
+
+# precomputed leaderboards behind /games/top/ and /games/trending/, overall (genre '') and per genre.
+# rebuilt wholesale by refresh_rankings (rankings.py), a page is a range scan on the unique index
+class GameRanking(models.Model):
+    TOP = 'top'
+    TRENDING = 'trending'
+    KIND_CHOICES = [(TOP, 'Top rated'), (TRENDING, 'Trending')]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    genre = models.CharField(max_length=50, blank=True) # '' is the leaderboard over every game
+    rank = models.PositiveIntegerField() # 1 is the best, unique within a kind and genre
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='rankings')
+    score = models.FloatField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'genre', 'rank'], name='gameranking_kind_genre_rank_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.genre or "overall"} #{self.rank}: game id {self.game_id}'
+
+
+# the TOP_K games most like each game, behind /games/<id>/similar/. built by similar.py, never by a request.
+# a row per game rather than per pair: a rebuild rewrites 100k rows instead of 2M
+class SimilarGames(models.Model):
+    game = models.OneToOneField(Game, on_delete=models.CASCADE, primary_key=True, related_name='similar_games')
+    similar_ids = ArrayField(models.BigIntegerField()) # closest first. not FKs, a deleted game just drops out of the list
+    scores = ArrayField(models.FloatField()) # cosine similarity of each, see similar.py
+    computed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f'games similar to game id: {self.game_id}'
+
+
+# logged out JWTs, by jti, until they would have expired anyway. read through revocation.py, not directly
+class RevokedToken(models.Model):
+    jti = models.CharField(max_length=255, primary_key=True)
+    expires_at = models.DateTimeField(db_index=True)
+    revoked_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f'revoked token {self.jti}'
+
+
+# a row per game whose name was added, changed or deleted. each worker's autocomplete index (autocomplete.py)
+# polls it to catch up with the other workers. game is a plain id, the game may be gone. no game means
+# "too much changed, reload everything" (seed_synthetic)
+class GameNameChange(models.Model):
+    game_id = models.IntegerField(null=True)
+    changed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f'name change for game id: {self.game_id}' if self.game_id else 'reload every game name'
+
+
+# deferred work for run_worker, see jobs.py. done jobs are deleted, failed ones stay until someone looks
+class Job(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATE_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (FAILED, 'Failed')]
+
+    kind = models.CharField(max_length=50) # a handler registered in jobs.py
+    # what it's about: a game id, a user id for the user- kinds, None for jobs about everything. not a FK, they go away
+    target_id = models.IntegerField(null=True)
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default=PENDING)
+    run_at = models.DateTimeField() # not before this, later for a retry
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'run_at'], name='job_state_run_at_idx'), # what's due, what's stuck
+        ]
+        constraints = [
+            # one waiting job per kind and game, enqueueing another is a no-op (ON CONFLICT DO NOTHING)
+            models.UniqueConstraint(Coalesce('target_id', 0), 'kind', condition=models.Q(state='pending'), name='job_pending_uniq'),
+        ]
 
     def __str__(self):
-        return f'review id: {self.id} {self.game}'
\ No newline at end of file
+        return f'{self.kind} job for id: {self.target_id} ({self.state})'
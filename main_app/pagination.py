@@ -0,0 +1,269 @@
+import base64
+import json
+from datetime import date, datetime
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.settings import api_settings
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+# keyset ("seek") pagination: the cursor holds the sort values of the last row seen and the next page
+# is WHERE (sort columns) > (those values) ORDER BY ... LIMIT n, an index range scan however deep you go.
+# every ordering has to end in a unique column (id) so there are no ties, and the columns can't be null
+class KeysetPagination(BasePagination):
+    page_size = api_settings.PAGE_SIZE or 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    count_query_param = 'count'
+    exact_count_below = 1000 # under this the planner guess is worse than just counting
+
+    # ?ordering=<name> choices, the first one is the default
+    orderings = {
+        'id': ('id',),
+        '-id': ('-id',),
+    }
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_query = self.get_page_query(queryset, request)
+        self.count = self.estimate_count(queryset) if self.wants_count(request) else None
+        return self.finish_page(list(page_query))
+
+    async def apaginate_queryset(self, queryset, request, view=None): # same, for the async views
+        page_query = self.get_page_query(queryset, request)
+        self.count = await self.aestimate_count(queryset) if self.wants_count(request) else None
+        return self.finish_page([row async for row in page_query])
+
+    def get_page_query(self, queryset, request):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request, queryset.model)
+        self.has_cursor = cursor is not None
+        self.ordering_name = cursor['o'] if cursor else self.get_ordering_name(request)
+        self.backwards = bool(cursor and cursor.get('b'))
+        fields = self.orderings[self.ordering_name]
+        if self.backwards: # walk the index the other way from the first row of the page we came from
+            fields = tuple(field[1:] if field.startswith('-') else f'-{field}' for field in fields)
+
+        queryset = queryset.order_by(*fields)
+        if cursor:
+            queryset = queryset.filter(self.seek(fields, cursor['v']))
+        return queryset[:self.page_size + 1]
+
+    def first_page(self, queryset, request, url, ordering=None):
+        # the first page of a list inside another response, like the profile's reviews. its next link carries on at url
+        return self.finish_page(list(self.get_first_page_query(queryset, request, url, ordering)))
+
+    async def afirst_page(self, queryset, request, url, ordering=None):
+        return self.finish_page([row async for row in self.get_first_page_query(queryset, request, url, ordering)])
+
+    def get_first_page_query(self, queryset, request, url, ordering=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri(url)
+        self.has_cursor = self.backwards = False
+        self.ordering_name = ordering or next(iter(self.orderings))
+        return queryset.order_by(*self.orderings[self.ordering_name])[:self.page_size + 1]
+
+    def finish_page(self, rows):
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.backwards:
+            rows.reverse()
+
+        fields = self.orderings[self.ordering_name]
+        self.next_values = self.previous_values = None
+        if rows and (has_more or self.backwards):
+            self.next_values = self.row_values(rows[-1], fields)
+        if rows and (has_more if self.backwards else self.has_cursor):
+            self.previous_values = self.row_values(rows[0], fields)
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_data(self, data):
+        response_data = {
+            'next': self.get_next_link(),
+            'previous': self.get_link(self.previous_values, backwards=True),
+            'results': data,
+        }
+        if self.count is not None:
+            response_data = {'count': self.count, **response_data}
+        return response_data
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'count': {'type': 'integer', 'description': 'estimate, only with ?count=true'},
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_ordering_name(self, request):
+        name = request.query_params.get(self.ordering_query_param)
+        return name if name in self.orderings else next(iter(self.orderings))
+
+    def wants_count(self, request):
+        return request.query_params.get(self.count_query_param, '').lower() in ('1', 'true', 'yes')
+
+    def seek(self, fields, values):
+        # (a, b, c) > (x, y, z) spelled out as a > x OR (a = x AND b > y) OR ..., with a >= x in front
+        # so postgres gets a range bound on the leading index column
+        after = Q()
+        equal = Q()
+        for field, value in zip(fields, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            after |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        first = fields[0]
+        bound = Q(**{f"{first.lstrip('-')}__{'lte' if first.startswith('-') else 'gte'}": values[0]})
+        return bound & after
+
+    def row_values(self, row, fields):
+        values = []
+        for field in fields:
+            name = field.lstrip('-')
+            value = row[name] if isinstance(row, dict) else getattr(row, name) # .values() pages are dicts
+            values.append(value.isoformat() if isinstance(value, (date, datetime)) else value)
+        return values
+
+    def get_next_link(self):
+        return self.get_link(self.next_values, backwards=False)
+
+    def get_link(self, values, backwards):
+        if values is None:
+            return None
+        cursor = {'o': self.ordering_name, 'v': values}
+        if backwards:
+            cursor['b'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode()).decode()
+        url = remove_query_param(self.base_url, self.ordering_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            fields = self.orderings[cursor['o']]
+            if not isinstance(cursor['v'], list) or len(cursor['v']) != len(fields):
+                raise ValueError
+            # it came from the client, each value has to be something its column can hold before it goes near a query.
+            # clean() also turns the isoformat dates back into dates. the columns aren't nullable, and AutoField's clean lets None by
+            if None in cursor['v']:
+                raise ValueError
+            cursor['v'] = [model._meta.get_field(field.lstrip('-')).clean(value, None) for field, value in zip(fields, cursor['v'])]
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound('Invalid cursor')
+        return cursor
+
+    def estimate_count(self, queryset):
+        # the planner's row estimate (pg_class.reltuples + column stats) costs a plan, not a scan
+        estimate = self.plan_rows(queryset.order_by().explain(format='json'))
+        if estimate < self.exact_count_below or not analyzed(queryset.model._meta.db_table):
+            return queryset.count()
+        return estimate
+
+    async def aestimate_count(self, queryset):
+        estimate = self.plan_rows(await queryset.order_by().aexplain(format='json'))
+        if estimate < self.exact_count_below or not await sync_to_async(analyzed)(queryset.model._meta.db_table):
+            return await queryset.acount()
+        return estimate
+
+    def plan_rows(self, explain_output):
+        return int(json.loads(explain_output)[0]['Plan']['Plan Rows'])
+
+
+analyzed_tables = set() # stays analyzed once it has been, no need to ask again
+
+
+def analyzed(table):
+    # a table that was never analyzed has reltuples -1 and the planner makes up about a thousand rows,
+    # for one row as much as for a million. only its estimate can't be trusted
+    if table not in analyzed_tables:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples >= 0 FROM pg_class WHERE oid = %s::regclass', [table])
+            if not cursor.fetchone()[0]:
+                return False
+        analyzed_tables.add(table)
+    return True
+
+
+class GamePagination(KeysetPagination):
+    orderings = {
+        'id': ('id',),
+        '-id': ('-id',),
+        'release_date': ('release_date', 'id'),
+        '-release_date': ('-release_date', '-id'),
+    }
+
+
+class ReviewPagination(KeysetPagination):
+    orderings = {
+        '-date_submitted': ('-date_submitted', '-id'),
+        'date_submitted': ('date_submitted', 'id'),
+    }
+
+
+class RankingPagination(KeysetPagination): # GameRanking rows, rank is unique within a leaderboard
+    orderings = {
+        'rank': ('rank',),
+    }
+
+
+class UserPagination(KeysetPagination):
+    orderings = {
+        '-date_joined': ('-date_joined', '-id'),
+        'date_joined': ('date_joined', 'id'),
+    }
+
+
+# ranked search results can't be keyset paged (the rank isn't a column), so plain page numbers.
+# capped, nobody reads page 40 of a search and every page costs its offset. no count either,
+# one extra row tells us whether there is a next page
+class SearchPagination(BasePagination):
+    page_size = 20
+    max_page = 20
+    page_query_param = 'page'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        try:
+            self.page = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            raise NotFound('Invalid page')
+        if self.page < 1:
+            raise NotFound('Invalid page')
+        if self.page > self.max_page:
+            raise NotFound(f'Only the first {self.max_page} pages of results are available')
+        start = (self.page - 1) * self.page_size
+        rows = list(queryset[start:start + self.page_size + 1])
+        self.has_next = len(rows) > self.page_size and self.page < self.max_page
+        return rows[:self.page_size]
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': replace_query_param(self.base_url, self.page_query_param, self.page + 1) if self.has_next else None,
+            'previous': replace_query_param(self.base_url, self.page_query_param, self.page - 1) if self.page > 1 else None,
+            'results': data,
+        })
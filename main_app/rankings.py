@@ -0,0 +1,89 @@
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import GameRanking
+
+# the leaderboards in GameRanking. both kinds are scored in one set based statement each and the
+# best `size` games per leaderboard (overall and every genre) replace the previous ones, readers keep
+# seeing the old rows until the new ones commit. run refresh_rankings from cron, every few minutes is fine
+PRIOR_REVIEWS = 10 # how many reviews at the average every game is assumed to start with
+SIZE = 1000 # games kept per leaderboard, nobody pages further
+TRENDING_WINDOW_DAYS = 7
+TRENDING_BASELINE_WINDOWS = 4 # the recent window is compared with this many windows before it
+
+# mean score over every review, what an unknown game is assumed to score. from the stats table, not the reviews
+MEAN = 'SELECT COALESCE(SUM(score_sum)::float8 / NULLIF(SUM(review_count), 0), 3) AS c FROM main_app_gamestats'
+
+# top: bayesian average (score_sum + m * C) / (review_count + m), so one 5 star review doesn't beat
+# a hundred 4.8s. reads GameStats, a row per game, never the reviews
+TOP_SQL = f"""
+    WITH mean AS ({MEAN}),
+    scored AS (
+        SELECT s.game_id, g.genres, (s.score_sum + %(prior)s * mean.c) / (s.review_count + %(prior)s) AS score
+        FROM main_app_gamestats s
+        JOIN main_app_game g ON g.id = s.game_id
+        CROSS JOIN mean
+        WHERE s.review_count > 0
+    )
+"""
+
+# trending: reviews in the last window, each worth its bayesian average over 5, times how much faster the
+# game is getting them than its weekly rate over the windows before. only reads the reviews in those
+# windows, through the (date_submitted, id) index
+TRENDING_SQL = f"""
+    WITH mean AS ({MEAN}),
+    windows AS (
+        SELECT game_id,
+               COUNT(*) FILTER (WHERE date_submitted > %(recent_start)s) AS recent_count,
+               COALESCE(SUM(score) FILTER (WHERE date_submitted > %(recent_start)s), 0) AS recent_sum,
+               COUNT(*) FILTER (WHERE date_submitted <= %(recent_start)s) AS baseline_count
+        FROM main_app_review
+        WHERE date_submitted > %(baseline_start)s AND date_submitted <= %(today)s
+        GROUP BY game_id
+    ),
+    scored AS (
+        SELECT w.game_id, g.genres,
+               w.recent_count * (w.recent_sum + %(prior)s * mean.c) / (w.recent_count + %(prior)s) / 5
+               * (w.recent_count + 1) / (w.baseline_count::float8 / %(baseline_windows)s + 1) AS score
+        FROM windows w
+        JOIN main_app_game g ON g.id = w.game_id
+        CROSS JOIN mean
+        WHERE w.recent_count > 0
+    )
+"""
+
+RANK_SQL = """
+    , leaderboards AS (
+        SELECT '' AS genre, game_id, score FROM scored
+        UNION ALL
+        SELECT DISTINCT genre, game_id, score FROM scored, unnest(genres) AS genre
+    ),
+    ranked AS (
+        SELECT genre, game_id, score, row_number() OVER (PARTITION BY genre ORDER BY score DESC, game_id) AS rank
+        FROM leaderboards
+    )
+    INSERT INTO main_app_gameranking (kind, genre, rank, game_id, score, computed_at)
+    SELECT %(kind)s, genre, rank, game_id, score, %(now)s FROM ranked WHERE rank <= %(size)s
+"""
+
+
+def refresh_rankings(kinds=(GameRanking.TOP, GameRanking.TRENDING), prior=PRIOR_REVIEWS, size=SIZE,
+                     window_days=TRENDING_WINDOW_DAYS, baseline_windows=TRENDING_BASELINE_WINDOWS, today=None):
+    today = today or timezone.localdate()
+    params = {
+        'prior': prior, 'size': size, 'now': timezone.now(), 'today': today, 'baseline_windows': baseline_windows,
+        'recent_start': today - timedelta(days=window_days),
+        'baseline_start': today - timedelta(days=window_days * (1 + baseline_windows)),
+    }
+    counts = {}
+    for kind in kinds:
+        scored = {GameRanking.TOP: TOP_SQL, GameRanking.TRENDING: TRENDING_SQL}[kind]
+        with transaction.atomic(), connection.cursor() as cursor:
+            # two refreshes at once would insert the same ranks, readers aren't blocked by this
+            cursor.execute('LOCK TABLE main_app_gameranking IN EXCLUSIVE MODE')
+            cursor.execute('DELETE FROM main_app_gameranking WHERE kind = %s', [kind])
+            cursor.execute(scored + RANK_SQL, {**params, 'kind': kind})
+            counts[kind] = cursor.rowcount
+    return counts
@@ -0,0 +1,25 @@
+import orjson
+from rest_framework.renderers import JSONRenderer
+
+# JSONRenderer's bytes from orjson instead of json.dumps, a few times faster on a page of games. orjson does
+# the plain types itself and hands the rest (lazy translations, decimals, datetimes, querysets) to DRF's
+# encoder, same as before. indented output (the browsable API, ?indent=) still goes through json.dumps.
+# the differences: floats under 1e-4 or from 1e16 up are spelled 0.00001 and 1e16 rather than 1e-05 and 1e+16
+# (the same numbers), and NaN comes out as null instead of the NaN json.dumps writes, which isn't JSON anyway
+class FastJSONRenderer(JSONRenderer):
+    options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS # datetimes get DRF's 'Z' format
+    encoder = JSONRenderer.encoder_class()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.ensure_ascii or not self.compact or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            rendered = orjson.dumps(data, default=self.encoder.default, option=self.options)
+        except orjson.JSONEncodeError: # ints over 64 bits and the like, let json.dumps have a go
+            return super().render(data, accepted_media_type, renderer_context)
+        # JSONRenderer escapes these two, they are valid JSON but not valid javascript
+        if b'\xe2\x80\xa8' in rendered or b'\xe2\x80\xa9' in rendered:
+            rendered = rendered.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return rendered
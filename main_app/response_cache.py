@@ -0,0 +1,106 @@
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+from .routers import primary_reads
+
+# every cached object (a game page, a profile) has a version number in the cache. writes bump it,
+# cached responses are stored under the version they were built from, so a bump makes the old
+# entry unreachable without deleting anything and the ETag is just the version
+VERSION_KEY = 'version:{kind}:{pk}'
+RESPONSE_KEY = 'response:{kind}:{pk}:{version}'
+COUNTER_KEY = 'response-cache:{name}'
+
+
+def fresh_version():
+    # a counter that got evicted restarts from the clock instead of 1, so it can't land back
+    # on a version that still has an old response stored under it
+    return int(time.time() * 1000)
+
+
+def get_version(kind, pk):
+    key = VERSION_KEY.format(kind=kind, pk=pk)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, fresh_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(kind, pk):
+    key = VERSION_KEY.format(kind=kind, pk=pk)
+    try:
+        cache.incr(key)
+    except ValueError: # not in the cache, nothing can be cached under it either
+        cache.add(key, fresh_version(), timeout=None)
+
+
+def bump_on_commit(kind, pk):
+    # after commit, otherwise a reader could cache the old rows under the new version
+    transaction.on_commit(lambda: bump_version(kind, pk))
+
+
+def count(name):
+    key = COUNTER_KEY.format(name=name)
+    if cache.add(key, 1, timeout=None):
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=None)
+
+
+def get_counters():
+    keys = {name: COUNTER_KEY.format(name=name) for name in ('hits', 'misses', 'not_modified')}
+    found = cache.get_many(keys.values())
+    return {name: found.get(key, 0) for name, key in keys.items()}
+
+
+def etag_matches(request, etag):
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    return header.strip() == '*' or etag in [tag.strip() for tag in header.split(',')]
+
+
+def versioned_response(kind):
+    # for retrieve() on a viewset: 304 when the client has the current version, the stored data
+    # when we have it, otherwise run the view and keep its data. neither of the first two touches the db
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            if not settings.RESPONSE_CACHE_ENABLED:
+                return view_method(self, request, *args, **kwargs)
+            try:
+                pk = int(kwargs[self.lookup_url_kwarg or self.lookup_field])
+            except ValueError:
+                return view_method(self, request, *args, **kwargs)
+
+            version = get_version(kind, pk)
+            # the format is in there because the browsable api and json are different bytes
+            etag = f'"{kind}-{pk}-{version}-{request.accepted_renderer.format}"'
+            if etag_matches(request, etag):
+                count('not_modified')
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+            key = RESPONSE_KEY.format(kind=kind, pk=pk, version=version)
+            data = cache.get(key)
+            if data is not None:
+                count('hits')
+                return Response(data, headers={'ETag': etag, 'X-Cache': 'HIT'})
+
+            count('misses')
+            with primary_reads(): # a lagging replica's rows would stay cached under the new version
+                response = view_method(self, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(key, response.data, timeout=settings.RESPONSE_CACHE_TIMEOUT)
+                response['ETag'] = etag
+                response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
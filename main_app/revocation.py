@@ -0,0 +1,94 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.utils import timezone as django_timezone
+
+from .models import RevokedToken
+
+# logged out JWTs live in the RevokedToken table, shared by every worker. checking it on every request would
+# be a query per request, so each worker keeps the whole (small, expiring) set in memory and pulls in new
+# revocations every JWT_REVOCATION_SYNC_SECONDS. checking a token is a dict lookup; a token revoked on another
+# worker keeps working there for at most that long
+SYNC_OVERLAP = timedelta(seconds=30) # re-read a little behind the last sync, rows can commit out of revoked_at order
+
+
+class RevocationList:
+    def __init__(self, sync_seconds=None):
+        self.sync_seconds = sync_seconds
+        self.revoked = {} # jti -> expiry as a unix timestamp
+        self.synced_at = 0 # time.monotonic() of the last sync
+        self.watermark = None # revoked_at of the last sync
+        self.lock = threading.Lock()
+
+    def is_revoked(self, jti):
+        if self.needs_sync():
+            self.sync()
+        return self.contains(jti)
+
+    async def ais_revoked(self, jti): # for the async views, same thing through the async ORM
+        if self.needs_sync():
+            await self.async_sync()
+        return self.contains(jti)
+
+    def contains(self, jti):
+        expires = self.revoked.get(jti)
+        return expires is not None and expires > time.time()
+
+    def needs_sync(self):
+        return time.monotonic() - self.synced_at >= self.get_sync_seconds()
+
+    def revoke(self, jti, expires_at):
+        if expires_at <= django_timezone.now():
+            return # it's dead already
+        RevokedToken.objects.bulk_create([RevokedToken(jti=jti, expires_at=expires_at)], ignore_conflicts=True)
+        self.revoked[jti] = expires_at.timestamp() # this worker knows straight away
+
+    def sync(self):
+        if not self.lock.acquire(blocking=False):
+            return # another thread is on it, use what we have
+        try:
+            now = django_timezone.now()
+            self.merge(list(self.new_revocations(now)), now)
+        finally:
+            self.lock.release()
+
+    async def async_sync(self):
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            now = django_timezone.now()
+            self.merge([row async for row in self.new_revocations(now)], now)
+        finally:
+            self.lock.release()
+
+    def new_revocations(self, now):
+        rows = RevokedToken.objects.filter(expires_at__gt=now)
+        if self.watermark is not None:
+            rows = rows.filter(revoked_at__gte=self.watermark)
+        return rows.values_list('jti', 'expires_at')
+
+    def merge(self, rows, now):
+        for jti, expires_at in rows:
+            self.revoked[jti] = expires_at.timestamp()
+        self.revoked = {jti: expires for jti, expires in self.revoked.items() if expires > now.timestamp()}
+        self.watermark = now - SYNC_OVERLAP
+        self.synced_at = time.monotonic()
+
+    def get_sync_seconds(self):
+        if self.sync_seconds is not None:
+            return self.sync_seconds
+        return getattr(settings, 'JWT_REVOCATION_SYNC_SECONDS', 5)
+
+    def clear(self): # tests
+        self.revoked = {}
+        self.synced_at = 0
+        self.watermark = None
+
+
+revoked_tokens = RevocationList()
+
+
+def token_expiry(token):
+    return datetime.fromtimestamp(token['exp'], tz=timezone.utc)
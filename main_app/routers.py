@@ -0,0 +1,85 @@
+import contextvars
+import hashlib
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+# read replicas (DATABASE_REPLICA_URLS, see settings.py). replica_routing_middleware decides per request:
+# GET/HEAD/OPTIONS read from a random replica, anything else reads and writes on the primary. a request that
+# wrote pins its client (same Authorization header or session cookie) to the primary for READ_YOUR_WRITES_SECONDS,
+# so a replica that is a few hundred ms behind never shows them their own write missing. the pins live in the
+# cache, share it between workers (CACHE_URL) or a pin only holds on the worker that took the write.
+# commands, signals and anything else outside a request use the primary
+routing = contextvars.ContextVar('database_routing', default=None)
+PIN_KEY = 'primary-pin:{client}'
+
+# read on the primary even in a GET: a lagging replica would make a logout or a new session not count yet
+PRIMARY_ONLY_MODELS = {'main_app.revokedtoken', 'sessions.session'}
+
+
+class RequestRouting:
+    __slots__ = ('replica', 'wrote')
+
+    def __init__(self, replica):
+        self.replica = replica # alias this request reads from, None for the primary
+        self.wrote = False
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = routing.get()
+        if state is None or state.replica is None or model._meta.label_lower in PRIMARY_ONLY_MODELS:
+            return DEFAULT_DB_ALIAS # not None, or django would follow hints['instance'] back to a replica
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = routing.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True # every database has the same rows
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS # replicas get their schema from the primary
+
+
+def client_key(request):
+    credentials = request.headers.get('Authorization') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not credentials:
+        return None
+    return PIN_KEY.format(client=hashlib.sha256(credentials.encode()).hexdigest())
+
+
+def begin_routing(request):
+    replica = None
+    if settings.DATABASE_REPLICAS and request.method in ('GET', 'HEAD', 'OPTIONS'):
+        key = client_key(request)
+        if key is None or not cache.get(key):
+            replica = random.choice(settings.DATABASE_REPLICAS)
+    state = RequestRouting(replica)
+    return state, routing.set(state)
+
+
+def finish_routing(request, state):
+    if state.wrote and settings.DATABASE_REPLICAS:
+        key = client_key(request)
+        if key is not None:
+            cache.set(key, 1, timeout=settings.READ_YOUR_WRITES_SECONDS)
+
+
+@contextmanager
+def primary_reads(): # for reads whose result outlives the request, like a cached response
+    state = routing.get()
+    if state is None:
+        yield
+        return
+    replica, state.replica = state.replica, None
+    try:
+        yield
+    finally:
+        state.replica = replica
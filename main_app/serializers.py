@@ -1,6 +1,11 @@
 from django.contrib.auth.models import User, Group
-from .models import Game, Review
+from .models import Game, GameStats, GenreFacet, Review, UserStats
+from .revocation import revoked_tokens
 from rest_framework import serializers
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
 
 class UserSerializer(serializers.HyperlinkedModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -12,6 +17,38 @@ class UserSerializer(serializers.HyperlinkedModelSerializer):
         user = User.objects.create_user(**data)
         return user
 
+# the profile's numbers, from the UserStats row instead of everything the user wrote
+class UserStatsSerializer(serializers.ModelSerializer):
+    average_score = serializers.SerializerMethodField() # the mean score they give
+    histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
+    class Meta:
+        model = UserStats
+        fields = ['review_count', 'average_score', 'histogram', 'games_added', 'favourite_genres', 'last_active_at']
+
+    def get_average_score(self, stats):
+        return None if stats.average_score is None else round(stats.average_score, 2)
+
+def user_stats_data(user): # select_related('stats') first. no row yet is a user who hasn't written anything
+    try:
+        stats = user.stats
+    except UserStats.DoesNotExist:
+        stats = UserStats(user=user)
+    return UserStatsSerializer(stats).data
+
+# just enough of a user to put a name next to a review
+class UserSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['id', 'username']
+
+# api/token/refresh, a logged out refresh token can't mint new access tokens
+class RevocableTokenRefreshSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        refresh = RefreshToken(attrs['refresh'])
+        if revoked_tokens.is_revoked(refresh.get(jwt_settings.JTI_CLAIM)):
+            raise InvalidToken('Token has been revoked')
+        return super().validate(attrs)
+
 # GROUP
 class GroupSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
@@ -19,12 +56,38 @@ class GroupSerializer(serializers.HyperlinkedModelSerializer):
         fields = ['url', 'name']
 
 # GAME
+class GameStatsSerializer(serializers.ModelSerializer):
+    average_score = serializers.SerializerMethodField()
+    histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
+    class Meta:
+        model = GameStats
+        fields = ['review_count', 'average_score', 'histogram', 'last_review_date']
+
+    def get_average_score(self, stats):
+        return None if stats.average_score is None else round(stats.average_score, 2)
+
 class GameSerializer(serializers.ModelSerializer):
     user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
     genres = serializers.ListSerializer(child=serializers.CharField(max_length=100), allow_empty=True)
+    stats = GameStatsSerializer(read_only=True) # select_related('stats') on the queryset or it's a query per game
     class Meta:
         model = Game
-        fields = ['id', 'name', 'genres', 'description', 'release_date', 'image_url', 'user']
+        fields = ['id', 'name', 'genres', 'description', 'release_date', 'image_url', 'user', 'stats']
+
+# one row of an import_games file. no user field, the command owns the games it imports
+class GameImportSerializer(serializers.ModelSerializer):
+    genres = serializers.ListField(child=serializers.CharField(max_length=50), allow_empty=True)
+    release_date = serializers.DateTimeField(input_formats=['iso-8601', '%Y-%m-%d'])
+    class Meta:
+        model = Game
+        fields = ['name', 'genres', 'description', 'release_date', 'image_url']
+
+# GENRE
+class GenreFacetSerializer(serializers.ModelSerializer):
+    average_score = serializers.FloatField(read_only=True)
+    class Meta:
+        model = GenreFacet
+        fields = ['genre', 'game_count', 'review_count', 'average_score']
 
 # REVIEW
 class ReviewSerializer(serializers.ModelSerializer):
@@ -34,3 +97,55 @@ class ReviewSerializer(serializers.ModelSerializer):
         model = Review
         fields = ['id', 'score', 'review','date_submitted', 'user', 'game']
 
+# one review of a /reviews/batch/ post. plain ids, the view checks them all with one IN query each
+# instead of the two lookups per review PrimaryKeyRelatedField would do
+class ReviewBatchItemSerializer(serializers.ModelSerializer): # no user, every item is the requester's own
+    game = serializers.IntegerField(source='game_id')
+    class Meta:
+        model = Review
+        fields = ['score', 'review', 'date_submitted', 'game']
+
+# REVIEW + who wrote it, for the game page. needs select_related('user') on the queryset
+class ReviewWithReviewerSerializer(ReviewSerializer):
+    reviewer = UserSummarySerializer(source='user', read_only=True)
+    class Meta(ReviewSerializer.Meta):
+        fields = ReviewSerializer.Meta.fields + ['reviewer']
+
+# SEARCH RESULTS, rank and highlights are annotated on by SearchView
+class GameSearchResultSerializer(GameSerializer):
+    rank = serializers.FloatField(read_only=True)
+    name_highlight = serializers.CharField(read_only=True)
+    description_highlight = serializers.CharField(read_only=True)
+    class Meta(GameSerializer.Meta):
+        fields = GameSerializer.Meta.fields + ['rank', 'name_highlight', 'description_highlight']
+
+class ReviewSearchResultSerializer(ReviewWithReviewerSerializer):
+    rank = serializers.FloatField(read_only=True)
+    review_highlight = serializers.CharField(read_only=True)
+    class Meta(ReviewWithReviewerSerializer.Meta):
+        fields = ReviewWithReviewerSerializer.Meta.fields + ['rank', 'review_highlight']
+
+# query string of /search/
+class SearchParamsSerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=200)
+    type = serializers.ChoiceField(choices=['games', 'reviews'], default='games')
+    genres = serializers.CharField(required=False) # comma separated, results have all of them
+    released_after = serializers.DateField(required=False)
+    released_before = serializers.DateField(required=False)
+    min_score = serializers.FloatField(required=False, min_value=1, max_value=5)
+
+    def validate_genres(self, value):
+        return [genre.strip() for genre in value.split(',') if genre.strip()]
+
+# query string of /games/autocomplete/
+class AutocompleteParamsSerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=100)
+    limit = serializers.IntegerField(default=10, min_value=1, max_value=50)
+
+# query string of /export/<kind>.<ndjson|csv>
+class ExportParamsSerializer(serializers.Serializer):
+    game = serializers.IntegerField(required=False)
+    user = serializers.IntegerField(required=False)
+    since = serializers.DateField(required=False)
+    until = serializers.DateField(required=False)
+    after = serializers.IntegerField(required=False, min_value=0) # last key of a download that broke off
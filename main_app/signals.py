@@ -0,0 +1,99 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .aggregates import add_game_to_genres, touch_users
+from .autocomplete import record_name_change
+from .jobs import enqueue
+from .models import Game, GameStats, Review
+from .response_cache import bump_on_commit
+
+
+# signals instead of view code so every write path (viewsets, the APIViews, admin, cascades) keeps the stats
+# and the cached pages right
+
+@receiver(pre_save, sender=Game)
+def game_saving(sender, instance, **kwargs):
+    if instance.pk and not hasattr(instance, '_counted_genres'): # built by hand rather than loaded, look the genres up
+        instance._counted_genres = set(Game.objects.filter(pk=instance.pk).values_list('genres', flat=True).first() or [])
+
+
+@receiver(post_save, sender=Game)
+def game_saved(sender, instance, created, **kwargs):
+    genres = set(instance.genres or [])
+    if created:
+        GameStats.objects.get_or_create(game=instance)
+        add_game_to_genres(instance.pk, genres)
+    elif genres != instance._counted_genres:
+        add_game_to_genres(instance.pk, instance._counted_genres - genres, sign=-1)
+        add_game_to_genres(instance.pk, genres - instance._counted_genres)
+    if created:
+        enqueue(('similar-games', instance.pk), ('user-stats', instance.user_id)) # one more game added on the profile
+    elif genres != instance._counted_genres:
+        enqueue(('similar-games', instance.pk)) # its genre vector changed (similar.py)
+    touch_users([instance.user_id])
+    instance._remember_genres()
+    if created or instance.name != getattr(instance, '_indexed_name', None): # unknown if it wasn't loaded first
+        record_name_change(instance.pk, instance.name)
+        instance._indexed_name = instance.name
+    bump_on_commit('game', instance.pk)
+    bump_on_commit('user', instance.user_id) # the profile lists the user's games
+
+
+@receiver(pre_delete, sender=Game)
+def game_deleting(sender, instance, **kwargs):
+    # before the cascade, while the stats row still has everything the genre totals were given for this game.
+    # the game-stats jobs its reviews' deletes enqueue find no game and do nothing
+    add_game_to_genres(instance.pk, getattr(instance, '_counted_genres', set(instance.genres or [])), sign=-1)
+
+
+@receiver(post_delete, sender=Game)
+def game_deleted(sender, instance, **kwargs):
+    record_name_change(instance.pk, None)
+    enqueue(('user-stats', instance.user_id))
+    bump_on_commit('game', instance.pk)
+    bump_on_commit('user', instance.user_id)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    bump_on_commit('user', instance.pk)
+
+
+# a review write changes its game's stats, the genre totals, its similar games, its author's profile stats and maybe the
+# leaderboards. all of that is left to run_worker (jobs.py), the write only enqueues it. the review lists on the game and
+# profile pages and the author's last activity change now
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, **kwargs):
+    scored_state = getattr(instance, '_scored_state', None) # None: saved without being loaded first, assume it changed
+    if created or scored_state != (instance.game_id, instance.score, instance.date_submitted):
+        game_ids = {instance.game_id} if scored_state is None else {instance.game_id, scored_state[0]}
+        enqueue(*((kind, game_id) for kind in ('game-stats', 'similar-games') for game_id in game_ids),
+                ('user-stats', instance.user_id), ('rankings', None))
+        for game_id in game_ids - {instance.game_id}: # moved to another game
+            bump_on_commit('game', game_id)
+    instance._remember_scored_state()
+    touch_users([instance.user_id])
+    bump_on_commit('game', instance.game_id)
+    bump_on_commit('user', instance.user_id)
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    game_id = getattr(instance, '_scored_state', (instance.game_id,))[0]
+    enqueue(('game-stats', game_id), ('similar-games', game_id), ('user-stats', instance.user_id), ('rankings', None))
+    bump_on_commit('game', game_id)
+    bump_on_commit('user', instance.user_id)
+
+
+def reviews_bulk_created(reviews):
+    # bulk_create sends no signals. this is review_saved for a whole batch, once per game and user instead of per review
+    game_ids = {review.game_id for review in reviews}
+    user_ids = {review.user_id for review in reviews}
+    enqueue(*((kind, game_id) for kind in ('game-stats', 'similar-games') for game_id in game_ids),
+            *(('user-stats', user_id) for user_id in user_ids), ('rankings', None))
+    touch_users(user_ids)
+    for game_id in game_ids:
+        bump_on_commit('game', game_id)
+    for user_id in user_ids:
+        bump_on_commit('user', user_id)
@@ -0,0 +1,168 @@
+import io
+import math
+import time
+
+import numpy as np
+import orjson
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+from scipy import sparse
+
+from .models import Game, Review
+
+# "if you liked X" for /games/<id>/similar/. every game is two vectors: its genres one-hot, and its reviews as
+# score - NEUTRAL_SCORE per reviewer, so a 5 pulls it towards the other games that reviewer liked and a 1 away from
+# them. both are scaled to length 1 and a game's similarity to another is the cosine of their genre vectors times
+# GENRE_WEIGHT plus the cosine of their review vectors times the rest, so games nobody reviewed still get
+# neighbours by genre. games are scored CHUNK_SIZE at a time against all the others, that chunk's scores are
+# the only dense matrix, and each game's best TOP_K go to its SimilarGames row.
+# build_similar_games() does every game. review writes queue a 'similar-games' job per game (jobs.py) that redoes
+# just those games, games that list a changed game keep its old score until the next full build
+TOP_K = 20
+GENRE_WEIGHT = 0.3
+NEUTRAL_SCORE = 3 # a 3 says nothing either way and isn't loaded at all
+# up to this much is added for how many people reviewed a game, so of games that are equally alike the better
+# known one comes first. it also keeps argpartition fast, rows with a handful of distinct values are its worst case
+POPULARITY_WEIGHT = 0.001
+CHUNK_SIZE = 64 # games scored at a time, a chunk takes about CHUNK_SIZE x games x 20 bytes (130 MB at 100k games)
+SAVE_SIZE = 1024 # games written per transaction
+COPY_SIZE = 1000000 # review ids per COPY
+
+# COPY ... (FORMAT binary) of three int8 columns: a field count, then a length and a big endian value per field.
+# numpy reads a whole batch of those at once, no python object per review
+COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+COPY_ROW = np.dtype([('fields', '>i2'), ('game_length', '>i4'), ('game', '>i8'), ('user_length', '>i4'), ('user', '>i8'),
+                     ('weight_length', '>i4'), ('weight', '>i8')])
+REVIEWS_COPY = """
+    COPY (
+        SELECT game_id::int8, user_id::int8, (score - %(neutral)s)::int8 FROM main_app_review
+        WHERE id > %(after)s AND id <= %(until)s AND score <> %(neutral)s
+    ) TO STDOUT (FORMAT binary)
+"""
+
+# a row per game, sent as a json array of them. an upsert replaces what a game had without a delete first, so
+# writers never wait for each other and readers see the old list or the new one
+UPSERT_SQL = """
+    INSERT INTO main_app_similargames (game_id, similar_ids, scores, computed_at)
+    SELECT n.game_id, n.similar_ids, n.scores, %(now)s
+    FROM jsonb_to_recordset(%(rows)s::jsonb) AS n (game_id int8, similar_ids int8[], scores float8[])
+    WHERE EXISTS (SELECT 1 FROM main_app_game WHERE id = n.game_id) -- it may have been deleted since it was loaded
+    ON CONFLICT (game_id) DO UPDATE SET similar_ids = excluded.similar_ids, scores = excluded.scores, computed_at = excluded.computed_at
+"""
+
+
+def normalized_rows(matrix): # every row scaled to length 1, rows of zeros stay zeros
+    if sparse.issparse(matrix):
+        lengths = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        return sparse.csr_matrix(sparse.diags((1 / np.where(lengths, lengths, 1)).astype(np.float32)) @ matrix)
+    lengths = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(lengths, lengths, 1)
+
+
+def load_games(): # sorted game ids and their genre vectors, dense games x genres (genres are a few dozen words)
+    ids, rows, columns, vocabulary = [], [], [], {}
+    for row, (game_id, genres) in enumerate(Game.objects.order_by('id').values_list('id', 'genres').iterator(chunk_size=10000)):
+        ids.append(game_id)
+        for genre in set(genres or []):
+            rows.append(row)
+            columns.append(vocabulary.setdefault(genre, len(vocabulary)))
+    genres = np.zeros((len(ids), len(vocabulary)), dtype=np.float32)
+    genres[rows, columns] = 1
+    return np.array(ids, dtype=np.int64), normalized_rows(genres)
+
+
+def copy_reviews(cursor, after, until): # (game, user, weight) records of the reviews with ids in (after, until]
+    buffer = io.BytesIO()
+    cursor.copy_expert(cursor.mogrify(REVIEWS_COPY, {'neutral': NEUTRAL_SCORE, 'after': after, 'until': until}).decode(), buffer)
+    data = buffer.getbuffer()
+    if data[:len(COPY_SIGNATURE)] != COPY_SIGNATURE:
+        raise ValueError('not a binary COPY')
+    flags_end = len(COPY_SIGNATURE) + 4
+    start = flags_end + 4 + int.from_bytes(data[flags_end:flags_end + 4], 'big') # after the header extension
+    return np.frombuffer(data, dtype=COPY_ROW, offset=start, count=(len(data) - start - 2) // COPY_ROW.itemsize) # -1 trailer
+
+
+def load_reviews(game_ids): # sparse games x reviewers of score - NEUTRAL_SCORE, a row per game_ids entry, rows length 1
+    games, users, weights = [], [np.empty(0, np.int64)], []
+    bounds = Review.objects.aggregate(first=Min('id'), last=Max('id'))
+    if len(game_ids) and bounds['first'] is not None:
+        with connection.cursor() as cursor:
+            for after in range(bounds['first'] - 1, bounds['last'], COPY_SIZE):
+                rows = copy_reviews(cursor, after, after + COPY_SIZE)
+                positions = np.searchsorted(game_ids, rows['game']).clip(max=len(game_ids) - 1)
+                known = game_ids[positions] == rows['game'] # not a game added since load_games()
+                games.append(positions[known].astype(np.int32))
+                users.append(rows['user'][known])
+                weights.append(rows['weight'][known].astype(np.float32))
+    users, user_positions = np.unique(np.concatenate(users), return_inverse=True)
+    reviews = sparse.csr_matrix( # two reviews of one game by the same user add up
+        (np.concatenate(weights or [np.empty(0, np.float32)]), (np.concatenate(games or [np.empty(0, np.int32)]), user_positions)),
+        shape=(len(game_ids), len(users)), dtype=np.float32,
+    )
+    return normalized_rows(reviews)
+
+
+def nearest(genres, reviews, rows, top_k=TOP_K, genre_weight=GENRE_WEIGHT, chunk_size=CHUNK_SIZE):
+    # for chunk_size of rows at a time: (the rows, their top_k neighbours' rows best first, the similarities),
+    # the last two are rows x top_k. similarities of 0 or less are nan, nothing in common isn't similar
+    top_k = min(top_k, len(genres) - 1)
+    weighted_genres = (genre_weight * genres).T.copy() # genres x games, what the chunks multiply against
+    reviewed_by = ((1 - genre_weight) * reviews).T.tocsr() # reviewers x games, the same for reviews
+    reviewers = np.diff(reviews.indptr)
+    popularity = (POPULARITY_WEIGHT * np.log1p(reviewers) / np.log1p(max(reviewers.max(initial=0), 1))).astype(np.float32)
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        scores = genres[chunk] @ weighted_genres
+        overlap = (reviews[chunk] @ reviewed_by).tocoo() # only the pairs with a reviewer in common
+        scores[overlap.row, overlap.col] += overlap.data
+        scores += popularity
+        scores[np.arange(len(chunk)), chunk] = -np.inf # not itself
+        best = np.argpartition(scores, -top_k, axis=1)[:, -top_k:] if top_k > 0 else np.empty((len(chunk), 0), np.intp)
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        best, best_scores = np.take_along_axis(best, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+        similarities = best_scores - popularity[best]
+        yield chunk, best, np.where(similarities > 0, similarities, np.nan)
+
+
+def save_nearest(game_ids, chunks): # chunks from nearest(), replacing what those games had
+    rows = []
+    for chunk, best, best_scores in chunks:
+        for game_id, similar_ids, scores in zip(game_ids[chunk].tolist(), game_ids[best].tolist(), best_scores.tolist()):
+            kept = [(similar_id, round(score, 6)) for similar_id, score in zip(similar_ids, scores) if not math.isnan(score)]
+            rows.append({'game_id': game_id, 'similar_ids': [similar_id for similar_id, _ in kept], 'scores': [score for _, score in kept]})
+    outermost = not connection.in_atomic_block
+    with transaction.atomic(), connection.cursor() as cursor:
+        # rebuilt from the reviews if a crash loses it, no need to wait for the disk. only when this is the whole
+        # transaction, as in the build_similar_games command: SET LOCAL lasts until the outermost COMMIT, and in a
+        # job (jobs.run_batch) that is the one that deletes the Job rows, which stay at the normal setting
+        if outermost:
+            cursor.execute('SET LOCAL synchronous_commit TO OFF')
+        cursor.execute(UPSERT_SQL, {'rows': orjson.dumps(rows).decode(), 'now': timezone.now()})
+        return cursor.rowcount
+
+
+def build_similar_games(game_ids=None, top_k=TOP_K, genre_weight=GENRE_WEIGHT, chunk_size=CHUNK_SIZE, report=None):
+    # the neighbours of game_ids, or of every game. report(stage, seconds) hears how long each stage took
+    started = time.perf_counter()
+    ids, genres = load_games()
+    reviews = load_reviews(ids)
+    if report:
+        report('load', time.perf_counter() - started)
+    # deleted games have nothing to redo, their rows went with them
+    rows = np.arange(len(ids)) if game_ids is None else np.flatnonzero(np.isin(ids, list(game_ids)))
+    per_save = max(1, SAVE_SIZE // chunk_size)
+    saved, saving, pending = 0, 0, []
+    scoring_started = time.perf_counter()
+    for number, chunk in enumerate(nearest(genres, reviews, rows, top_k, genre_weight, chunk_size), start=1):
+        pending.append(chunk)
+        if number % per_save == 0 or number * chunk_size >= len(rows):
+            mark = time.perf_counter()
+            saved += save_nearest(ids, pending)
+            saving += time.perf_counter() - mark
+            pending = []
+    if report:
+        report('score', time.perf_counter() - scoring_started - saving)
+        report('save', saving)
+    return saved # games
@@ -1,3 +1,1106 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import tempfile
+import threading
+import tracemalloc
+from io import StringIO
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from functools import partial
+from types import SimpleNamespace
+from unittest.mock import patch
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils.translation import gettext_lazy
+from prometheus_client import REGISTRY
+from psycopg2 import extensions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+from scipy import sparse
+
+from .authentication import RevocableJWTAuthentication
+from .autocomplete import GameNameIndex, game_names
+from .db_pool.pool import ConnectionPool, PoolTimeout
+from .exports import stream_export
+from .jobs import BACKOFF, MAX_ATTEMPTS, claim, enqueue, handlers, job, queue_depth, release, run_job, run_jobs
+from .fast_serializers import game_rows, review_rows, serialize_games, serialize_reviews, serialize_reviews_with_reviewer
+from .models import Game, GameNameChange, GameRanking, GameStats, GenreFacet, Job, Review, RevokedToken, SimilarGames, UserStats
+from .pagination import analyzed_tables
+from .rankings import refresh_rankings
+from .renderers import FastJSONRenderer
+from .revocation import RevocationList, revoked_tokens
+from .similar import build_similar_games, nearest, normalized_rows
+from .serializers import GameSerializer, ReviewSerializer, ReviewWithReviewerSerializer
+
+# a stand-in read replica for RoutingTests: a second connection to the test database (a test mirror of default).
+# like a replica that is behind, it doesn't see anything the test's transaction hasn't committed
+connections.settings.setdefault('replica-test', {**connections.settings['default'], 'TEST': {'MIRROR': 'default'}})
+
+
+def make_game(user, name='Celeste'):
+    return Game.objects.create(
+        name=name,
+        genres=['Platformer', 'Indie'],
+        description='climb the mountain',
+        release_date=datetime(2018, 1, 25, tzinfo=timezone.utc),
+        image_url='https://example.com/celeste.png',
+        user=user,
+    )
+
+
+def make_reviews(game, count):
+    reviewers = User.objects.bulk_create(User(username=f'reviewer-{game.id}-{n}') for n in range(count))
+    for n, reviewer in enumerate(reviewers):
+        Review.objects.create(game=game, user=reviewer, score=n % 5 + 1, review='good', date_submitted=date(2023, 11, n % 28 + 1))
+
+
+class QueryCountTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sofia', password='pw')
+        self.client.force_authenticate(self.user)
+
+    def assert_constant_queries(self, url_for, expected):
+        # same number of queries for a game with 1 review and one with 50
+        for count in (1, 50):
+            game = make_game(self.user, name=f'game with {count} reviews')
+            make_reviews(game, count)
+            with self.assertNumQueries(expected):
+                response = self.client.get(url_for(game))
+            self.assertEqual(response.status_code, 200)
+
+    def test_game_detail_embeds_reviewers(self):
+        self.assert_constant_queries(lambda game: f'/games/{game.id}/', 2) # game + stats, reviews + users
+
+        game = Game.objects.get(name='game with 50 reviews')
+        response = self.client.get(f'/games/{game.id}/')
+        self.assertEqual(len(response.data['reviews']), 50)
+        first = response.data['reviews'][0]
+        self.assertEqual(first['reviewer'], {'id': first['user'], 'username': User.objects.get(pk=first['user']).username})
+
+    def test_profile(self):
+        for n in range(25):
+            make_reviews(make_game(self.user, name=f'mine {n}'), 1)
+        with self.assertNumQueries(3): # user + profile stats, games + stats, reviews
+            response = self.client.get(f'/users/{self.user.id}/')
+        self.assertEqual([game['name'] for game in response.data['games']], [f'mine {n}' for n in range(24, 4, -1)]) # newest first
+        self.assertIsNone(response.data['reviews_next'])
+        rest = self.client.get(response.data['games_next']).json() # carries on at /games/?user=
+        self.assertEqual([game['name'] for game in rest['results']], [f'mine {n}' for n in range(4, -1, -1)])
+        self.assertIsNone(rest['next'])
+
+    def test_batch_user_lookup(self):
+        game = make_game(self.user)
+        make_reviews(game, 30)
+        ids = list(game.reviews.values_list('user_id', flat=True))
+        with self.assertNumQueries(1):
+            response = self.client.get('/users/', {'ids': ','.join(map(str, ids))})
+        self.assertEqual(sorted(user['id'] for user in response.data), sorted(ids))
+
+    def test_batch_user_lookup_rejects_junk(self):
+        response = self.client.get('/users/', {'ids': '1,two'})
+        self.assertEqual(response.status_code, 400)
+
+
+
+class PaginationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sofia', password='pw')
+        self.client.force_authenticate(self.user)
+        days = [3, 1, 3, 2, 1, 3, 2] # ties, so the id decides
+        for n, day in enumerate(days):
+            game = make_game(self.user, name=f'game {n}')
+            Game.objects.filter(pk=game.pk).update(release_date=datetime(2020, 1, day, tzinfo=timezone.utc))
+            reviewer = User.objects.create_user(f'reviewer {n}', date_joined=datetime(2021, 1, day, tzinfo=timezone.utc))
+            Review.objects.create(game=game, user=reviewer, score=4, review='ok', date_submitted=date(2023, 1, day))
+        User.objects.filter(pk=self.user.pk).update(date_joined=datetime(2021, 1, 2, tzinfo=timezone.utc))
+
+    def walk(self, url):
+        # every page's ids following next to the end, then following previous back to the start
+        url += ('&' if '?' in url else '?') + 'page_size=2'
+        forward = [self.client.get(url).json()]
+        while forward[-1]['next']:
+            forward.append(self.client.get(forward[-1]['next']).json())
+        backward = [forward[-1]]
+        while backward[-1]['previous']:
+            backward.append(self.client.get(backward[-1]['previous']).json())
+        ids = lambda pages: [[row['id'] for row in page['results']] for page in pages]
+        return ids(forward), ids(reversed(backward))
+
+    def assert_pages(self, url, expected):
+        forward, backward = self.walk(url)
+        self.assertEqual(sum(forward, []), list(expected))
+        self.assertEqual(backward, forward)
+        self.assertIsNone(self.client.get(url).json()['previous'])
+
+    def test_every_ordering_both_ways(self):
+        lists = [
+            ('/games/', Game.objects.all(), {'id': ['id'], '-id': ['-id'], 'release_date': ['release_date', 'id'],
+                                             '-release_date': ['-release_date', '-id']}),
+            ('/reviews/', Review.objects.all(), {'-date_submitted': ['-date_submitted', '-id'], 'date_submitted': ['date_submitted', 'id']}),
+            ('/users/', User.objects.all(), {'-date_joined': ['-date_joined', '-id'], 'date_joined': ['date_joined', 'id']}),
+        ]
+        for path, queryset, orderings in lists:
+            for ordering, fields in orderings.items():
+                with self.subTest(path=path, ordering=ordering):
+                    self.assert_pages(f'{path}?ordering={ordering}', queryset.order_by(*fields).values_list('id', flat=True))
+        self.assert_pages('/games/', Game.objects.order_by('id').values_list('id', flat=True)) # the first one by default
+
+    def test_count(self):
+        analyzed_tables.clear()
+        # the test tables were never analyzed, the planner guesses about a thousand rows for any of them
+        self.assertEqual(self.client.get('/games/', {'count': 'true'}).json()['count'], 7)
+        self.assertEqual(self.client.get('/reviews/', {'count': 'true', 'game': Game.objects.first().id}).json()['count'], 1)
+        self.assertNotIn('count', self.client.get('/games/').json())
+
+    def test_invalid_cursors_are_404s(self):
+        cursors = [
+            {'o': 'id', 'v': ['abc']}, {'o': 'id', 'v': [None]}, {'o': 'id', 'v': [[1]]}, {'o': 'id', 'v': [{'a': 1}]},
+            {'o': 'id', 'v': [2 ** 80]}, {'o': 'id', 'v': 1}, {'o': 'id', 'v': [1, 2]}, {'o': 'nope', 'v': [1]},
+            {'o': 'release_date', 'v': ['not-a-date', 1]}, {'o': 'release_date', 'v': [None, 1]}, ['id', [1]],
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                encoded = base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+                self.assertEqual(self.client.get('/games/', {'cursor': encoded}).status_code, 404)
+        self.assertEqual(self.client.get('/games/', {'cursor': 'not base64 json'}).status_code, 404)
+        self.assertEqual(self.client.get('/reviews/', {'cursor': base64.urlsafe_b64encode(b'{"o":"date_submitted","v":["2023-02-30",1]}').decode()}).status_code, 404)
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=True)
+class ResponseCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('sofia', password='pw')
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.game = make_game(self.user)
+
+    def test_hit_and_not_modified_skip_the_database(self):
+        url = f'/games/{self.game.id}/'
+        first = self.client.get(url)
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.data, first.data)
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_review_write_changes_the_version(self):
+        url = f'/games/{self.game.id}/'
+        before = self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            make_reviews(self.game, 1)
+        after = self.client.get(url, HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(after.status_code, 200) # the new review
+        self.assertEqual(after.data['game']['stats']['review_count'], 0) # the stats are the worker's job
+        with self.captureOnCommitCallbacks(execute=True):
+            run_jobs()
+        before, after = after, self.client.get(url, HTTP_IF_NONE_MATCH=after['ETag'])
+        self.assertEqual(after.status_code, 200)
+        self.assertEqual(after['X-Cache'], 'MISS')
+        self.assertNotEqual(after['ETag'], before['ETag'])
+        self.assertEqual(after.data['game']['stats']['review_count'], 1)
+
+    def test_profile_follows_game_edits(self):
+        url = f'/users/{self.user.id}/'
+        before = self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(f'/games/{self.game.id}/edit', {
+                'name': 'Celeste Farewell', 'genres': ['Platformer'], 'description': 'more mountain',
+                'release_date': '2019-09-09T00:00:00Z', 'image_url': 'https://example.com/c.png', 'user': self.user.id,
+            }, format='json')
+        after = self.client.get(url)
+        self.assertNotEqual(after['ETag'], before['ETag'])
+        self.assertEqual(after.data['games'][0]['name'], 'Celeste Farewell')
+
+
+class SearchTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sofia', password='pw')
+        self.client.force_authenticate(self.user)
+        self.game = make_game(self.user, name='Hollow Knight')
+        shovel_knight = make_game(self.user, name='Shovel Knight')
+        shovel_knight.genres = ['Action']
+        shovel_knight.save()
+
+    def test_games_are_ranked_and_highlighted(self):
+        response = self.client.get('/search/', {'q': 'hollow knight'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['id'], self.game.id)
+        self.assertIn('<mark>Hollow</mark>', response.data['results'][0]['name_highlight'])
+
+    def test_genre_filter(self):
+        response = self.client.get('/search/', {'q': 'knight', 'genres': 'Indie'})
+        self.assertEqual([game['id'] for game in response.data['results']], [self.game.id])
+
+    def test_reviews(self):
+        make_reviews(self.game, 1)
+        Review.objects.update(review='the mantis lords fight is brilliant')
+        response = self.client.get('/search/', {'q': 'mantis', 'type': 'reviews'})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIn('<mark>mantis</mark>', response.data['results'][0]['review_highlight'])
+
+    def test_query_is_required(self):
+        self.assertEqual(self.client.get('/search/').status_code, 400)
+
+
+class GenreFacetTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sofia', password='pw')
+        self.client.force_authenticate(self.user)
+
+    def facets(self):
+        return {facet['genre']: facet for facet in self.client.get('/genres/').data}
+
+    def test_follows_games_and_reviews(self):
+        game = make_game(self.user) # Platformer, Indie
+        make_reviews(game, 2) # scores 1 and 2
+        run_jobs()
+        other = make_game(self.user, name='Hades')
+        other.genres = ['Indie', 'Roguelike']
+        other.save()
+
+        facets = self.facets()
+        self.assertEqual(facets['Indie']['game_count'], 2)
+        self.assertEqual(facets['Platformer']['average_score'], 1.5)
+        self.assertEqual(facets['Roguelike']['review_count'], 0)
+        self.assertNotIn('Action', facets)
+
+        game.genres = ['Indie', 'Action']
+        game.save()
+        facets = self.facets()
+        self.assertNotIn('Platformer', facets)
+        self.assertEqual(facets['Action']['review_count'], 2)
+
+        game.delete()
+        facets = self.facets()
+        self.assertEqual(facets['Indie']['game_count'], 1)
+        self.assertEqual(facets['Indie']['review_count'], 0)
+
+    def test_genre_filtered_listing(self):
+        game = make_game(self.user)
+        other = make_game(self.user, name='Hades')
+        other.genres = ['Indie', 'Roguelike']
+        other.save()
+        response = self.client.get('/games/', {'genres': 'Platformer,Indie'})
+        self.assertEqual([row['id'] for row in response.data['results']], [game.id])
+
+
+class ImportGamesTests(APITestCase):
+    def test_upserts_dedupes_and_rejects(self):
+        user = User.objects.create_user('importer')
+        rows = [
+            {'name': 'Hades', 'genres': ['Roguelike'], 'description': 'v1', 'release_date': '2020-09-17', 'image_url': 'https://example.com/h.png'},
+            {'name': 'HADES!', 'genres': ['Roguelike', 'Indie'], 'description': 'v2', 'release_date': '2020-09-17', 'image_url': 'https://example.com/h.png'},
+            {'name': 'Celeste', 'genres': [], 'description': 'climb', 'release_date': 'not a date', 'image_url': 'https://example.com/c.png'},
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'games.jsonl')
+            with open(path, 'w') as dump:
+                dump.write('\n'.join(json.dumps(row) for row in rows) + '\nnot json\n')
+            call_command('import_games', path, user='importer', batch_size=2, stdout=open(os.devnull, 'w'))
+            call_command('import_games', path, user='importer', stdout=open(os.devnull, 'w')) # again, nothing new
+            self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+
+        hades = Game.objects.get(user=user)
+        self.assertEqual(hades.description, 'v2')
+        self.assertTrue(GameStats.objects.filter(game=hades).exists())
+
+
+class BatchReviewTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sofia', password='pw')
+        self.client.force_authenticate(self.user)
+        self.games = [make_game(self.user, name=name) for name in ('Celeste', 'Hades')]
+
+    def post_batch(self, count):
+        items = [
+            {'score': n % 5 + 1, 'review': 'ok', 'date_submitted': '2023-11-20', 'user': self.user.id, 'game': self.games[n % 2].id}
+            for n in range(count)
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/reviews/batch/', items, format='json')
+        self.assertEqual(response.status_code, 201)
+        return len(queries)
+
+    def test_queries_depend_on_games_not_reviews(self):
+        self.assertEqual(self.post_batch(10), self.post_batch(200))
+        self.assertEqual(run_jobs(), {'done': 3}) # each game's stats and the reviewer's once, the leaderboards are due in a minute
+        stats = GameStats.objects.get(game=self.games[0])
+        self.assertEqual(stats.review_count, 105)
+
+    def test_reviews_are_the_requesters(self):
+        someone_else = User.objects.create_user('someone else')
+        response = self.client.post('/reviews/batch/', [{'score': 1, 'review': 'as someone else', 'date_submitted': '2023-11-20',
+                                                         'user': someone_else.id, 'game': self.games[0].id}], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data[0]['user'], self.user.id)
+        self.assertFalse(Review.objects.filter(user=someone_else).exists())
+
+    def test_errors_per_item_and_nothing_saved(self):
+        items = [
+            {'score': 5, 'review': 'ok', 'date_submitted': '2023-11-20', 'user': self.user.id, 'game': self.games[0].id},
+            {'score': 9, 'review': 'ok', 'date_submitted': '2023-11-20', 'user': self.user.id, 'game': self.games[0].id},
+            {'score': 5, 'review': 'ok', 'date_submitted': '2023-11-20', 'user': self.user.id, 'game': 999999},
+        ]
+        response = self.client.post('/reviews/batch/', items, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('score', response.data[1])
+        self.assertIn('game', response.data[2])
+        self.assertFalse(Review.objects.exists())
+
+
+class GameStatsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sofia', password='pw')
+        self.games = [make_game(self.user, name=name) for name in ('Celeste', 'Hades')]
+        make_reviews(self.games[0], 3) # scores 1, 2, 3 on 2023-11-01 to 03
+        run_jobs()
+
+    def assert_stats(self, game, count, average, histogram, last_review_date):
+        stats = GameStats.objects.get(game=game)
+        self.assertEqual((stats.review_count, stats.average_score, stats.histogram, stats.last_review_date),
+                         (count, average, histogram, last_review_date))
+
+    def test_follow_review_writes(self):
+        celeste, hades = self.games
+        self.assert_stats(celeste, 3, 2.0, {1: 1, 2: 1, 3: 1, 4: 0, 5: 0}, date(2023, 11, 3))
+        review = Review.objects.create(game=celeste, user=self.user, score=5, review='great', date_submitted=date(2023, 12, 1))
+        run_jobs()
+        self.assert_stats(celeste, 4, 2.75, {1: 1, 2: 1, 3: 1, 4: 0, 5: 1}, date(2023, 12, 1))
+
+        review.score = 4
+        review.save()
+        run_jobs()
+        self.assert_stats(celeste, 4, 2.5, {1: 1, 2: 1, 3: 1, 4: 1, 5: 0}, date(2023, 12, 1))
+
+        review.game = hades
+        review.save()
+        run_jobs() # both games recounted
+        self.assert_stats(celeste, 3, 2.0, {1: 1, 2: 1, 3: 1, 4: 0, 5: 0}, date(2023, 11, 3))
+        self.assert_stats(hades, 1, 4.0, {1: 0, 2: 0, 3: 0, 4: 1, 5: 0}, date(2023, 12, 1))
+
+        review.delete()
+        run_jobs()
+        self.assert_stats(hades, 0, None, {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}, None)
+
+    def test_rebuild(self):
+        celeste, hades = self.games
+        Review.objects.filter(game=celeste).update(score=5) # no signals, so the stats drift
+        GameStats.objects.filter(game=hades).delete() # missing
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_game_stats', verify=True, stdout=out)
+        self.assertIn(f'game {celeste.id}: stats were wrong\n', out.getvalue())
+        self.assertIn(f'game {hades.id}: stats were wrong\n', out.getvalue())
+        self.assert_stats(celeste, 3, 2.0, {1: 1, 2: 1, 3: 1, 4: 0, 5: 0}, date(2023, 11, 3)) # only reported
+
+        out = StringIO()
+        call_command('rebuild_game_stats', batch_size=1, stdout=out)
+        self.assertIn('2 games checked, 2 wrong', out.getvalue())
+        self.assert_stats(celeste, 3, 5.0, {1: 0, 2: 0, 3: 0, 4: 0, 5: 3}, date(2023, 11, 3))
+        self.assert_stats(hades, 0, None, {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}, None)
+        self.assertEqual(GenreFacet.objects.get(genre='Platformer').score_sum, 15) # the genre totals moved with it
+        call_command('rebuild_game_stats', verify=True, stdout=StringIO()) # clean now
+
+
+class RevocationTests(APITestCase):
+    def setUp(self):
+        revoked_tokens.clear()
+        RevocableJWTAuthentication.users.clear()
+        User.objects.create_user('sofia', password='pw')
+        self.tokens = self.client.post('/api/login', {'username': 'sofia', 'password': 'pw'}, format='json').json()
+        self.client.logout() # only the bearer token from here on
+
+    def test_logged_out_token_is_refused(self):
+        bearer = f"Bearer {self.tokens['access']}"
+        self.assertEqual(self.client.get('/games/', HTTP_AUTHORIZATION=bearer).status_code, 200)
+        self.client.post('/api/logout', {'token': self.tokens['access'], 'refresh': self.tokens['refresh']}, format='json')
+        self.assertEqual(self.client.get('/games/', HTTP_AUTHORIZATION=bearer).status_code, 401)
+        self.assertEqual(RevokedToken.objects.count(), 2)
+
+    def test_other_workers_pick_it_up_on_sync(self):
+        other_worker = RevocationList(sync_seconds=0)
+        other_worker.sync()
+        self.client.post('/api/logout', {'token': self.tokens['access']}, format='json')
+        jti = RevokedToken.objects.get().jti
+        self.assertTrue(other_worker.is_revoked(jti))
+
+    def test_refresh(self):
+        response = self.client.post('/api/token/refresh', {'refresh': self.tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/games/', HTTP_AUTHORIZATION=f"Bearer {response.data['access']}").status_code, 200)
+
+        self.client.post('/api/logout', {'refresh': self.tokens['refresh']}, format='json')
+        response = self.client.post('/api/token/refresh', {'refresh': self.tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_known_token_needs_no_queries(self):
+        bearer = f"Bearer {self.tokens['access']}"
+        self.client.get('/genres/', HTTP_AUTHORIZATION=bearer)
+        with self.assertNumQueries(1): # just the genres
+            self.client.get('/genres/', HTTP_AUTHORIZATION=bearer)
+
+    def test_checks_are_local_between_syncs(self):
+        worker = RevocationList(sync_seconds=60)
+        worker.sync()
+        with self.assertNumQueries(0):
+            self.assertFalse(worker.is_revoked('not-revoked'))
+
+
+class AsyncViewTests(APITestCase):
+    def setUp(self):
+        revoked_tokens.clear()
+        RevocableJWTAuthentication.users.clear()
+        self.user = User.objects.create_user('sofia', password='pw')
+        self.game = make_game(self.user)
+        make_reviews(self.game, 3)
+        self.bearer = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+
+    async def test_same_json_as_the_sync_views(self):
+        for path in ('/games/', f'/games/{self.game.id}/', f'/users/{self.user.id}/'):
+            expected = await sync_to_async(self.client.get)(path, HTTP_AUTHORIZATION=self.bearer)
+            response = await self.async_client.get(f'/async{path}', headers={'Authorization': self.bearer})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), expected.json())
+
+    async def test_same_filters_as_the_sync_views(self):
+        paths = (f'/games/?user={self.user.id}', '/games/?genres=Indie,%20Platformer', '/games/?genres=RPG', '/games/?user=me',
+                 f'/reviews/?user={self.user.id}', f'/reviews/?game={self.game.id}', '/reviews/?game=celeste')
+        for path in paths:
+            expected = await sync_to_async(self.client.get)(path, HTTP_AUTHORIZATION=self.bearer)
+            response = await self.async_client.get(f'/async{path}', headers={'Authorization': self.bearer})
+            self.assertEqual((response.status_code, response.json()), (expected.status_code, expected.json()), path)
+
+    async def test_paging(self):
+        path = f'/reviews/?game={self.game.id}&page_size=2'
+        expected = (await sync_to_async(self.client.get)(path, HTTP_AUTHORIZATION=self.bearer)).json()
+        response = (await self.async_client.get(f'/async{path}', headers={'Authorization': self.bearer})).json()
+        self.assertEqual(response['results'], expected['results'])
+        self.assertTrue(response['next'].startswith('http://testserver/async/reviews/'))
+        response = await self.async_client.get(response['next'], headers={'Authorization': self.bearer})
+        self.assertEqual(len(response.json()['results']), 1)
+
+    async def test_exports_stream_under_asgi(self):
+        get = lambda: b''.join(self.client.get('/export/reviews.ndjson', HTTP_AUTHORIZATION=self.bearer).streaming_content)
+        expected = await sync_to_async(get)()
+        with patch('main_app.views.stream_export', partial(stream_export, chunk_size=1)):
+            response = await self.async_client.get('/export/reviews.ndjson', headers={'Authorization': self.bearer})
+        self.assertTrue(response.is_async) # not a sync body django would read into a list first
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(len(chunks), 3) # one row per chunk, as they came off the cursor
+        self.assertEqual(b''.join(chunks), expected)
+
+    async def test_needs_a_token(self):
+        response = await self.async_client.get('/async/games/')
+        self.assertEqual(response.status_code, 401)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.info = SimpleNamespace(transaction_status=extensions.TRANSACTION_STATUS_IDLE)
+
+    def close(self):
+        self.closed = 1
+
+    def rollback(self):
+        self.info.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def test_reuses_bounds_and_waits(self):
+        pool = ConnectionPool(max_size=2, timeout=0.1)
+        first, second = pool.getconn(FakeConnection), pool.getconn(FakeConnection)
+        with self.assertRaises(PoolTimeout):
+            pool.getconn(FakeConnection)
+
+        threading.Timer(0.02, pool.putconn, [first]).start()
+        self.assertIs(pool.getconn(FakeConnection), first) # handed over once it came back
+        stats = pool.get_stats()
+        self.assertEqual((stats['connects'], stats['checkouts'], stats['waits'], stats['timeouts']), (2, 3, 2, 1))
+
+    def test_returned_connections_are_cleaned_up(self):
+        pool = ConnectionPool(max_size=2)
+        connection = pool.getconn(FakeConnection)
+        connection.info.transaction_status = extensions.TRANSACTION_STATUS_INTRANS
+        pool.putconn(connection)
+        self.assertEqual(connection.info.transaction_status, extensions.TRANSACTION_STATUS_IDLE)
+
+        connection = pool.getconn(FakeConnection)
+        connection.closed = 1 # the server went away
+        pool.putconn(connection)
+        self.assertIsNot(pool.getconn(FakeConnection), connection)
+        self.assertEqual(pool.get_stats()['discarded'], 1)
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sofia', password='pw')
+        self.client.force_authenticate(self.user)
+        make_reviews(make_game(self.user), 3)
+
+    def sample(self, name, route):
+        return REGISTRY.get_sample_value(name, {'route': route, 'method': 'GET'}) or 0
+
+    def test_records_per_route(self):
+        before = self.sample('http_request_sql_queries_sum', '^reviews/$')
+        self.client.get('/reviews/')
+        self.assertEqual(self.sample('http_request_sql_queries_sum', '^reviews/$') - before, 1)
+        self.assertGreater(self.sample('http_request_serialization_seconds_sum', '^reviews/$'), 0)
+
+        with override_settings(METRICS_TOKEN='scraper'):
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scraper')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'http_response_size_bytes_bucket{le="256.0",method="GET",route="^reviews/$"}', response.content)
+        self.assertIn(b'db_pool_checkouts_total', response.content)
+
+    def test_needs_a_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404) # no METRICS_TOKEN, not public
+        with override_settings(DEBUG=True): # not even in DEBUG, settings.py ships with it on
+            self.assertEqual(self.client.get('/metrics').status_code, 404)
+            with override_settings(METRICS_TOKEN='scraper'):
+                self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scraper').status_code, 200)
+        with override_settings(METRICS_TOKEN='scraper'):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer guess').status_code, 401)
+
+    async def test_async_views(self):
+        bearer = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        sample = sync_to_async(self.sample) # reading the registry runs the job queue collector's query
+        before = await sample('http_request_sql_queries_count', 'async/games/')
+        await self.async_client.get('/async/games/', headers={'Authorization': bearer})
+        self.assertEqual(await sample('http_request_sql_queries_count', 'async/games/') - before, 1)
+        self.assertGreater(await sample('http_request_sql_queries_sum', 'async/games/'), 0)
+
+    @override_settings(SLOW_REQUEST_MS=0)
+    def test_slow_request_log(self):
+        with self.assertLogs('main_app.slow_requests', 'WARNING') as logs:
+            self.client.get('/reviews/')
+        self.assertIn('main_app_review', logs.output[0])
+
+
+class SyntheticDataTests(APITestCase):
+    def test_seed_and_benchmark_every_route(self):
+        call_command('seed_synthetic', reviews=500, stdout=StringIO())
+        self.assertEqual(Review.objects.count(), 500)
+        call_command('rebuild_game_stats', verify=True, stdout=StringIO()) # raises if the stats don't add up
+
+        out = StringIO()
+        with tempfile.TemporaryDirectory() as directory: # fails on an uncovered route or a request that errors
+            call_command('bench_endpoints', iterations=1, baseline=os.path.join(directory, 'baseline.json'), stdout=out)
+        self.assertIn('GET /games/{game}/', out.getvalue())
+
+
+class FastSerializerTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sofia', password='pw')
+        self.client.force_authenticate(self.user)
+        self.game = make_game(self.user, name='Pokémon \u2028 "Red" \\ 日本')
+        self.game.release_date = datetime(2018, 1, 25, 13, 5, 7, 123456, tzinfo=timezone.utc)
+        self.game.save()
+        make_reviews(self.game, 7) # an average that needs rounding
+        make_game(self.user, name='never reviewed')
+        GameStats.objects.filter(game=make_game(self.user, name='no stats row')).delete()
+
+    def assert_same_bytes(self, fast, slow):
+        self.assertEqual(fast, slow)
+        self.assertEqual(FastJSONRenderer().render(fast), JSONRenderer().render(slow))
+
+    def test_games(self):
+        games = Game.objects.select_related('stats').order_by('id')
+        self.assert_same_bytes(serialize_games(game_rows(games)), GameSerializer(games, many=True).data)
+
+    def test_reviews(self):
+        reviews = Review.objects.select_related('user').order_by('id')
+        self.assert_same_bytes(serialize_reviews(review_rows(reviews)), ReviewSerializer(reviews, many=True).data)
+        self.assert_same_bytes(serialize_reviews_with_reviewer(review_rows(reviews, reviewer=True)),
+                               ReviewWithReviewerSerializer(reviews, many=True).data)
+
+    def test_renderer_falls_back_to_drf_encoder(self):
+        data = {'when': datetime(2020, 5, 1, 8, tzinfo=timezone.utc), 'day': date(2020, 5, 1), 'price': Decimal('1.50'),
+                'message': gettext_lazy('Not found.'), 1: 'int key', 'nested': [{'score': 4.25}]}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render({'big': 2 ** 70}), b'{"big":1180591620717411303424}') # json.dumps' turn
+        self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=4'),
+                         JSONRenderer().render(data, 'application/json; indent=4'))
+
+    def test_endpoints_page_like_before(self):
+        response = self.client.get('/games/', {'page_size': 2})
+        self.assertEqual(response.json()['results'], GameSerializer(Game.objects.select_related('stats').order_by('id')[:2], many=True).data)
+        second = self.client.get(response.json()['next']).json()
+        self.assertEqual([game['name'] for game in second['results']], ['no stats row'])
+        self.assertIsNone(second['results'][0]['stats'])
+
+        response = self.client.get(f'/games/{self.game.id}/')
+        reviews = self.game.reviews.select_related('user').order_by('-date_submitted', '-id')
+        self.assertEqual(response.content, JSONRenderer().render({
+            'game': GameSerializer(Game.objects.select_related('stats').get(pk=self.game.id)).data,
+            'reviews': ReviewWithReviewerSerializer(reviews, many=True).data,
+        }))
+
+
+class RankingTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sofia', password='pw')
+        self.client.force_authenticate(self.user)
+        self.today = date(2023, 11, 30)
+        self.one_hit = self.game_with_scores('one perfect review', [5], genres=['Indie'])
+        self.steady = self.game_with_scores('lots of good reviews', [5, 4] * 20, genres=['RPG'])
+        self.mediocre = self.game_with_scores('lots of bad reviews', [2, 3] * 20, genres=['RPG', 'Indie'])
+
+    def game_with_scores(self, name, scores, genres, days_ago=30):
+        game = make_game(self.user, name=name)
+        game.genres = genres
+        game.save()
+        reviewers = User.objects.bulk_create(User(username=f'{name}-{n}') for n in range(len(scores)))
+        for reviewer, score in zip(reviewers, scores):
+            Review.objects.create(game=game, user=reviewer, score=score, review='ok',
+                                  date_submitted=self.today - timedelta(days=days_ago))
+        run_jobs()
+        return game
+
+    def names(self, path):
+        return [game['name'] for game in self.client.get(path).json()['results']]
+
+    def test_top_is_bayesian(self):
+        refresh_rankings(today=self.today)
+        self.assertEqual(self.names('/games/top/'), ['lots of good reviews', 'one perfect review', 'lots of bad reviews'])
+        self.assertEqual(self.names('/games/top/?genre=Indie'), ['one perfect review', 'lots of bad reviews'])
+
+    def test_trending_favours_recent_reviews(self):
+        self.game_with_scores('this week', [4] * 5, genres=['Indie'], days_ago=1)
+        refresh_rankings(today=self.today)
+        self.assertEqual(self.names('/games/trending/'), ['this week']) # the rest were reviewed a month ago
+        self.game_with_scores('this week too', [4] * 8, genres=['Indie'], days_ago=2)
+        refresh_rankings([GameRanking.TRENDING], today=self.today)
+        self.assertEqual(self.names('/games/trending/?genre=Indie'), ['this week too', 'this week'])
+
+    def test_pages_in_constant_queries(self):
+        for n in range(5):
+            self.game_with_scores(f'filler {n}', [3] * (n + 1), genres=['RPG'])
+        refresh_rankings(today=self.today)
+        with self.assertNumQueries(2): # a page of rankings, its games + stats
+            response = self.client.get('/games/top/', {'page_size': 3}).json()
+        seen = [game['rank'] for game in response['results']]
+        while response['next']:
+            response = self.client.get(response['next']).json()
+            seen += [game['rank'] for game in response['results']]
+        self.assertEqual(seen, list(range(1, 9)))
+
+
+class SimilarGamesTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sofia', password='pw')
+        self.client.force_authenticate(self.user)
+        self.fans = User.objects.bulk_create(User(username=f'fan {n}') for n in range(3))
+        self.rpg = self.game('rpg', ['RPG', 'Indie'])
+        self.other_rpg = self.game('other rpg', ['RPG', 'Indie'])
+        self.shooter = self.game('shooter', ['Shooter'])
+        self.other_shooter = self.game('other shooter', ['Shooter'])
+
+    def game(self, name, genres):
+        game = make_game(self.user, name=name)
+        game.genres = genres
+        game.save()
+        return game
+
+    def review(self, game, score):
+        for fan in self.fans:
+            Review.objects.create(game=game, user=fan, score=score, review='ok', date_submitted=date(2023, 11, 20))
+
+    def similar(self, game):
+        return [(row['name'], row['similarity']) for row in self.client.get(f'/games/{game.id}/similar/').json()]
+
+    def test_genres_and_reviewers_in_common(self):
+        self.review(self.rpg, 5)
+        self.review(self.shooter, 5) # the same people loved both
+        self.review(self.other_shooter, 1) # and hated this one
+        build_similar_games()
+        # reviews are 1 - GENRE_WEIGHT of it, genres the rest. nothing in common isn't listed at all
+        self.assertEqual(self.similar(self.rpg), [('shooter', 0.7), ('other rpg', 0.3)])
+        self.assertEqual(self.similar(self.other_shooter), []) # the genre is outweighed by the reviewers
+        with self.assertNumQueries(2): # its SimilarGames row, the neighbours + their stats
+            self.client.get(f'/games/{self.rpg.id}/similar/')
+        self.assertEqual(self.client.get('/games/0/similar/').status_code, 404)
+
+    def test_review_writes_redo_their_games(self):
+        build_similar_games()
+        self.assertEqual(self.similar(self.other_rpg), [('rpg', 0.3)])
+        self.review(self.rpg, 4)
+        self.review(self.other_rpg, 4)
+        Job.objects.update(run_at=datetime.now(timezone.utc)) # due now, not in ten minutes
+        with CaptureQueriesContext(connection) as queries:
+            run_jobs()
+        # the job's deletes commit with the rows, both as durably as any other write. checked before the next
+        # request, which clears the query log
+        self.assertFalse([query['sql'] for query in queries if 'synchronous_commit' in query['sql']])
+        self.assertEqual(self.similar(self.other_rpg), [('rpg', 1.0)])
+
+    def test_a_job_without_a_game_does_every_game(self): # what migration 0012 queues
+        Job.objects.all().delete()
+        enqueue(('similar-games', None))
+        Job.objects.update(run_at=datetime.now(timezone.utc))
+        self.assertEqual(run_jobs(), {'done': 1})
+        self.assertEqual(SimilarGames.objects.count(), 4)
+
+    def test_chunks_match_one_big_matrix(self):
+        rng = np.random.default_rng(42)
+        genres = normalized_rows(rng.integers(0, 2, (50, 6)).astype(np.float32))
+        reviews = normalized_rows(sparse.random(50, 30, density=0.2, format='csr', dtype=np.float32, random_state=42))
+        expected = 0.3 * genres @ genres.T + 0.7 * (reviews @ reviews.T).toarray()
+        np.fill_diagonal(expected, -np.inf)
+        for chunk_size in (1, 7, 50):
+            for rows, best, scores in nearest(genres, reviews, np.arange(50), top_k=5, chunk_size=chunk_size):
+                top = -np.sort(-expected[rows], axis=1)[:, :5]
+                kept = ~np.isnan(scores)
+                np.testing.assert_array_equal(kept, top > 0)
+                np.testing.assert_allclose(scores[kept], top[kept], rtol=1e-5) # the best five, best first
+                np.testing.assert_allclose(np.take_along_axis(expected[rows], best, axis=1)[kept], scores[kept], rtol=1e-5)
+
+
+class UserStatsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sofia', password='pw')
+        self.client.force_authenticate(self.user)
+        self.author = User.objects.create_user('author')
+        self.rpg = make_game(self.author, name='rpg')
+        self.rpg.genres = ['RPG', 'Indie']
+        self.rpg.save()
+        self.platformer = make_game(self.author) # Platformer, Indie
+
+    def review(self, game, score):
+        response = self.client.post('/reviews/', {'score': score, 'review': 'ok', 'date_submitted': '2023-11-20',
+                                                  'user': self.user.id, 'game': game.id})
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def stats(self, user):
+        return self.client.get(f'/users/{user.id}/').data['stats']
+
+    def test_writes_update_the_profile(self):
+        self.review(self.rpg, 5)
+        self.review(self.platformer, 4)
+        worst = self.review(self.platformer, 1)
+        self.assertIsNotNone(UserStats.objects.get(user=self.user).last_active_at) # straight away, the rest is a job
+        self.assertEqual(self.stats(self.user)['review_count'], 0)
+        run_jobs()
+        stats = self.stats(self.user)
+        self.assertEqual((stats['review_count'], stats['average_score'], stats['games_added']), (3, 3.33, 0))
+        self.assertEqual(stats['histogram'], {'1': 1, '2': 0, '3': 0, '4': 1, '5': 1})
+        self.assertEqual(stats['favourite_genres'], ['Indie', 'Platformer', 'RPG']) # liked twice, then once each
+
+        self.client.delete(f'/reviews/{worst}/')
+        run_jobs()
+        self.assertEqual(self.stats(self.user)['average_score'], 4.5)
+        self.assertEqual(self.stats(self.author)['games_added'], 2)
+        self.platformer.delete()
+        run_jobs()
+        self.assertEqual(self.stats(self.author)['games_added'], 1)
+        self.assertEqual(self.stats(self.user)['favourite_genres'], ['Indie', 'RPG'])
+
+    def test_new_user(self):
+        newcomer = User.objects.create_user('newcomer')
+        self.assertFalse(UserStats.objects.filter(user=newcomer).exists())
+        self.assertEqual(self.stats(newcomer), {'review_count': 0, 'average_score': None, 'histogram': {'1': 0, '2': 0, '3': 0, '4': 0, '5': 0},
+                                                'games_added': 0, 'favourite_genres': [], 'last_active_at': None})
+
+    def test_rebuild_matches_the_jobs(self):
+        self.review(self.rpg, 2)
+        run_jobs()
+        counted = UserStats.objects.order_by('user_id').values()
+        before = list(counted)
+        UserStats.objects.all().delete()
+        self.assertEqual(self.stats(self.user)['review_count'], 0) # not counted yet
+        call_command('rebuild_user_stats', stdout=StringIO())
+        self.assertEqual(list(counted), before)
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sofia', password='pw')
+        self.client.force_authenticate(self.user)
+        self.game = make_game(self.user)
+        make_reviews(self.game, 3)
+        run_jobs() # the stats
+
+    def add_reviews(self, count): # bulk, the stats don't matter here
+        Review.objects.bulk_create(Review(game=self.game, user=self.user, score=4, review='x' * 200,
+                                          date_submitted=date(2023, 1, 1)) for _ in range(count))
+
+    def export_peak(self, chunk_size):
+        tracemalloc.start()
+        try:
+            size = sum(len(chunk) for chunk in stream_export('reviews', 'ndjson', chunk_size=chunk_size))
+            return size, tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_memory_stays_flat(self):
+        self.add_reviews(500)
+        small_size, small_peak = self.export_peak(chunk_size=100)
+        self.add_reviews(4500)
+        large_size, large_peak = self.export_peak(chunk_size=100)
+        self.assertGreater(large_size, small_size * 9)
+        self.assertLess(large_peak, small_peak * 1.5) # ten times the rows, about the same memory
+
+    def test_formats_filters_and_resuming(self):
+        response = self.client.get('/export/reviews.ndjson', {'game': self.game.id, 'since': '2023-11-02'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['date_submitted'] for row in rows], ['2023-11-02', '2023-11-03'])
+        self.assertEqual(set(rows[0]), {'id', 'score', 'review', 'date_submitted', 'user', 'game'})
+
+        response = self.client.get('/export/reviews.csv', {'after': rows[0]['id']})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines, ['id,score,review,date_submitted,user,game', f"{rows[1]['id']},3,good,2023-11-03,{rows[1]['user']},{self.game.id}"])
+
+        games = b''.join(self.client.get('/export/games.csv').streaming_content).decode().splitlines()
+        self.assertEqual(games[1], f'{self.game.id},Celeste,Platformer|Indie,climb the mountain,2018-01-25T00:00:00Z,'
+                                   f'https://example.com/celeste.png,{self.user.id}')
+        stats = json.loads(b''.join(self.client.get('/export/game-stats.ndjson').streaming_content))
+        self.assertEqual((stats['review_count'], stats['average_score'], stats['last_review_date']), (3, 2.0, '2023-11-03'))
+
+    def test_rejects_unknown_exports(self):
+        self.assertEqual(self.client.get('/export/users.csv').status_code, 404)
+        self.assertEqual(self.client.get('/export/reviews.xml').status_code, 404)
+        self.assertEqual(self.client.get('/export/reviews.csv', {'since': 'yesterday'}).status_code, 400)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export_data', 'reviews', format='csv', game=self.game.id, stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 4)
+
+
+@override_settings(DATABASE_REPLICAS=['replica-test'], READ_YOUR_WRITES_SECONDS=60)
+class RoutingTests(APITestCase):
+    databases = {'default', 'replica-test'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('sofia', password='pw')
+        self.game = make_game(self.user)
+        self.client.force_authenticate(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer sofia') # what the pin is keyed on
+
+    def queries(self, alias):
+        return REGISTRY.get_sample_value('db_queries_total', {'database': alias}) or 0
+
+    def test_reads_go_to_the_replica(self):
+        before = self.queries('replica-test')
+        response = self.client.get(f'/games/{self.game.id}/')
+        self.assertEqual(response.status_code, 404) # the replica hasn't caught up with setUp
+        self.assertGreater(self.queries('replica-test'), before)
+        self.assertEqual(Game.objects.db, 'default') # outside a request
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        response = self.client.patch(f'/games/{self.game.id}/', {'description': 'new'})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(f'/games/{self.game.id}/')
+        self.assertEqual(response.json()['game']['description'], 'new')
+
+        other = self.client_class()
+        other.force_authenticate(self.user)
+        other.credentials(HTTP_AUTHORIZATION='Bearer someone else') # not pinned, reads the replica
+        self.assertEqual(other.get(f'/games/{self.game.id}/').status_code, 404)
+
+        cache.clear() # the window is over
+        self.assertEqual(self.client.get(f'/games/{self.game.id}/').status_code, 404)
+
+    def test_failed_writes_dont_pin(self):
+        self.assertEqual(self.client.post('/games/', {'name': ''}).status_code, 400)
+        self.assertEqual(self.client.get(f'/games/{self.game.id}/').status_code, 404)
+
+    def test_exports_stream_from_the_replica(self):
+        response = self.client.get('/export/games.ndjson')
+        self.assertEqual(b''.join(response.streaming_content), b'')
+
+
+class AutocompleteTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sofia', password='pw')
+        self.client.force_authenticate(self.user)
+        for name in ['The Witcher 3: Wild Hunt', 'The Witness', 'Pokémon Yellow', 'Celeste', 'Witchfire']:
+            make_game(self.user, name=name)
+        game_names.clear()
+        game_names.load()
+
+    def tearDown(self):
+        game_names.clear()
+
+    def autocomplete(self, q, **params):
+        response = self.client.get('/games/autocomplete/', {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(game['name'], game['match']) for game in response.json()]
+
+    def test_prefixes_come_from_memory(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.autocomplete('the WIT', limit=2), [('The Witcher 3: Wild Hunt', 'prefix'), ('The Witness', 'prefix')])
+        self.assertEqual(self.autocomplete('poke'), [('Pokémon Yellow', 'prefix')]) # normalized like import keys
+        self.assertEqual(self.autocomplete('the witcher 3 wild')[0], ('The Witcher 3: Wild Hunt', 'prefix'))
+
+    def test_fuzzy_matches_fill_up_the_rest(self):
+        self.assertEqual(self.autocomplete('celest'), [('Celeste', 'prefix')])
+        self.assertIn(('The Witcher 3: Wild Hunt', 'fuzzy'), self.autocomplete('witcher'))
+        self.assertIn(('The Witcher 3: Wild Hunt', 'fuzzy'), self.autocomplete('witchr')) # typo
+        self.assertEqual(self.autocomplete('yelow'), [('Pokémon Yellow', 'fuzzy')])
+        self.assertEqual(self.client.get('/games/autocomplete/').status_code, 400)
+
+    def test_changes_reach_every_worker(self):
+        other_worker = GameNameIndex(sync_seconds=0)
+        other_worker.load()
+        game = Game.objects.get(name='Celeste')
+        with self.captureOnCommitCallbacks(execute=True):
+            game.name = 'Celeste Classic'
+            game.save()
+            make_game(self.user, name='Celestial Drift')
+        self.assertEqual([name for _, name in game_names.lookup('celest')], ['Celeste Classic', 'Celestial Drift'])
+        self.assertEqual([name for _, name in other_worker.lookup('celest')], ['Celeste Classic', 'Celestial Drift'])
+
+        game_id = game.id
+        with self.captureOnCommitCallbacks(execute=True):
+            game.delete()
+        self.assertEqual([name for _, name in game_names.lookup('celest')], ['Celestial Drift'])
+        self.assertEqual([name for _, name in other_worker.lookup('celest')], ['Celestial Drift'])
+        self.assertEqual(GameNameChange.objects.filter(game_id=game_id).count(), 3) # created, renamed, deleted
+
+    def test_duplicates_are_refused_on_create(self):
+        game = {'name': 'the witcher 3 - WILD HUNT', 'genres': ['RPG'], 'description': 'again',
+                'release_date': '2015-05-19T00:00:00Z', 'image_url': 'https://example.com/w3.png', 'user': self.user.id}
+        for path in ('/new-game/', '/games/'):
+            response = self.client.post(path, game, format='json')
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual([duplicate['name'] for duplicate in response.json()['duplicates']], ['The Witcher 3: Wild Hunt'])
+        self.assertEqual(self.client.post('/games/', {**game, 'allow_duplicate': True}, format='json').status_code, 201)
+        self.assertEqual(self.client.post('/games/', {**game, 'name': 'The Witcher 4'}, format='json').status_code, 201)
+
+
+class JobQueueTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sofia', password='pw')
+        self.client.force_authenticate(self.user)
+        self.game = make_game(self.user)
+        Job.objects.all().delete() # the new game's similar-games and user-stats jobs
+        self.calls = []
+        job('test-flaky')(self.flaky)
+        self.addCleanup(handlers.pop, 'test-flaky')
+
+    def flaky(self, game_id): # fails twice, then works
+        self.calls.append(game_id)
+        if len(self.calls) < 3:
+            raise ValueError('not yet')
+
+    def make_due(self):
+        Job.objects.filter(state=Job.PENDING).update(run_at=datetime.now(timezone.utc))
+
+    def test_review_writes_enqueue_and_coalesce(self):
+        for score in (5, 1):
+            response = self.client.post('/reviews/', {'score': score, 'review': 'ok', 'date_submitted': '2023-11-20',
+                                                      'user': self.user.id, 'game': self.game.id})
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(sorted(Job.objects.values_list('kind', 'target_id'), key=str), [
+            ('game-stats', self.game.id), ('rankings', None), ('similar-games', self.game.id), ('user-stats', self.user.id),
+        ])
+        self.assertEqual(GameStats.objects.get(game=self.game).review_count, 0)
+
+        self.make_due()
+        self.assertEqual(run_jobs(), {'done': 4})
+        stats = GameStats.objects.get(game=self.game)
+        self.assertEqual((stats.review_count, stats.average_score), (2, 3.0))
+        self.assertFalse(Job.objects.exists())
+
+    def test_retries_with_backoff(self):
+        enqueue(('test-flaky', self.game.id))
+        with self.assertLogs('main_app.jobs', 'ERROR'):
+            self.assertEqual(run_jobs(), {'retried': 1})
+        retry = Job.objects.get()
+        self.assertEqual((retry.state, retry.attempts), (Job.PENDING, 1))
+        self.assertGreater(retry.run_at, datetime.now(timezone.utc)) # not again straight away
+        self.assertIn('ValueError: not yet', retry.last_error)
+
+        self.make_due()
+        with self.assertLogs('main_app.jobs', 'ERROR'):
+            run_jobs()
+        self.assertGreater(Job.objects.get().run_at - datetime.now(timezone.utc), BACKOFF) # twice the first wait
+        self.make_due()
+        self.assertEqual(run_jobs(), {'done': 1})
+        self.assertEqual(self.calls, [self.game.id] * 3)
+
+    def test_gives_up_after_max_attempts(self):
+        enqueue(('test-flaky', None))
+        Job.objects.update(attempts=MAX_ATTEMPTS - 1)
+        with self.assertLogs('main_app.jobs', 'ERROR'):
+            self.assertEqual(run_jobs(), {'failed': 1})
+        self.assertEqual(Job.objects.get().state, Job.FAILED)
+        enqueue(('test-flaky', None)) # a failed job doesn't hold up new ones
+        self.assertEqual(Job.objects.filter(state=Job.PENDING).count(), 1)
+
+    def test_a_retry_coalesces_into_a_newer_job(self):
+        enqueue(('test-flaky', self.game.id))
+        running = claim(10)
+        enqueue(('test-flaky', self.game.id)) # a write while the first one runs
+        self.assertEqual(Job.objects.count(), 2)
+        with self.assertLogs('main_app.jobs', 'ERROR'):
+            self.assertEqual(run_job(running[0]), 'retried')
+        self.assertEqual(Job.objects.get().attempts, 0) # the new one, it covers the failed one
+
+    def test_release_and_run_worker_once(self):
+        enqueue(('game-stats', self.game.id))
+        release(claim(10)) # a worker stopping before it got to it
+        self.assertEqual(Job.objects.values_list('state', 'attempts').get(), (Job.PENDING, 0))
+        out = StringIO()
+        call_command('run_worker', once=True, stdout=out)
+        self.assertEqual(out.getvalue().strip(), '1 done')
+        self.assertFalse(Job.objects.exists())
+
+    def test_a_batch_takes_its_backlog_along(self):
+        batches = []
+        job('test-batch', delay=timedelta(minutes=10), batch_size=10)(batches.append)
+        self.addCleanup(handlers.pop, 'test-batch')
+        enqueue(*(('test-batch', game_id) for game_id in (1, 2, 3)))
+        Job.objects.filter(target_id=1).update(run_at=datetime.now(timezone.utc)) # only one of them is due
+        self.assertEqual(run_jobs(), {'done': 3})
+        self.assertEqual([sorted(game_ids) for game_ids in batches], [[1, 2, 3]])
+
+    def test_queue_depth_metrics(self):
+        enqueue(('game-stats', self.game.id), ('rankings', None))
+        depth = {(kind, state): count for kind, state, count, _ in queue_depth()}
+        self.assertEqual(depth, {('game-stats', 'due'): 1, ('rankings', 'waiting'): 1})
+        self.assertEqual(REGISTRY.get_sample_value('job_queue_depth', {'kind': 'game-stats', 'state': 'due'}), 1)
+        done = REGISTRY.get_sample_value('jobs_total', {'kind': 'game-stats', 'outcome': 'done'}) or 0
+        run_jobs()
+        self.assertEqual(REGISTRY.get_sample_value('jobs_total', {'kind': 'game-stats', 'outcome': 'done'}), done + 1)
+
+
+class JobWorkerTests(TransactionTestCase): # real commits, so several workers see the same jobs
+    def test_workers_never_share_a_job(self):
+        user = User.objects.create_user('sofia')
+        games = [make_game(user, name=f'game {n}') for n in range(40)]
+        Job.objects.all().delete() # the games' own jobs
+        enqueue(*(('game-stats', game.id) for game in games))
+        claimed = []
+
+        def worker():
+            try:
+                while jobs := claim(3):
+                    claimed.extend(job.target_id for job in jobs)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(claimed), sorted(game.id for game in games))
@@ -1,19 +1,42 @@
 from django.contrib.auth.models import User, Group
 from django.contrib.auth import authenticate, login
-from django.http import JsonResponse
-from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.middleware.csrf import get_token
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db import transaction
+from django.db.models import F
+from datetime import datetime, time, timezone as dt_timezone
+import os
 
-from rest_framework import viewsets, permissions, status
+from rest_framework import generics, viewsets, permissions, status
 from rest_framework.views import APIView
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.generics import RetrieveAPIView
 from rest_framework.response import Response
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.tokens import RefreshToken, UntypedToken
+from rest_framework_simplejwt.views import TokenRefreshView
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
 from rest_framework.authentication import TokenAuthentication
 
-from .models import Game, Review
-from .serializers import UserSerializer, GroupSerializer, GameSerializer, ReviewSerializer
+from .autocomplete import autocomplete, find_duplicates
+from .db_pool.pool import get_all_stats
+from .exports import EXPORTS, FORMATS, async_chunks, stream_export
+from .fast_serializers import game_rows, review_rows, serialize_games, serialize_reviews, serialize_reviews_with_reviewer
+from .filters import filter_games, filter_reviews
+from .models import Game, GameRanking, GenreFacet, Review, SimilarGames
+from .response_cache import versioned_response
+from .revocation import revoked_tokens, token_expiry
+from .pagination import GamePagination, KeysetPagination, RankingPagination, ReviewPagination, SearchPagination, UserPagination
+from .serializers import UserSerializer, GroupSerializer, GameSerializer, GenreFacetSerializer, ReviewSerializer
+from .serializers import RevocableTokenRefreshSerializer
+from .serializers import GameSearchResultSerializer, ReviewSearchResultSerializer, SearchParamsSerializer, ReviewBatchItemSerializer
+from .serializers import AutocompleteParamsSerializer, ExportParamsSerializer, user_stats_data
+from .signals import reviews_bulk_created
 
 
 # just grabbing information
@@ -21,16 +44,42 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = User.objects.all().order_by('-date_joined')
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated] # if not authenticated we can't consume API
-    def retrieve(self, request, *args, **kwargs): #override the built in one
-        instance = self.get_object() #fetches the specific user object based on request
-        user_serializer = self.get_serializer(instance)#grabs the serializer for this user
-        games_serializer = GameSerializer(instance.game_set.all(), many=True)#creates a specific serializer for all games connected to this user
-        reviews_serializer = ReviewSerializer(instance.reviews.all(), many=True)
+    pagination_class = UserPagination
+    max_batch_ids = 100
 
+    def list(self, request, *args, **kwargs): # ?ids=1,2,3 looks up a handful of users in one query, no paging
+        ids = request.query_params.get('ids')
+        if ids is None:
+            return super().list(request, *args, **kwargs)
+        try:
+            ids = {int(user_id) for user_id in ids.split(',') if user_id}
+        except ValueError:
+            raise ValidationError({'ids': 'must be a comma separated list of user ids'})
+        if len(ids) > self.max_batch_ids:
+            raise ValidationError({'ids': f'at most {self.max_batch_ids} ids at a time'})
+        serializer = self.get_serializer(self.get_queryset().filter(id__in=ids), many=True)
+        return Response(serializer.data)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'retrieve':
+            queryset = queryset.select_related('stats') # the profile's numbers, same query
+        return queryset
+
+    @versioned_response('user')
+    def retrieve(self, request, *args, **kwargs): # the user, their stats and the first page of their games and reviews
+        instance = self.get_object()
+        # the rest of each list is on /games/?user= and /reviews/?user=, *_next is where the page carries on
+        games, reviews = GamePagination(), ReviewPagination()
+        game_page = games.first_page(game_rows(instance.game_set.all()), request, f"{reverse('game-list')}?user={instance.id}", '-id')
+        review_page = reviews.first_page(review_rows(instance.reviews.all()), request, f"{reverse('review-list')}?user={instance.id}")
         response_data = {
-            'user': user_serializer.data,
-            'games': games_serializer.data,
-            'reviews': reviews_serializer.data
+            'user': self.get_serializer(instance).data,
+            'stats': user_stats_data(instance),
+            'games': serialize_games(game_page),
+            'games_next': games.get_next_link(),
+            'reviews': serialize_reviews(review_page),
+            'reviews_next': reviews.get_next_link(),
         }
         return Response(response_data, status=status.HTTP_200_OK)
 
@@ -39,33 +88,143 @@ class GroupViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Group.objects.all()
     serializer_class = GroupSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
 class GameViewSet(viewsets.ModelViewSet):
-    queryset = Game.objects.all()
+    queryset = Game.objects.select_related('stats') # stats come along in the same query
     serializer_class = GameSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = GamePagination
+
+    def get_queryset(self): # ?genres=RPG,Indie and ?user=<id>, see filters.py
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = filter_games(queryset, self.request.query_params)
+        return queryset
+
+    def list(self, request, *args, **kwargs): # same JSON as GameSerializer, built straight from .values() rows
+        page = self.paginate_queryset(game_rows(self.filter_queryset(self.get_queryset())))
+        return self.get_paginated_response(serialize_games(page))
+
+    def create(self, request, *args, **kwargs): # ModelViewSet's, plus the duplicate check
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        conflict = duplicate_game_response(request, serializer.validated_data['name'])
+        if conflict:
+            return conflict
+        self.perform_create(serializer)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(serializer.data))
+
+    @action(detail=False, pagination_class=None)
+    def autocomplete(self, request): # ?q=zel -> up to ?limit= names, from this worker's index (autocomplete.py)
+        params = AutocompleteParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return Response(autocomplete(params.validated_data['q'], params.validated_data['limit']))
+
+    @action(detail=False, pagination_class=RankingPagination)
+    def top(self, request): # bayesian average, see rankings.py
+        return self.ranking(request, GameRanking.TOP)
+
+    @action(detail=False, pagination_class=RankingPagination)
+    def trending(self, request): # most and best reviewed lately
+        return self.ranking(request, GameRanking.TRENDING)
+
+    def ranking(self, request, kind): # ?genre=RPG for that genre's leaderboard. two queries, however deep the page
+        rankings = GameRanking.objects.filter(kind=kind, genre=request.query_params.get('genre', ''))
+        page = self.paginate_queryset(rankings.values('rank', 'score', 'game_id'))
+        games = serialize_games(game_rows(Game.objects.filter(id__in=[row['game_id'] for row in page])))
+        games = {game['id']: game for game in games}
+        return self.get_paginated_response([
+            {**games[row['game_id']], 'rank': row['rank'], 'ranking_score': row['score']}
+            for row in page if row['game_id'] in games # deleted since the page was read
+        ])
 
+    @action(detail=True, pagination_class=None)
+    def similar(self, request, pk=None): # "if you liked this", precomputed by similar.py. best first, with their similarity
+        try:
+            similar_ids, scores = generics.get_object_or_404(SimilarGames.objects.values_list('similar_ids', 'scores'), game_id=pk)
+        except Http404:
+            self.get_object() # 404s unless it's a game that hasn't been scored yet
+            return Response([])
+        games = {game['id']: game for game in serialize_games(game_rows(Game.objects.filter(id__in=similar_ids)))}
+        return Response([
+            {**games[game_id], 'similarity': round(score, 4)}
+            for game_id, score in zip(similar_ids, scores) if game_id in games # deleted since it was scored
+        ])
+
+    @versioned_response('game')
     def retrieve(self, request, *args, **kwargs): #same thing as above but just for a single game, grabs all data from that game + game specific reviews
         instance = self.get_object()
         game_serializer = self.get_serializer(instance)
-        reviews_serializer = ReviewSerializer(instance.reviews.all(), many=True)
+        reviews = review_rows(instance.reviews.order_by('-date_submitted', '-id'), reviewer=True) # reviewer names in the same query
 
         response_data = {
             'game': game_serializer.data,
-            'reviews': reviews_serializer.data
+            'reviews': serialize_reviews_with_reviewer(reviews)
         }
         return Response(response_data, status=status.HTTP_200_OK)
 
+class GenreFacetViewSet(viewsets.ReadOnlyModelViewSet): # genre -> number of games and average score, kept up to date by signals.py
+    queryset = GenreFacet.objects.filter(game_count__gt=0).order_by('-game_count', 'genre')
+    serializer_class = GenreFacetSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = None # one row per genre, there aren't many
+
 class ReviewViewSet(viewsets.ModelViewSet):
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ReviewPagination
+
+    def get_queryset(self): # ?game=<id> and ?user=<id>, see filters.py
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = filter_reviews(queryset, self.request.query_params)
+        return queryset
+
+    def list(self, request, *args, **kwargs): # same JSON as ReviewSerializer, without the serializer
+        page = self.paginate_queryset(review_rows(self.filter_queryset(self.get_queryset())))
+        return self.get_paginated_response(serialize_reviews(page))
+
+    max_batch_size = 500
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request): # POST a list of reviews, all saved or none. errors come back in the same order as the list
+        items = request.data
+        if not isinstance(items, list) or not items:
+            raise ValidationError({'non_field_errors': ['Expected a non-empty list of reviews.']})
+        if len(items) > self.max_batch_size:
+            raise ValidationError({'non_field_errors': [f'At most {self.max_batch_size} reviews per batch.']})
+
+        validator = ReviewBatchItemSerializer() # reused for every item
+        rows, errors = [], []
+        for item in items:
+            try:
+                rows.append({**validator.run_validation(item), 'user_id': request.user.id}) # like CreateReviewAPIView, never the body's
+                errors.append({})
+            except ValidationError as error:
+                rows.append(None)
+                errors.append(error.detail)
+
+        valid = [row for row in rows if row is not None]
+        known_games = set(Game.objects.filter(id__in={row['game_id'] for row in valid}).values_list('id', flat=True))
+        for row, item_errors in zip(rows, errors):
+            if row is None:
+                continue
+            if row['game_id'] not in known_games:
+                item_errors['game'] = [f'Invalid pk "{row["game_id"]}" - object does not exist.']
+        if any(errors):
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            reviews = Review.objects.bulk_create([Review(**row) for row in rows])
+            reviews_bulk_created(reviews) # stats and caches once per game, not per review
+        return Response(ReviewSerializer(reviews, many=True).data, status=status.HTTP_201_CREATED)
 
 
 
 class UserForReviewView(RetrieveAPIView): #used to fetch user details for a specific review, from their id. get requests only
      def get(self, request, user_id): #customize the get request
-        print(f"Received user ID from URL path: {user_id}")
         user = get_object_or_404(User, pk=user_id) #django magic shortcut
         serialized_user = UserSerializer(user, context={'request': request}) #it required the context but it's magic, no obvious reason why it would need more than the id
         return Response(serialized_user.data)
@@ -105,18 +264,41 @@ class LoginAndTokenView(APIView):
             return JsonResponse({'message': 'Invalid credentials'}, status=401)
 
 
+class RefreshTokenView(TokenRefreshView): # refresh token in, new access token out
+    serializer_class = RevocableTokenRefreshSerializer
+
+
 class LogoutView(APIView):
-    def post(self, request):
-        token = request.data.get('token')
-        cache.set(token, 'logged_out', timeout=None) #kind of blacklisting? lives there forever now
+    def post(self, request): # revokes whichever of token / refresh / access it's sent, until they would expire anyway
+        for field in ('token', 'refresh', 'access'):
+            raw_token = request.data.get(field)
+            if not raw_token:
+                continue
+            try:
+                token = UntypedToken(raw_token)
+            except TokenError: # expired or not ours, nothing to revoke
+                continue
+            revoked_tokens.revoke(token[jwt_settings.JTI_CLAIM], token_expiry(token))
         return JsonResponse({'message': 'logged out successfully'})
 
 #GAME
+def duplicate_game_response(request, name): # a 409 listing the games a new one looks like, unless it says "allow_duplicate": true
+    if request.data.get('allow_duplicate') in (True, 'true', '1'):
+        return None
+    duplicates = find_duplicates(name)
+    if not duplicates:
+        return None
+    return Response({'detail': 'A game with this name already exists. Send "allow_duplicate": true to add it anyway.',
+                     'duplicates': duplicates}, status=status.HTTP_409_CONFLICT)
+
 class CreateGameAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated] #passed superuser credent
     def post(self, request):
         serializer = GameSerializer(data=request.data)
         if serializer.is_valid():
+            conflict = duplicate_game_response(request, serializer.validated_data['name'])
+            if conflict:
+                return conflict
             game = serializer.save() #saves in db 
             return Response({'message':'game created ok', 'user_data':serializer.data}, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -124,7 +306,7 @@ class CreateGameAPIView(APIView):
 class EditGameAPIView(APIView):
     def put(self, request, game_id):
         try:
-            game = Game.objects.get(pk=game_id)
+            game = Game.objects.select_related('stats').get(pk=game_id)
         except (Game.DoesNotExist):
             return Response({"error": "Game not found"}, status=status.HTTP_404_NOT_FOUND)
         
@@ -174,6 +356,89 @@ class ReviewAPIView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+# SEARCH
+SEARCH_CONFIG = 'english' # has to match the to_tsvector() calls in the triggers (migration 0005)
+
+class SearchView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = SearchPagination
+    highlight = {'start_sel': '<mark>', 'stop_sel': '</mark>', 'config': SEARCH_CONFIG}
+
+    def get(self, request):
+        params = SearchParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        params = params.validated_data
+        query = SearchQuery(params['q'], search_type='websearch', config=SEARCH_CONFIG)
+
+        if params['type'] == 'games':
+            results = self.search_games(query, params)
+            serializer_class = GameSearchResultSerializer
+        else:
+            results = self.search_reviews(query, params)
+            serializer_class = ReviewSearchResultSerializer
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(results, request, view=self)
+        return paginator.get_paginated_response(serializer_class(page, many=True).data)
+
+    # every filter is one an index can answer: @@ and @> on the GIN indexes, ranges on btrees
+    def search_games(self, query, params):
+        games = Game.objects.select_related('stats').filter(search_vector=query)
+        if params.get('genres'):
+            games = games.filter(genres__contains=params['genres'])
+        if 'released_after' in params:
+            games = games.filter(release_date__gte=datetime.combine(params['released_after'], time.min, tzinfo=dt_timezone.utc))
+        if 'released_before' in params:
+            games = games.filter(release_date__lte=datetime.combine(params['released_before'], time.max, tzinfo=dt_timezone.utc))
+        if 'min_score' in params:
+            games = games.filter(stats__average_score__gte=params['min_score'])
+        return games.annotate(
+            rank=SearchRank(F('search_vector'), query),
+            name_highlight=SearchHeadline('name', query, highlight_all=True, **self.highlight),
+            description_highlight=SearchHeadline('description', query, max_fragments=2, **self.highlight),
+        ).order_by('-rank', 'id')
+
+    def search_reviews(self, query, params):
+        reviews = Review.objects.select_related('user').filter(search_vector=query)
+        if params.get('genres'):
+            reviews = reviews.filter(game__genres__contains=params['genres'])
+        if 'released_after' in params:
+            reviews = reviews.filter(game__release_date__gte=datetime.combine(params['released_after'], time.min, tzinfo=dt_timezone.utc))
+        if 'released_before' in params:
+            reviews = reviews.filter(game__release_date__lte=datetime.combine(params['released_before'], time.max, tzinfo=dt_timezone.utc))
+        if 'min_score' in params:
+            reviews = reviews.filter(score__gte=params['min_score'])
+        return reviews.annotate(
+            rank=SearchRank(F('search_vector'), query),
+            review_highlight=SearchHeadline('review', query, max_fragments=2, **self.highlight),
+        ).order_by('-rank', 'id')
+
+
+# EXPORT
+class ExportView(APIView): # /export/reviews.csv?game=1&since=2023-01-01, streamed off a server-side cursor, see exports.py
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, kind, extension):
+        if kind not in EXPORTS or extension not in FORMATS:
+            raise NotFound(f'Exports are {", ".join(EXPORTS)} as {" or ".join(FORMATS)}')
+        params = ExportParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        chunks = stream_export(kind, extension, **params.validated_data)
+        if isinstance(request._request, ASGIRequest): # see exports.async_chunks
+            chunks = async_chunks(chunks)
+        response = StreamingHttpResponse(chunks, content_type=FORMATS[extension])
+        response['Content-Disposition'] = f'attachment; filename="{kind}.{extension}"'
+        return response
+
+
+# DATABASE POOL
+class DatabasePoolStatsView(APIView): # this worker's pool counters (main_app/db_pool), for whatever scrapes it
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response({'pid': os.getpid(), 'pools': get_all_stats()})
+
+
 # CSRF EXPOSURE
 def csrf_token_view(request):
     csrf_token = get_token(request)